@@ -1,8 +1,29 @@
-from llm_benchmarker.manager import BenchManager
-from llm_benchmarker.evals import FarsiBench, MMLUBench
+"""The public names are imported on first access (PEP 562), so ``import llm_benchmarker`` stays cheap for the short
+lived worker processes and the tools that only need a submodule."""
+import importlib
 
 __all__ = [
     "BenchManager",
     "FarsiBench",
     "MMLUBench",
-]
\ No newline at end of file
+    "ServingBench",
+]
+
+_LAZY_ATTRS = {
+    "BenchManager": "llm_benchmarker.manager",
+    "FarsiBench": "llm_benchmarker.evals",
+    "MMLUBench": "llm_benchmarker.evals",
+    "ServingBench": "llm_benchmarker.evals",
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
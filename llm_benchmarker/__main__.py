@@ -0,0 +1,119 @@
+"""Command line of the benchmarker.
+
+    python -m llm_benchmarker publish --queue /shared/run.sqlite --conf my_models:conf --shard-size 500
+    python -m llm_benchmarker worker --queue /shared/run.sqlite --conf my_models:conf
+    python -m llm_benchmarker collect --queue /shared/run.sqlite --conf my_models:conf
+    python -m llm_benchmarker perf --baseline perf.json --threshold 0.2
+
+``--conf`` is ``module:attribute`` of the ``benchmark_model_conf`` of ``BenchManager`` (or a function without arguments
+that gives it). the module must be importable on every host."""
+import sys
+import json
+import argparse
+import importlib
+
+from typing import Any, Optional
+
+
+def _load_conf(spec: str) -> dict:
+    module_name, _, attribute = spec.partition(":")
+    if not module_name or not attribute:
+        raise argparse.ArgumentTypeError(f"--conf must be module:attribute, not {spec}")
+    conf = getattr(importlib.import_module(module_name), attribute)
+    return conf() if callable(conf) else conf
+
+
+def _to_json(obj: Any) -> Any:
+    return obj.item() if hasattr(obj, "item") else repr(obj)
+
+
+def _sampling(args: argparse.Namespace):
+    if args.sample_fraction is None:
+        return None
+    from llm_benchmarker.sampling import SamplingConfig
+
+    return SamplingConfig(fraction=args.sample_fraction, seed=args.seed)
+
+
+def _add_queue_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--queue", required=True, help="path of the SQLite file of the work queue")
+    parser.add_argument("--conf", required=True, help="module:attribute of the benchmark model configuration")
+    parser.add_argument("--stale-after", type=float, default=600.0,
+                        help="seconds without a heartbeat after that a shard is given to another worker")
+    parser.add_argument("--sample-fraction", type=float, default=None,
+                        help="run a stratified sample of the datasets, the same on all commands")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sample")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m llm_benchmarker", description="Benchmark LLMs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    publish = commands.add_parser("publish", help="publish the datasets as shards into a work queue")
+    _add_queue_arguments(publish)
+    publish.add_argument("--shard-size", type=int, default=500, help="number of samples per shard")
+
+    worker = commands.add_parser("worker", help="run the shards of a work queue")
+    _add_queue_arguments(worker)
+    worker.add_argument("--worker-id", default=None, help="name of the worker, host name and pid by default")
+    worker.add_argument("--poll-interval", type=float, default=5.0, help="seconds between the checks of the queue")
+    worker.add_argument("--max-shards", type=int, default=None, help="stop after this many shards")
+    worker.add_argument("--no-wait", action="store_true", help="stop when there is no free shard")
+
+    collect = commands.add_parser("collect", help="merge the results of the shards and print them as json")
+    _add_queue_arguments(collect)
+    collect.add_argument("--timeout", type=float, default=None, help="max seconds to wait for the shards")
+    collect.add_argument("--poll-interval", type=float, default=5.0, help="seconds between the checks of the queue")
+
+    perf = commands.add_parser("perf", help="measure the overhead of the benchmarker with a mock model")
+    perf.add_argument("--samples", type=int, default=2000, help="number of samples of each fixture dataset")
+    perf.add_argument("--repeats", type=int, default=5, help="number of measured runs of each stage")
+    perf.add_argument("--stage", action="append", dest="stages", default=None,
+                      help="run only this stage, can be repeated (all stages by default)")
+    perf.add_argument("--output", default=None, help="write the report into this json file")
+    perf.add_argument("--baseline", default=None, help="compare the report with this report")
+    perf.add_argument("--threshold", type=float, default=0.2,
+                      help="allowed relative loss of throughput and growth of peak memory against the baseline")
+    return parser
+
+
+def _perf(args: argparse.Namespace) -> int:
+    from llm_benchmarker import perf
+
+    report = perf.run_suite(samples=args.samples, repeats=args.repeats, stages=args.stages)
+    if args.output is not None:
+        perf.save_report(report, args.output)
+    regressions = []
+    if args.baseline is not None:
+        regressions = perf.compare(report, perf.load_report(args.baseline), threshold=args.threshold)
+    print(json.dumps({"stages": report["stages"], "regressions": [r._asdict() for r in regressions]}, indent=2))
+    return 1 if regressions else 0
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "perf":
+        return _perf(args)
+    from llm_benchmarker.manager import BenchManager
+    from llm_benchmarker.workqueue import WorkQueue
+
+    manager = BenchManager(_load_conf(args.conf))
+    queue = WorkQueue(args.queue, stale_after=args.stale_after)
+    try:
+        if args.command == "publish":
+            print(json.dumps(manager.publish(queue, shard_size=args.shard_size, sampling=_sampling(args))))
+        elif args.command == "worker":
+            completed = manager.work(queue, worker_id=args.worker_id, poll_interval=args.poll_interval,
+                                     max_shards=args.max_shards, wait=not args.no_wait, sampling=_sampling(args))
+            print(json.dumps({"completed_shards": completed}))
+        elif args.command == "collect":
+            results = manager.collect(queue, poll_interval=args.poll_interval, timeout=args.timeout,
+                                      sampling=_sampling(args))
+            print(json.dumps(results, ensure_ascii=False, default=_to_json))
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""This module decides how many prompts are sent to the ``gen_func`` of a model at once."""
+import os
+import re
+import json
+import pathlib
+import threading
+
+from typing import Union, Optional
+from loguru import logger
+
+
+_OOM_PATTERN = re.compile(r"out of memory|outofmemory|\boom\b|resource.?exhausted", re.IGNORECASE)
+
+
+def is_oom_error(error: BaseException) -> bool:
+    """Check whether an exception raised by ``gen_func`` looks like an Out-Of-Memory error. Serving stacks report
+    it in different ways (``MemoryError``, ``torch.cuda.OutOfMemoryError``, an HTTP error with "out of memory" in its
+    message, ...), so both the type name and the message are checked."""
+    if isinstance(error, MemoryError):
+        return True
+    return bool(_OOM_PATTERN.search(type(error).__name__) or _OOM_PATTERN.search(str(error)))
+
+
+class AdaptiveBatchSizer:
+    """Find a good batch size while the batches are running.
+
+    The size starts from ``initial`` and is multiplied by ``growth_factor`` after every successful batch as long as
+    the latency per item keeps improving. When the latency per item gets worse the best seen size is kept. After an OOM
+    error the size is bisected between the largest size that succeeded and the smallest one that failed, so the
+    number of OOMs is about the log2 of that range, and the sizer settles when they meet. It never goes below a size
+    that succeeded and never tries a size that failed again.
+    The chosen size can be saved into a json file per key (benchmark name) and is used as the initial size of the
+    next runs."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, initial: int = 50, min_size: int = 1, max_size: int = 4096, growth_factor: float = 2.0,
+                 tolerance: float = 0.05):
+        """
+        :param initial: the size of the first batch.
+        :param min_size: the size never goes below this.
+        :param max_size: the size never goes above this.
+        :param growth_factor: the size is multiplied by this after a successful and faster batch.
+        :param tolerance: relative slowdown of the latency per item that is still counted as an improvement."""
+        if not 1 <= min_size <= max_size:
+            raise ValueError(f"Invalid batch size bounds: min_size={min_size}, max_size={max_size}")
+        if growth_factor <= 1:
+            raise ValueError(f"growth_factor must be bigger than 1, not {growth_factor}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.growth_factor = growth_factor
+        self.tolerance = tolerance
+        self.size = self._clip(initial)
+        self._ceiling = max_size
+        self._largest_succeeded = 0  # the largest batch that succeeded
+        self._smallest_failed: Optional[int] = None  # the smallest batch that failed with an OOM
+        self._best_size = self.size
+        self._best_latency: Optional[float] = None
+        self._settled = False
+
+    def _clip(self, size: int) -> int:
+        return max(self.min_size, min(int(size), self.max_size))
+
+    def _bisect(self) -> Optional[int]:
+        """The size between the largest success and the smallest failure, ``None`` if they have met."""
+        if self._smallest_failed - self._largest_succeeded <= 1:
+            return None
+        return self._clip((self._largest_succeeded + self._smallest_failed) // 2)
+
+    def succeeded(self, batch_len: int, elapsed: float):
+        """Report a successful batch.
+        :param batch_len: number of prompts in the batch.
+        :param elapsed: seconds that the batch took."""
+        self._largest_succeeded = max(self._largest_succeeded, batch_len)
+        if batch_len < self.size or self._settled:
+            # a partial batch (end of data or a bisected batch) says nothing about the latency of the current size
+            return
+        latency = elapsed / batch_len
+        if self._best_latency is None or latency <= self._best_latency * (1 + self.tolerance):
+            if self._best_latency is None or latency < self._best_latency:
+                self._best_latency = latency
+            self._best_size = self.size
+            if self._smallest_failed is None:
+                grown = self._clip(min(self.size * self.growth_factor, self._ceiling))
+            else:
+                grown = self._bisect()
+                if grown is None or grown <= self.size:
+                    logger.debug(f"Batch size settled on {self.size}, {self._smallest_failed} runs out of memory")
+                    self._settled = True
+                    return
+            if grown > self.size:
+                logger.debug(f"Batch size grows from {self.size} to {grown}")
+            self.size = grown
+        else:
+            logger.debug(f"Latency per item got worse with batch size {self.size}, settled on {self._best_size}")
+            self.size = self._best_size
+            self._settled = True
+
+    def failed(self, batch_len: int):
+        """Report a batch that failed with an OOM error.
+        :param batch_len: number of prompts in the failed batch."""
+        if self._smallest_failed is None or batch_len < self._smallest_failed:
+            self._smallest_failed = batch_len
+        # a size that succeeded before can fail later (e.g. longer prompts), then it's not known to be good anymore
+        self._largest_succeeded = min(self._largest_succeeded, batch_len - 1)
+        self._ceiling = max(self.min_size, self._smallest_failed - 1)
+        size = self._bisect() if self._largest_succeeded else None
+        if size is None:
+            size = self._largest_succeeded or batch_len // 2
+        self.size = self._clip(min(size, self._ceiling))
+        self._best_size = min(self._best_size, self._ceiling)
+        if self._largest_succeeded and self.size == self._largest_succeeded:
+            self._settled = True
+            self._best_size = self.size
+        logger.debug(f"OOM with a batch of {batch_len} prompts, batch size is now {self.size}")
+
+    @classmethod
+    def load(cls, key: str, store_path: Union[str, pathlib.Path, None], initial: int = 50,
+             **kwargs) -> "AdaptiveBatchSizer":
+        """Create a sizer for ``key`` that starts from the size saved in ``store_path`` if there is one.
+        :param key: the name of the benchmark.
+        :param store_path: path to the json file of the saved sizes.
+        :param initial: the initial size if nothing saved for ``key``."""
+        saved = cls._read_store(store_path).get(key)
+        return cls(initial=saved if saved is not None else initial, **kwargs)
+
+    def save(self, key: str, store_path: Union[str, pathlib.Path, None]):
+        """Save the chosen size of ``key`` into ``store_path``."""
+        if store_path is None:
+            return
+        with self._lock:
+            store = self._read_store(store_path)
+            store[key] = self._best_size if self._settled else min(self.size, self._ceiling)
+            os.makedirs(pathlib.Path(store_path).parent, exist_ok=True)
+            tmp_path = f"{store_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(store, f, indent=2)
+            os.replace(tmp_path, store_path)
+
+    @staticmethod
+    def _read_store(store_path: Union[str, pathlib.Path, None]) -> dict:
+        if store_path is None or not os.path.exists(store_path):
+            return {}
+        try:
+            with open(store_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Can't read the saved batch sizes from {store_path}: {e}")
+            return {}
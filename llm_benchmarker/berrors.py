@@ -21,4 +21,9 @@ class InvalidPredictionsForBenchmarkError(Exception):
 
 class MetricCalculationError(Exception):
     def __init__(self, *args, **kwargs):
-        super().__init__(*args)
\ No newline at end of file
+        super().__init__(*args)
+
+
+class IncompleteDownloadError(Exception):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
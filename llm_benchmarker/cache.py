@@ -0,0 +1,132 @@
+"""An on-disk cache of the model predictions. With this, re-running a benchmark after changing a metric doesn't need
+to run the model again."""
+import os
+import json
+import time
+import pathlib
+import sqlite3
+import hashlib
+import threading
+
+from typing import Any, Union, Optional, Iterable, Tuple
+from loguru import logger
+
+from llm_benchmarker.config import PREDICTION_CACHE_PATH
+
+
+class PredictionCache:
+    """A content-addressed cache of predictions in a SQLite file.
+
+    The key of a prediction is the hash of the model identifier, the generation settings and the formatted prompt
+    (the output of ``prompt_formatter_func`` for that prompt). So a new model, new generation settings or a new
+    prompt template never hit the old predictions. When the cache is bigger than ``max_entries`` (or
+    ``max_bytes``), the least recently used predictions are evicted."""
+
+    def __init__(self, model_id: str, path: Union[str, pathlib.Path] = PREDICTION_CACHE_PATH,
+                 generation_settings: Optional[dict[str, Any]] = None, max_entries: Optional[int] = 1_000_000,
+                 max_bytes: Optional[int] = None):
+        """
+        :param model_id: an identifier of the model, e.g. name and revision of the checkpoint.
+        :param path: path of the SQLite file. many models can share one file.
+        :param generation_settings: the settings that change the output of the model, like temperature or
+            max_new_tokens. they are part of the key.
+        :param max_entries: max number of predictions in the file (for all models). ``None`` is unlimited.
+        :param max_bytes: max total size of the predictions (utf-8 bytes) in the file. ``None`` is unlimited."""
+        self.model_id = model_id
+        self.path = pathlib.Path(path)
+        self.generation_settings = generation_settings or {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._prefix = json.dumps([model_id, self.generation_settings], sort_keys=True, ensure_ascii=False,
+                                  default=repr)
+        self._lock = threading.Lock()
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, model_id TEXT NOT NULL, prediction TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions(last_access)")
+
+    def key(self, formatted_prompt: Any) -> str:
+        """Give the cache key of a formatted prompt.
+        :param formatted_prompt: anything that ``prompt_formatter_func`` returns for one prompt. it's serialized
+            with ``json`` (``repr`` for the unknown types)."""
+        content = json.dumps(formatted_prompt, sort_keys=True, ensure_ascii=False, default=repr)
+        return hashlib.sha256(f"{self._prefix}\n{content}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """Give the cached predictions of ``keys``, missed keys are not in the output."""
+        hits = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # sqlite has a limit on the number of variables in one query
+            for start_ix in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start_ix:start_ix + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, prediction FROM predictions WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                hits.update(rows)
+            if hits:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany("UPDATE predictions SET last_access = ? WHERE key = ?",
+                                           [(now, k) for k in hits])
+        return hits
+
+    def put_many(self, items: Iterable[Tuple[str, str]]):
+        """Write the ``(key, prediction)`` pairs into the cache and evict old predictions if it's needed."""
+        now = time.time()
+        rows = [(k, self.model_id, prediction, len(prediction.encode("utf-8")), now)
+                for k, prediction in items if isinstance(prediction, str)]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO predictions (key, model_id, prediction, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used predictions until the limits are respected."""
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            if count > self.max_entries:
+                logger.debug(f"Prediction cache has {count} entries, evicting {count - self.max_entries}")
+                self._conn.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY last_access ASC, rowid ASC LIMIT ?)", (count - self.max_entries,)
+                )
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+            if total > self.max_bytes:
+                to_free = total - self.max_bytes
+                freed = 0
+                stale_keys = []
+                for k, size in self._conn.execute("SELECT key, size FROM predictions ORDER BY last_access ASC, rowid ASC"):
+                    if freed >= to_free:
+                        break
+                    stale_keys.append((k,))
+                    freed += size
+                logger.debug(f"Prediction cache is {total} bytes, evicting {len(stale_keys)} entries")
+                self._conn.executemany("DELETE FROM predictions WHERE key = ?", stale_keys)
+
+    def clear(self, all_models: bool = False):
+        """Remove the predictions of this model (or of all models) from the cache."""
+        with self._lock, self._conn:
+            if all_models:
+                self._conn.execute("DELETE FROM predictions")
+            else:
+                self._conn.execute("DELETE FROM predictions WHERE model_id = ?", (self.model_id,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM predictions WHERE model_id = ?",
+                                      (self.model_id,)).fetchone()[0]
+
+    def close(self):
+        self._conn.close()
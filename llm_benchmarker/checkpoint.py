@@ -0,0 +1,104 @@
+"""Checkpoints of the predictions of a benchmark run. With them a run that died in the middle continues from the last
+completed batch instead of starting over."""
+import os
+import json
+import pathlib
+import hashlib
+import threading
+from collections.abc import Sequence
+
+from typing import Any, Union, Optional
+from loguru import logger
+
+
+def _to_json(obj: Any) -> Any:
+    """``json`` fallback for the list-like objects (e.g. a dataset loaded from the cache) and unknown types."""
+    if isinstance(obj, Sequence) and not isinstance(obj, (str, bytes)):
+        return list(obj)
+    return repr(obj)
+
+
+class Checkpoint:
+    """An append-only JSON lines file of the generated predictions of one benchmark.
+
+    The first line is a header with the fingerprint of the run (system prompt, formatted prompts and targets) and
+    every next line holds the indices and the predictions of one completed batch. Lines are flushed to disk right
+    after each batch, so at most the batches that were in flight are lost."""
+
+    def __init__(self, path: Union[str, pathlib.Path], fingerprint: str):
+        """
+        :param path: path of the checkpoint file.
+        :param fingerprint: fingerprint of the run, see ``Checkpoint.make_fingerprint``."""
+        self.path = pathlib.Path(path)
+        self.fingerprint = fingerprint
+        self.known_predictions: dict[int, str] = {}  # predictions that were in the file when it was opened
+        self._file = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_fingerprint(system_prompt: str, formatted_prompts: Any, targets: Any) -> str:
+        """Hash of everything that changes the predictions or their meaning in a run."""
+        content = json.dumps([system_prompt, formatted_prompts, targets], sort_keys=True, ensure_ascii=False,
+                             default=_to_json)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def open(self, resume: bool = False) -> dict[int, str]:
+        """Open the checkpoint for writing.
+        :param resume: if ``True`` and the file belongs to the same run (same fingerprint), its predictions are kept
+            and returned. otherwise the file starts over.
+        :returns: a dictionary of the already generated predictions by their index"""
+        predictions = self._read() if resume else None
+        os.makedirs(self.path.parent, exist_ok=True)
+        if predictions is None:
+            predictions = {}
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._write_line({"fingerprint": self.fingerprint})
+        else:
+            logger.info(f"Resuming from {self.path} with {len(predictions)} predictions")
+            self._file = open(self.path, "a", encoding="utf-8")
+        self.known_predictions = predictions
+        return predictions
+
+    def _read(self) -> Optional[dict[int, str]]:
+        """Read the predictions of the checkpoint file, ``None`` if there is no valid checkpoint of this run."""
+        if not self.path.exists():
+            return None
+        predictions = {}
+        with open(self.path, "rb") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = {}
+            if header.get("fingerprint") != self.fingerprint:
+                logger.warning(f"Checkpoint {self.path} belongs to another dataset or prompt format, starting over.")
+                return None
+            valid_size = f.tell()
+            for line in iter(f.readline, b""):
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete line")
+                    batch = json.loads(line)
+                except ValueError:
+                    # the last line was cut in the middle of a write
+                    break
+                predictions.update(zip(batch["ix"], batch["out"]))
+                valid_size = f.tell()
+        # drop a half written line, so new lines are appended after a valid one
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_size)
+        return predictions
+
+    def write(self, batch_ix: list[int], outputs: list[str]):
+        """Append a completed batch to the checkpoint."""
+        self._write_line({"ix": list(batch_ix), "out": list(outputs)})
+
+    def _write_line(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -11,14 +11,15 @@ from pathlib import Path
 from llm_benchmarker.utils import load_from_github,\
         load_from_hf,\
         load_from_no_where,\
-        load_file_from_web,\
-        list_mkdires_if_not_exists
+        load_file_from_web
 
 
 """Directories in the project"""
 DATASET_DIR_NAME = "data"
 BASE_PATH = Path(__file__).parent  # path to the benchmarker directory.
 DATA_DIR_PATH = BASE_PATH / DATASET_DIR_NAME  # path to the benchmarker/data directory.
+CACHE_DIR_PATH = Path(os.environ.get("LLM_BENCHMARKER_CACHE_DIR", BASE_PATH / ".cache"))  # state kept between runs.
+DATASET_CACHE_DIR_PATH = CACHE_DIR_PATH / "datasets"  # preprocessed outputs of the slot functions.
 
 """Keys for Dataset providers. For now we support Huggingface and Github(one file for now)"""
 BACKEND_GITHUB = "URL"
@@ -74,12 +75,8 @@ BENCH_CATEGORY_DATASET_LOCAL_DIR = {
     BENCH_CATEGORY_AGENTIC: DATA_DIR_PATH / BENCH_CATEGORY_AGENTIC,
 }
 
-
-# for dir in BENCH_CATEGORY_DATASET_LOCAL_DIR.values():
-#     if not os.path.exists(dir):
-#         os.makedirs(dir)
-
-list_mkdires_if_not_exists(BENCH_CATEGORY_DATASET_LOCAL_DIR.values())
+# the directories are created when a dataset is downloaded into them (``BenchDatasetLoader._extract_info``), importing
+# the package never touches the filesystem.
 
 
 """These are the names of the Benchmarks. these are the shared key between dataset loaders, benchmarks and slot functions"""
@@ -89,7 +86,8 @@ BENCHMARK_NAME_MOLECULENET = "MoleculeNet"
 
 
 
-"""datasets used for each benchmark. they are going to be downloaded in the first place"""
+"""datasets used for each benchmark. they are going to be downloaded in the first place. an optional ``"sha256"`` is the
+hex digest of a downloaded file, a file with another checksum is removed and the download fails."""
 DATASETS_PER_BENCH = {
     BENCHMARK_NAME_PERSIAN_QA: {
         "backend": BACKEND_GITHUB,
@@ -125,6 +123,8 @@ class BenchmarkConfig:
     category: str
     path: str
     local_dir: Union[str, Path]
+    download_kwargs: dict = dataclasses.field(default_factory=dict)
+    sha256: Optional[str] = None
 
 
 class BenchmarkConfigManager:
@@ -163,5 +163,16 @@ SLOT_DIR_PATH = [
 
 GENERATOR_FUNC_KEY = "gen_func"
 CHAT_TEMPLATE_FUNC = "prompt_formatter_func"
+MAX_CONCURRENCY_KEY = "max_concurrency"  # optional, number of in-flight batches for an ``async`` gen_func
+BATCH_SIZE_KEY = "batch_size"  # optional, (initial) number of prompts per call of gen_func
+ADAPTIVE_BATCH_SIZE_KEY = "adaptive_batch_size"  # optional, grow/shrink the batch size while running
+SORT_BY_LENGTH_KEY = "sort_by_length"  # optional, batch prompts with similar lengths together
+LENGTH_FUNC_KEY = "length_func"  # optional, length of a prompt (e.g. tokens), default is number of characters
+MAX_BATCH_TOKENS_KEY = "max_batch_tokens"  # optional, budget of padded tokens per batch
+
+DEFAULT_BATCH_SIZE = 50
+BATCH_SIZE_STORE_PATH = CACHE_DIR_PATH / "batch_sizes.json"  # batch sizes chosen by the adaptive batching
+PREDICTION_CACHE_KEY = "prediction_cache"  # optional, a ``llm_benchmarker.cache.PredictionCache``
+PREDICTION_CACHE_PATH = CACHE_DIR_PATH / "predictions.sqlite"
 
 
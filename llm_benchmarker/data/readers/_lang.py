@@ -3,8 +3,6 @@ from llm_benchmarker.config import BENCHMARK_NAME_MMLU
 
 from llm_benchmarker.data.readers.prompts import SYS_PROMPT_MMLU, USR_PROMPT_MMLU
 
-from datasets import load_from_disk
-
 
 def format_mmlu_prompt(sample):
     q = sample["question"]
@@ -14,13 +12,17 @@ def format_mmlu_prompt(sample):
     return text, answer
 
 
+def _iter_mmlu_samples(test_split):
+    """the subject of each question is its group, so the accuracy per subject is reported too"""
+    for sample in test_split:
+        prompt, answer = format_mmlu_prompt(sample)
+        yield prompt, [answer], sample["subject"]
+
+
 @slot(BENCHMARK_NAME_MMLU)
 def MMLU_load_from_disk(dataset_path: str):
+    """samples are formatted lazily, the arrow files of the dataset are memory-mapped by ``datasets``"""
+    from datasets import load_from_disk
+
     results = load_from_disk(dataset_path)
-    prompt_out = []
-    answer_out = []
-    for sample in results["test"]:
-        prompt, answer = format_mmlu_prompt(sample)
-        prompt_out.append(prompt)
-        answer_out.append([answer])
-    return SYS_PROMPT_MMLU, prompt_out, answer_out
+    return SYS_PROMPT_MMLU, _iter_mmlu_samples(results["test"])
@@ -41,16 +41,21 @@ def _read_qa(path):
 
 
 @slot(BENCHMARK_NAME_PERSIAN_QA)
-def persian_qa_dataset_loader(dataset_path: str):
+def persian_qa_dataset_loader(dataset_path: str, include_unanswerable: bool = False):
+    """
+    :param include_unanswerable: keep the questions without answer (SQuAD 2.0) with an empty target, so only an empty
+        prediction matches them. they are skipped by default, the scores are over the answerable questions.
+    """
     logger.debug(f"Loading the {BENCHMARK_NAME_PERSIAN_QA} dataset...")
     dataset = _c2dict(_read_qa(dataset_path))
     questions, contexts, answers = dataset['question'], dataset['context'], dataset['answers']
     prompt_out = []
     answers_out = []
     for qst, ctx, ans in zip(questions, contexts, answers):
-        if qst == '' or ctx == '' or ans == '':
+        ans = list(ans['text'])
+        if qst == '' or ctx == '' or (not ans and not include_unanswerable):
             continue
         prompt_out.append(prompts.USR_PROMPT_PERSIAN_QA.format(ctx, qst))
-        answers_out.append(ans)
+        answers_out.append(ans or [''])
     logger.debug(f"Dataset {BENCHMARK_NAME_PERSIAN_QA} is loaded.")
     return prompts.SYS_PROMPT_PERSIAN_QA, prompt_out, answers_out
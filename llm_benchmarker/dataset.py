@@ -1,14 +1,211 @@
 import os
+import glob
+import json
+import time
+import inspect
+import hashlib
 from pathlib import Path
+from collections.abc import Sequence
 
-from typing import Union, Type, Callable, Any, Tuple
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Type, Callable, Any, Tuple, Optional, Iterable, Iterator, NamedTuple
 from loguru import logger
 
 from llm_benchmarker.events.decorators import signal
-from llm_benchmarker.config import LOAD_TYPE_LOCALLY, LOAD_TYPE_HUB
+from llm_benchmarker.events.handlers import EventHandler
+from llm_benchmarker.config import LOAD_TYPE_LOCALLY, LOAD_TYPE_HUB, DATASET_CACHE_DIR_PATH
 from llm_benchmarker.utils import backend2func,\
       get_benchmark_config as bench2dataset,\
-      mkdires_if_not_exists
+      mkdires_if_not_exists,\
+      file_sha256,\
+      DOWNLOAD_CHUNK_SIZE
+
+
+class SlotOutput(NamedTuple):
+    """The materialized output of a slot function"""
+    system_prompt: str
+    prompts: Sequence
+    targets: Sequence
+    groups: Optional[Sequence] = None  # a key per sample (e.g. the subject of a MMLU question), if the slot gives it
+
+
+def is_streaming_output(output: tuple) -> bool:
+    """A slot function can return ``(system_prompt, prompts, targets)``, ``(system_prompt, prompts, targets, groups)``
+    where ``groups`` is a key per sample (e.g. the subject of the question), or for streaming
+    ``(system_prompt, samples)`` where ``samples`` is an iterable (e.g. a generator) of ``(prompt, target)`` or
+    ``(prompt, target, group)`` tuples."""
+    return len(output) == 2
+
+
+def materialize_slot_output(output: tuple) -> SlotOutput:
+    """Give the ``SlotOutput`` form of a slot output."""
+    if not is_streaming_output(output):
+        return SlotOutput(*output)
+    system_prompt, samples = output
+    prompts, targets, groups = [], [], []
+    for sample in samples:
+        prompts.append(sample[0])
+        targets.append(sample[1])
+        if len(sample) > 2:
+            groups.append(sample[2])
+    return SlotOutput(system_prompt, prompts, targets, groups if groups else None)
+
+
+def iter_slot_samples(output: tuple) -> Tuple[str, Iterator[tuple]]:
+    """Give the ``(system_prompt, samples)`` form of a slot output, ``samples`` is an iterator of
+    ``(prompt, target)`` or ``(prompt, target, group)`` tuples."""
+    if is_streaming_output(output):
+        system_prompt, samples = output
+        return system_prompt, iter(samples)
+    output = SlotOutput(*output)
+    if output.groups is None:
+        return output.system_prompt, zip(output.prompts, output.targets)
+    return output.system_prompt, zip(output.prompts, output.targets, output.groups)
+
+
+def chunked(samples: Iterable, chunk_size: int) -> Iterator[list]:
+    """Split an iterable into lists of at most ``chunk_size`` items without reading it ahead."""
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+    samples = iter(samples)
+    while True:
+        chunk = list(islice(samples, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ArrowColumnSequence(Sequence):
+    """A read-only list-like view over a column of a (memory-mapped) arrow table. items are converted to python
+    objects only when they are accessed, so the column is never copied into memory as a whole."""
+
+    _ITER_CHUNK_SIZE = 1024
+
+    def __init__(self, column):
+        self._column = column
+
+    def __len__(self) -> int:
+        return len(self._column)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                return self._column.slice(start, max(0, stop - start)).to_pylist()
+            return [self._column[ix].as_py() for ix in range(start, stop, step)]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("ArrowColumnSequence index out of range")
+        return self._column[item].as_py()
+
+    def __iter__(self):
+        for start_ix in range(0, len(self), self._ITER_CHUNK_SIZE):
+            yield from self._column.slice(start_ix, self._ITER_CHUNK_SIZE).to_pylist()
+
+
+class SlotOutputCache:
+    """Cache of the ``SlotOutput`` of the slot functions in arrow IPC files.
+
+    A cache file is keyed by the fingerprint of the dataset files (path, size and modification time), the source
+    code of the slot module and the prompt templates. So changing the dataset, the reader or a template makes a new
+    cache file. Warm loads memory-map the file and don't parse the raw dataset at all."""
+
+    def __init__(self, cache_dir: Union[str, Path] = DATASET_CACHE_DIR_PATH):
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def _files_fingerprint(dataset_path: Union[str, Path]) -> list:
+        """``(relative path, size, modification time)`` of the dataset file or of all files in the dataset dir."""
+        dataset_path = Path(dataset_path)
+        if dataset_path.is_file():
+            stat = dataset_path.stat()
+            return [[dataset_path.name, stat.st_size, stat.st_mtime_ns]]
+        files = []
+        for root, _, file_names in os.walk(dataset_path):
+            for file_name in sorted(file_names):
+                file_path = Path(root) / file_name
+                stat = file_path.stat()
+                files.append([str(file_path.relative_to(dataset_path)), stat.st_size, stat.st_mtime_ns])
+        return sorted(files)
+
+    @staticmethod
+    def _source_fingerprint(slot_fns: list[Callable]) -> list:
+        """Source code of the modules of the slot functions and of the prompt templates module."""
+        from llm_benchmarker.data.readers import prompts
+        sources = []
+        for source_file in [*[inspect.unwrap(fn).__code__.co_filename for fn in slot_fns], prompts.__file__]:
+            try:
+                sources.append(Path(source_file).read_text(encoding="utf-8"))
+            except OSError:
+                # source is not available (e.g. a slot defined in an interactive session), its name is the best key
+                sources.append(source_file)
+        return sources + [f"{fn.__module__}.{fn.__qualname__}" for fn in slot_fns]
+
+    def fingerprint(self, shared_key: str, dataset_path: Union[str, Path], slot_fns: list[Callable]) -> str:
+        """Give the key of the cache file of a dataset."""
+        content = json.dumps([shared_key, self._files_fingerprint(dataset_path), self._source_fingerprint(slot_fns)],
+                             ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, shared_key: str, fingerprint: str) -> Path:
+        return self.cache_dir / f"{shared_key}-{fingerprint[:24]}.arrow"
+
+    def cache_files(self, shared_key: str) -> list[Path]:
+        """The cache files of the dataset of ``shared_key``. the key is compared exactly, the files of the keys that
+        start with it (e.g. ``MMLU-Pro`` for ``MMLU``) are not included."""
+        if not self.cache_dir.is_dir():
+            return []
+        return [path for path in self.cache_dir.glob(f"{glob.escape(shared_key)}-*.arrow")
+                if path.stem.rpartition("-")[0] == shared_key]
+
+    def load(self, shared_key: str, fingerprint: str) -> Optional[SlotOutput]:
+        """Give the cached slot output, ``None`` on a cache miss."""
+        path = self._path(shared_key, fingerprint)
+        if not path.exists():
+            return None
+        import pyarrow as pa
+        try:
+            table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+        except (OSError, pa.ArrowInvalid) as e:
+            logger.warning(f"Invalid dataset cache file {path}: {e}")
+            return None
+        metadata = table.schema.metadata or {}
+        system_prompt = metadata.get(b"system_prompt", b"").decode("utf-8")
+        targets = ArrowColumnSequence(table.column("target"))
+        if metadata.get(b"target_encoding") == b"json":
+            targets = [json.loads(target) for target in targets]
+        groups = ArrowColumnSequence(table.column("group")) if "group" in table.column_names else None
+        logger.debug(f"Dataset {shared_key} is loaded from the cache {path}")
+        return SlotOutput(system_prompt, ArrowColumnSequence(table.column("prompt")), targets, groups)
+
+    def save(self, shared_key: str, fingerprint: str, output: SlotOutput):
+        """Write a slot output into the cache and remove the older cache files of the dataset."""
+        import pyarrow as pa
+        system_prompt, prompts, targets, groups = SlotOutput(*output)
+        metadata = {"system_prompt": system_prompt or ""}
+        try:
+            target_column = pa.array(list(targets))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # targets with mixed types are kept as json strings
+            target_column = pa.array([json.dumps(target, ensure_ascii=False) for target in targets], pa.string())
+            metadata["target_encoding"] = "json"
+        columns = {"prompt": pa.array(list(prompts), pa.string()), "target": target_column}
+        if groups is not None:
+            columns["group"] = pa.array([str(group) for group in groups], pa.string())
+        table = pa.table(columns, metadata=metadata)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(shared_key, fingerprint)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        for old_path in self.cache_files(shared_key):
+            if old_path != path:
+                old_path.unlink(missing_ok=True)
+        logger.debug(f"Dataset {shared_key} is cached in {path}")
 
 
 class BenchDatasetLoader:
@@ -25,15 +222,36 @@ class BenchDatasetLoader:
         self.__dataset__ = __dataset__
         self._local_load_func = local_load_func
 
-    def load_from_disk(self):
-        """load dataset from disk and return it"""
+    def load_from_disk(self, use_cache: bool = True, cache_dir: Union[str, Path] = DATASET_CACHE_DIR_PATH,
+                       stream: bool = False):
+        """load dataset from disk and return it
+        :param use_cache: use the preprocessed output of the slot from ``SlotOutputCache`` if it's still valid, and
+            cache it otherwise.
+        :param cache_dir: directory of the cached slot outputs.
+        :param stream: give the output of the slot as it is, it may be a lazy ``(system_prompt, samples)`` pair
+            (see ``is_streaming_output``). without it, the output is always a ``SlotOutput``."""
         @signal(self.__dataset__)
         def path():
             return self.get_local_path()
-        if self._local_load_func is None:
-            return path()
-        else:
+        if self._local_load_func is not None:
             return self._local_load_func(self.get_local_path())
+        slot_fns = EventHandler().get_slots(self.__dataset__)
+        if stream:
+            return path()
+        if not use_cache or not slot_fns:
+            return {key: materialize_slot_output(output) for key, output in path().items()}
+
+        cache = SlotOutputCache(cache_dir)
+        fingerprint = cache.fingerprint(self.__dataset__, self.get_local_path(), slot_fns)
+        cached = cache.load(self.__dataset__, fingerprint)
+        if cached is not None:
+            return {self.__dataset__: cached}
+        results = {key: materialize_slot_output(output) for key, output in path().items()}
+        try:
+            cache.save(self.__dataset__, fingerprint, results[self.__dataset__])
+        except Exception as e:
+            logger.warning(f"Can't cache the {self.__dataset__} dataset: {e}")
+        return results
 
     def get_local_path(self) -> str:
         """give the local path of the related dataset"""
@@ -57,7 +275,9 @@ class BenchDatasetLoader:
         info = bench2dataset(shared_key)
         load_funcs = backend2func(info.get("backend"))
         downloader = load_funcs.get(LOAD_TYPE_HUB)
-        downloader_kwargs = info.get("download_kwargs", None)
+        downloader_kwargs = dict(info.get("download_kwargs") or {})
+        if info.get("sha256"):
+            downloader_kwargs["sha256"] = info["sha256"]
         hub_path = info.get("path")
         local_path = info.get("local_dir")
         mkdires_if_not_exists(local_path)
@@ -71,9 +291,11 @@ class BenchDatasetLoader:
         return hub_path, local_path, load_funcs, downloader_kwargs
 
     @classmethod
-    def load(cls, shared_key: str):
+    def load(cls, shared_key: str, session=None, progress: Optional[Callable[[int, Optional[int]], None]] = None):
         """By this we create an BenchDatasetLoader instance but with some preprocess
         :param btype: a benchmark type
+        :param session: ``requests.Session`` of the download, see ``utils.get_http_session``.
+        :param progress: called with the downloaded and the total bytes while the dataset is downloaded.
         :returns: an object of BenchDatasetLoader"""
         logger.debug(f"Loading the {shared_key} dataset into disk if it doesn't exists")
         check_dataset = cls._extract_info(shared_key)
@@ -83,8 +305,16 @@ class BenchDatasetLoader:
         dataset_path, destination_path, load_funcs, downloader_kwargs = check_dataset
         self = cls(dataset_path, destination_path, shared_key, load_funcs.get(LOAD_TYPE_LOCALLY))
         self.__dataset__ = shared_key
+        expected_sha256 = downloader_kwargs.get("sha256")
+        # a declared checksum is checked on every load, so a corrupt or replaced dataset file is downloaded again.
+        # dataset directories (e.g. of Huggingface) have no single checksum and are not checked.
+        if expected_sha256 and os.path.isfile(destination_path) and \
+                file_sha256(destination_path) != expected_sha256.lower():
+            logger.warning(f"Checksum of {destination_path} doesn't match {expected_sha256}, downloading it again")
+            os.remove(destination_path)
         if not os.path.exists(destination_path):
-            if not load_funcs.get(LOAD_TYPE_HUB)(dataset_path, destination_path, **downloader_kwargs):
+            if not load_funcs.get(LOAD_TYPE_HUB)(dataset_path, destination_path, session=session, progress=progress,
+                                                 **downloader_kwargs):
                 logger.debug(f"Failed to download dataset from {dataset_path}")
                 raise Exception(f"Failed to download dataset from {dataset_path}")
             else:
@@ -94,14 +324,73 @@ class BenchDatasetLoader:
         return self
 
 
+class DownloadProgress:
+    """Logs the progress of one dataset download and keeps its size, time and throughput."""
+
+    def __init__(self, shared_key: str, log_every: float = 0.1):
+        """
+        :param shared_key: name of the benchmark of the dataset.
+        :param log_every: fraction of the file between two progress logs (every ``1 / log_every`` MiB when the size
+            is unknown)."""
+        self.shared_key = shared_key
+        self.log_every = log_every
+        self.downloaded = 0
+        self.total: Optional[int] = None
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._next_log = 0.0
+
+    def __call__(self, downloaded: int, total: Optional[int]):
+        self.downloaded, self.total = downloaded, total
+        done = downloaded / total if total else downloaded / (DOWNLOAD_CHUNK_SIZE / self.log_every)
+        if done >= self._next_log:
+            self._next_log = done + self.log_every
+            size = f"{downloaded / 2 ** 20:.1f}/{total / 2 ** 20:.1f} MiB" if total else \
+                f"{downloaded / 2 ** 20:.1f} MiB"
+            logger.info(f"Downloading {self.shared_key}: {size} ({self.throughput / 2 ** 20:.2f} MiB/s)")
+
+    @property
+    def throughput(self) -> float:
+        """bytes per second"""
+        elapsed = self.elapsed or time.perf_counter() - self.started
+        return self.downloaded / elapsed if elapsed > 0 else 0.0
+
+    def finish(self) -> dict[str, Any]:
+        self.elapsed = time.perf_counter() - self.started
+        return {"bytes": self.downloaded, "seconds": self.elapsed, "bytes_per_second": self.throughput}
+
+
 class DatasetManager:
 
-    def __init__(self, btypes: list):
-        """Create a list of BenchDatasetLoader and manage it
-        :param btypes: list of benchmark types. like [FarsiBench, ]"""
+    def __init__(self, btypes: list, max_workers: Optional[int] = None):
+        """Create a list of BenchDatasetLoader and manage it. the missing datasets are downloaded concurrently, so a
+        cold start takes about the time of the slowest download.
+        :param btypes: list of benchmark types. like [FarsiBench, ]
+        :param max_workers: number of concurrent downloads, ``None`` is one per benchmark (at most 8) and ``1``
+            downloads them one after another."""
         self._loaders = {}
-        for b in btypes:
-            self._loaders[b.shared_key()] = BenchDatasetLoader.load(b.shared_key())
+        self.download_stats: dict[str, dict[str, Any]] = {}  # size, time and throughput of the downloaded datasets
+        shared_keys = list(dict.fromkeys(b.shared_key() for b in btypes))
+        max_workers = max_workers or min(8, len(shared_keys))
+        if max_workers <= 1 or len(shared_keys) <= 1:
+            for shared_key in shared_keys:
+                self._loaders[shared_key] = self._load(shared_key)
+            return
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dataset-download") as executor:
+            futures = {shared_key: executor.submit(self._load, shared_key) for shared_key in shared_keys}
+        # every download ran to the end (a finished one is kept on disk), then the first failure is raised
+        for shared_key, future in futures.items():
+            self._loaders[shared_key] = future.result()
+
+    def _load(self, shared_key: str) -> "BenchDatasetLoader":
+        progress = DownloadProgress(shared_key)
+        loader = BenchDatasetLoader.load(shared_key, progress=progress)
+        if progress.downloaded:
+            stats = progress.finish()
+            self.download_stats[shared_key] = stats
+            logger.info(f"Downloaded {shared_key}: {stats['bytes'] / 2 ** 20:.1f} MiB in {stats['seconds']:.2f}s "
+                        f"({progress.throughput / 2 ** 20:.2f} MiB/s)")
+        return loader
 
     def get_loaders(self) -> dict[str, BenchDatasetLoader]:
         """Get a dictionary with key benchmark name(__dataset__ shared key) as and BenchDatasetLoader as value"""
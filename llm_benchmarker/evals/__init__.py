@@ -1,9 +1,13 @@
 from .base import BaseBench
 from .multiling import FarsiBench
 from .lang import MMLUBench
+from .serving import ServingBench, FarsiServingBench, MMLUServingBench
 
 __all__ = [
     "FarsiBench",
     "BaseBench",
     "MMLUBench",
+    "ServingBench",
+    "FarsiServingBench",
+    "MMLUServingBench",
 ]
\ No newline at end of file
@@ -1,24 +1,42 @@
 """Benchmark names that are shared between benchmark classes and their information in benchmarker/config.py
 These values are the key communication between benchmarks and they're datasets"""
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import Dict, Any, Tuple, Callable, List
+from typing import Dict, Any, Tuple, Callable, List, Optional
 
 from abc import ABC, abstractmethod
 
 from llm_benchmarker.berrors import LengthMisMatchError, \
     InvalidPredictionsForBenchmarkError, MetricCalculationError
+from llm_benchmarker.evals.metrics import MetricAccumulator, submit_shards, merge_accumulators
+from llm_benchmarker.events import timing
 from loguru import logger
 
 
+def _is_valid_prediction(prediction: Any) -> bool:
+    """A prediction is valid if it's a non-empty string"""
+    return prediction is not None and isinstance(prediction, str) and bool(prediction.strip())
+
+
 class BaseBench(ABC):
     """A base class for All benchmarks that we need to compute"""
 
+    metric_names: Tuple[str, ...] = ()  # metrics of ``llm_benchmarker.evals.registry`` that the benchmark uses
+    # the outputs that are means of per-sample scores and the max of their score, they get a confidence interval in a
+    # sampled run (see ``llm_benchmarker.sampling``). corpus level metrics like BLEU are not means of samples.
+    interval_metrics: Dict[str, float] = {}
+    # a benchmark that sends the prompts to ``gen_func`` itself (e.g. ``ServingBench`` that measures the latency)
+    # implements ``run_generation(model_pipeline, system_prompt, prompts) -> dict`` instead of scoring predictions
+    drives_generation: bool = False
+
     def __init__(self):
         ...
 
     @abstractmethod
     def compute(self, predictions: list[str], targets: list[list[str]]):
-        """This function will calculate the benchmark itself."""
+        """This function will calculate the benchmark itself. If the slot of the benchmark gives a key per sample
+        (``groups``, e.g. the subject of a question), it's passed as the ``groups`` keyword argument too."""
         pass
 
 
@@ -27,6 +45,39 @@ class BaseBench(ABC):
     def shared_key(cls, ) -> str:
         return ""
 
+    def num_scored(self, predictions: list[str]) -> int:
+        """Number of ``predictions`` that ``compute`` scores, the invalid ones are filtered (see
+        ``_validate_inputs``). a benchmark that scores every prediction overrides it."""
+        return sum(map(_is_valid_prediction, predictions))
+
+    def accumulator(self) -> "BenchAccumulator":
+        """Give an accumulator for computing the benchmark chunk by chunk (streaming). Benchmarks can override this
+        with an accumulator that doesn't keep the predictions, by default they are kept and ``compute`` runs at the
+        end."""
+        return BufferedBenchAccumulator(self)
+
+    def compute_parallel(self, predictions: list[str], targets: list[list[str]], num_workers: Optional[int] = None,
+                         groups: Optional[list[str]] = None) -> dict:
+        """Compute the benchmark with a pool of processes. The samples are split in shards, each metric of
+        ``accumulator()`` is updated on every shard in a worker and the partial states are merged exactly (e.g. the
+        corpus BLEU of all samples, not the average BLEU of the shards). The shards of all metrics are in the pool at
+        the same time, so the metrics run concurrently too. Benchmarks without a ``MetricsBenchAccumulator`` run
+        ``compute``.
+        :param num_workers: number of processes, number of the cores if it's ``None``.
+        :param groups: the group of each sample, like ``compute``."""
+        accumulator = self.accumulator()
+        if not isinstance(accumulator, MetricsBenchAccumulator):
+            if groups is None:
+                return self.compute(predictions, targets)
+            return self.compute(predictions, targets, groups=groups)
+        try:
+            if not predictions:
+                raise InvalidPredictionsForBenchmarkError("Prediction list is empty.")
+            accumulator.update(predictions, targets, groups, num_workers=num_workers or os.cpu_count() or 1)
+        except (LengthMisMatchError, InvalidPredictionsForBenchmarkError) as e:
+            return BenchmarkResults(benchmark_name=accumulator.benchmark_name, errors={"validation": str(e)}).to_dict()
+        return accumulator.finalize()
+
 
     def _validate_inputs(
             self,
@@ -45,7 +96,7 @@ class BaseBench(ABC):
         valid_pairs = [
             (pred, targ)
             for pred, targ in zip(predictions, targets)
-            if pred is not None and isinstance(pred, str) and pred.strip()
+            if _is_valid_prediction(pred)
         ]
 
         num_filtered = len(predictions) - len(valid_pairs)
@@ -67,7 +118,8 @@ class BaseBench(ABC):
     ):
         """Safely calculates the metric with error handling"""
         try:
-            result = metric_fn(predictions, targets)
+            with timing.span(timing.SPAN_METRIC, self.benchmark_name, metric=metric_name, prompts=len(predictions)):
+                result = metric_fn(predictions, targets)
             return result, None
         except Exception as e:
             logger.error(f"{metric_name} calculation failed: {e}")
@@ -78,6 +130,165 @@ class BaseBench(ABC):
         return f"{self.__class__.__name__}"
 
 
+class BenchAccumulator(ABC):
+    """Consumes predictions and targets chunk by chunk and gives the results of a benchmark at the end."""
+
+    @abstractmethod
+    def update(self, predictions: list[str], targets: list[list[str]], groups: Optional[list[str]] = None):
+        """Add a chunk of predictions and their targets (and the group of each sample if the slot gives it)."""
+        pass
+
+    @abstractmethod
+    def merge(self, other: "BenchAccumulator") -> "BenchAccumulator":
+        """Add the state of another accumulator of the same benchmark (e.g. of another shard) to this one."""
+        pass
+
+    @abstractmethod
+    def finalize(self) -> dict:
+        """Give the results of the benchmark like ``BaseBench.compute``."""
+        pass
+
+    @property
+    @abstractmethod
+    def num_scored(self) -> int:
+        """Number of the samples that the metrics are computed on, invalid predictions are not scored (see
+        ``BaseBench._validate_inputs``)."""
+        pass
+
+
+class BufferedBenchAccumulator(BenchAccumulator):
+    """Keeps all chunks and runs ``compute`` of the benchmark on them at the end."""
+
+    def __init__(self, bench: BaseBench):
+        self._bench = bench
+        self._predictions = []
+        self._targets = []
+        self._groups = []
+
+    def update(self, predictions: list[str], targets: list[list[str]], groups: Optional[list[str]] = None):
+        self._predictions.extend(predictions)
+        self._targets.extend(targets)
+        if groups is not None:
+            self._groups.extend(groups)
+
+    def __getstate__(self) -> dict:
+        # the benchmark object stays in the process, a merged state only needs the samples
+        return {**self.__dict__, "_bench": None}
+
+    def merge(self, other: "BufferedBenchAccumulator") -> "BufferedBenchAccumulator":
+        self._predictions.extend(other._predictions)
+        self._targets.extend(other._targets)
+        self._groups.extend(other._groups)
+        return self
+
+    @property
+    def num_scored(self) -> int:
+        return self._bench.num_scored(self._predictions)
+
+    def finalize(self) -> dict:
+        if len(self._groups) == len(self._predictions) > 0:
+            return self._bench.compute(self._predictions, self._targets, groups=self._groups)
+        return self._bench.compute(self._predictions, self._targets)
+
+
+class MetricsBenchAccumulator(BenchAccumulator):
+    """Accumulator of a benchmark that is made of metric accumulators (see ``llm_benchmarker.evals.metrics``).
+    Only the states of the metrics are kept. Invalid predictions are filtered like ``BaseBench._validate_inputs``
+    and a failing metric is reported as an error like ``BaseBench._safe_metric_calc``."""
+
+    def __init__(self, benchmark_name: str, metrics: List[Tuple[str, Callable[[], MetricAccumulator]]]):
+        """
+        :param benchmark_name: the name of the benchmark in the results.
+        :param metrics: ``(name, factory)`` pairs, ``factory`` creates an empty metric accumulator."""
+        self.benchmark_name = benchmark_name
+        self._factories = dict(metrics)
+        self.metrics: Dict[str, MetricAccumulator] = {name: factory() for name, factory in metrics}
+        self.errors: Dict[str, str] = {}
+        self.num_valid = 0
+        self.num_filtered = 0
+
+    def update(self, predictions: list[str], targets: list[list[str]], groups: Optional[list[str]] = None,
+               num_workers: int = 1):
+        """
+        :param num_workers: with more than one, the chunk is scored by a pool of this many processes (see
+            ``BaseBench.compute_parallel``). the metric factories must be picklable then, e.g. accumulator classes."""
+        if not len(predictions) == len(targets):
+            raise LengthMisMatchError(f"Length MisMatch")
+        has_groups = groups is not None
+        groups = groups if has_groups else [None] * len(predictions)
+        valid_samples = [(pred, targ, group) for pred, targ, group in zip(predictions, targets, groups)
+                         if _is_valid_prediction(pred)]
+        self.num_filtered += len(predictions) - len(valid_samples)
+        if not valid_samples:
+            return
+        self.num_valid += len(valid_samples)
+        predictions, targets, groups = [list(items) for items in zip(*valid_samples)]
+        groups = groups if has_groups else None
+        if num_workers > 1 and len(predictions) > 1:
+            self._update_in_processes(predictions, targets, groups, num_workers)
+            return
+        for name, metric in self.metrics.items():
+            if name in self.errors:
+                continue
+            try:
+                with timing.span(timing.SPAN_METRIC, self.benchmark_name, metric=name, prompts=len(predictions)):
+                    if metric.accepts_groups and groups is not None:
+                        metric.update(predictions, targets, groups=groups)
+                    else:
+                        metric.update(predictions, targets)
+            except Exception as e:
+                logger.error(f"{name} calculation failed: {e}")
+                self.errors[name] = str(e)
+
+    def _update_in_processes(self, predictions: list[str], targets: list[list[str]], groups: Optional[list[str]],
+                             num_workers: int):
+        """Submit the shards of every metric to one pool, then merge the states of each metric in shard order."""
+        names = [name for name in self.metrics if name not in self.errors]
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {name: submit_shards(executor, self._factories[name], predictions, targets, num_workers, groups)
+                       for name in names}
+            for name in names:
+                try:
+                    self.metrics[name].merge(merge_accumulators([future.result() for future in futures[name]]))
+                except Exception as e:
+                    logger.error(f"{name} calculation failed: {e}")
+                    self.errors[name] = str(e)
+
+    def merge(self, other: "MetricsBenchAccumulator") -> "MetricsBenchAccumulator":
+        for name, metric in self.metrics.items():
+            if name in other.errors:
+                self.errors.setdefault(name, other.errors[name])
+            elif name not in self.errors:
+                metric.merge(other.metrics[name])
+        self.num_valid += other.num_valid
+        self.num_filtered += other.num_filtered
+        return self
+
+    @property
+    def num_scored(self) -> int:
+        return self.num_valid
+
+    def finalize(self) -> dict:
+        if self.num_filtered > 0:
+            logger.warning(f"Filtered {self.num_filtered} invalid predictions")
+        if self.num_valid == 0:
+            return BenchmarkResults(
+                benchmark_name=self.benchmark_name,
+                errors={"validation": "No Valid predictions after validating."}
+            ).to_dict()
+        result = BenchmarkResults(benchmark_name=self.benchmark_name)
+        for name, metric in self.metrics.items():
+            if name in self.errors:
+                result.errors[name] = self.errors[name]
+                continue
+            try:
+                result.metrics.update(metric.finalize())
+            except Exception as e:
+                logger.error(f"{name} calculation failed: {e}")
+                result.errors[name] = str(e)
+        return result.to_dict()
+
+
 @dataclass
 class BenchmarkResults:
     """Structured benchmark results"""
@@ -1,12 +1,19 @@
-from .base import BaseBench, BenchmarkResults
+from functools import partial
+from typing import Optional
+
+from .base import BaseBench, BenchmarkResults, MetricsBenchAccumulator
 
 from llm_benchmarker.config import BENCHMARK_NAME_MMLU
-from llm_benchmarker.evals.metrics import calc_accuracy
+from llm_benchmarker.evals.metrics import MultipleChoiceAccumulator
+from llm_benchmarker.evals.registry import get_metric
 
 
 class MMLUBench(BaseBench):
     """This class used for implmenting the measuing Massive Multitask Language Understanding(MMMLU) Benchmark"""
 
+    metric_names = ("mc_accuracy",)
+    interval_metrics = {"accuracy": 1.0}
+
     def __init__(self):
         super().__init__()
         self.benchmark_name = MMLUBench.shared_key()
@@ -15,13 +22,23 @@ class MMLUBench(BaseBench):
     def shared_key(cls, ) -> str:
         return BENCHMARK_NAME_MMLU
 
-    def compute(self, predictions: list[str], targets: list[list[str]]):
+    def accumulator(self) -> MetricsBenchAccumulator:
+        return MetricsBenchAccumulator(self.benchmark_name, [
+            ('accuracy', MultipleChoiceAccumulator),
+        ])
 
+    def compute(self, predictions: list[str], targets: list[list[str]], groups: Optional[list[str]] = None):
+        """The chosen option is extracted from each prediction and compared with the 0-based answer id.
+        :param groups: the subject of each question, gives ``accuracy_per_subject`` too."""
         try:
-            predictions, targets = self._validate_inputs(predictions, targets)
+            if groups is not None:
+                # keep the subjects aligned with the samples that survive the validation
+                predictions, targets = self._validate_inputs(predictions, list(zip(targets, groups)))
+                targets, groups = [list(items) for items in zip(*targets)]
+            else:
+                predictions, targets = self._validate_inputs(predictions, targets)
+                targets = list(targets)
             predictions = list(predictions)
-            targets = list(targets)
-            targets
         except Exception as e:
             return BenchmarkResults(
                 benchmark_name=self.benchmark_name,
@@ -33,7 +50,7 @@ class MMLUBench(BaseBench):
         result = BenchmarkResults(benchmark_name=self.benchmark_name,)
 
         metrics_to_calc = [
-            ('accuracy', calc_accuracy),
+            ('accuracy', partial(get_metric("mc_accuracy"), groups=groups)),
         ]
 
         for name, fn in metrics_to_calc:
@@ -1,6 +1,13 @@
+from abc import ABC, abstractmethod
 from collections import Counter
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Sequence, Iterator, Callable
+import math
 import re
 
+import numpy as np
+
 
 def _cleaner(text):
     return re.sub('\u200c', " ", text).strip()
@@ -32,35 +39,738 @@ def _metric_max_over_ground_truths(metric_fn, prediction, ground_truths):
 
 
 def calc_bleu(predictions: list[str], targets: list[list[str]]) -> dict:
-    from evaluate import load
-    metric = load("bleu")
-    return metric.compute(predictions=predictions, references=targets)
+    """Corpus BLEU with the same output as the ``bleu`` metric of ``evaluate``, without loading its script."""
+    accumulator = BleuAccumulator()
+    accumulator.update(predictions, targets)
+    return accumulator.finalize()
 
 
-def calc_rouge(predictions: list[str], targets: list[list[str]]) -> dict:
-    from evaluate import load
-    metric = load("rouge")
-    scores = metric.compute(predictions=predictions, references=targets)
-    return scores
+def calc_rouge(predictions: list[str], targets: list[list[str]], num_workers: int = 1) -> dict:
+    """Mean ROUGE F-measures with the keys of the ``rouge`` metric of ``evaluate``, without loading its script.
+    :param num_workers: with more than one, the samples are scored in shards by this many processes. useful for very
+        long predictions, where the LCS of ROUGE-L is the biggest cost."""
+    return accumulate_in_processes(RougeAccumulator, predictions, targets, num_workers).finalize()
 
 
-def f1_score_exact_match(predictions: list[str], targets: list[list[str]]) -> dict:
-    f1 = exact_match = total = 0
-    for ground_truths, prediction in zip(targets, predictions):
-        total += 1
-        exact_match += _metric_max_over_ground_truths(_exact_match_score, prediction, ground_truths)
-        f1 += _metric_max_over_ground_truths(_f1_score, prediction, ground_truths)
-    exact_match = 100.0 * exact_match / total
-    f1 = 100.0 * f1 / total
-    return {"f1_score": f1, "exact_match": exact_match}
+def f1_score_exact_match(predictions: list[str], targets: list[list[str]], char_level: bool = False) -> dict:
+    """SQuAD-style F1 and exact match over the normalized tokens (see ``normalize_answer``), the best reference of
+    each sample counts.
+    :param char_level: count the common characters instead of tokens, like the older versions. only for comparing
+        with old results."""
+    accumulator = F1ExactMatchAccumulator(char_level=char_level)
+    accumulator.update(predictions, targets)
+    return accumulator.finalize()
 
 
 def calc_accuracy(predictions: list[str], targets: list[list[str]]) -> dict:
-    correct = 0
-    total = len(predictions)
-    for ground_truth, prediction in zip(targets, predictions):
-        pred_norm = str(prediction).strip().lower()
-        ground_truth_norms = [str(g).strip().lower() for g in ground_truth]
-        if pred_norm in ground_truth_norms:
-            correct += 1
-    return {"accuracy": correct / total if total > 0 else 0.0}
+    accumulator = AccuracyAccumulator()
+    accumulator.update(predictions, targets)
+    return accumulator.finalize()
+
+
+def calc_mc_accuracy(predictions: list[str], targets: list, groups: Optional[list[str]] = None) -> dict:
+    """Accuracy of multiple-choice answers, the chosen option is extracted from the predictions (see
+    ``extract_choices``). If ``groups`` (e.g. the subject of each question) is given, the accuracy of each group is
+    reported under ``accuracy_per_subject`` too."""
+    accumulator = MultipleChoiceAccumulator()
+    accumulator.update(predictions, targets, groups=groups)
+    return accumulator.finalize()
+
+
+# an option is a digit 1-4 or a capital letter A-D that is not a part of a bigger word or number. a letter followed
+# by a lowercase word ("A good choice is ...") is an article, not an option.
+_CHOICE_PATTERN = re.compile(r"(?<![\w.])(?:([1-4])(?![\w]|\.\d)|([A-D])(?![\w'])(?! [a-z]))")
+_CHOICE_IDS = np.full(128, -1, dtype=np.int64)
+_CHOICE_IDS[[ord(c) for c in "1234"]] = np.arange(4)
+_CHOICE_IDS[[ord(c) for c in "ABCD"]] = np.arange(4)
+
+
+def extract_choices(predictions: list[str]) -> np.ndarray:
+    """Give the id (0 to 3) of the first option mentioned in each prediction, -1 if there is none.
+
+    "3", "Answer: 3", "(3)", "3. Paris" and "(C)" are all the id 2. The pattern runs once over all predictions joined
+    by a NUL separator, and the matches are mapped back to their predictions by their offset."""
+    texts = [p if isinstance(p, str) else "" for p in predictions]
+    choices = np.full(len(texts), -1, dtype=np.int64)
+    if not texts:
+        return choices
+    joined = "\x00".join(texts)
+    matches = [(m.start(), m.group(m.lastindex)) for m in _CHOICE_PATTERN.finditer(joined)]
+    if not matches:
+        return choices
+    positions = np.fromiter((pos for pos, _ in matches), dtype=np.int64, count=len(matches))
+    codes = np.fromiter((ord(char) for _, char in matches), dtype=np.int64, count=len(matches))
+    starts = np.cumsum([0] + [len(t) + 1 for t in texts[:-1]])
+    sample_ix = np.searchsorted(starts, positions, side="right") - 1
+    # matches are in the order of their positions, so the first index of each sample is its first option
+    samples, first_ix = np.unique(sample_ix, return_index=True)
+    choices[samples] = _CHOICE_IDS[codes[first_ix]]
+    return choices
+
+
+def _target_choice_ids(targets: list) -> np.ndarray:
+    """Integer ids of the targets. an integer target is already an id (the ``answer`` column of MMLU is 0-based),
+    a string target is read like a prediction ("3" or "C" is the id 2)."""
+    firsts = [t[0] if isinstance(t, (list, tuple)) and len(t) > 0 else t for t in targets]
+    ids = np.full(len(firsts), -1, dtype=np.int64)
+    int_mask = np.fromiter((isinstance(t, (int, np.integer)) and not isinstance(t, bool) for t in firsts),
+                           dtype=bool, count=len(firsts))
+    if int_mask.any():
+        ids[int_mask] = np.fromiter((t for t, m in zip(firsts, int_mask) if m), dtype=np.int64)
+    if not int_mask.all():
+        ids[~int_mask] = extract_choices([str(t) for t, m in zip(firsts, int_mask) if not m])
+    return ids
+
+
+"""Mergeable metric accumulators. Each one keeps the sufficient statistics of a metric instead of the predictions,
+so a metric can be computed batch by batch (``update``), partial states of shards can be combined (``merge``) and the
+final value is given by ``finalize``."""
+
+
+class MetricAccumulator(ABC):
+    """Base class of the metric accumulators"""
+
+    accepts_groups = False  # whether ``update`` takes the group of each sample as ``groups``
+
+    @abstractmethod
+    def update(self, predictions: list[str], targets: list[list[str]]):
+        """Add a batch of predictions and their targets to the state."""
+        pass
+
+    @abstractmethod
+    def merge(self, other: "MetricAccumulator") -> "MetricAccumulator":
+        """Add the state of another accumulator of the same metric to this one, and return this one."""
+        pass
+
+    @abstractmethod
+    def finalize(self) -> dict:
+        """Give the value of the metric with the same keys as its ``calc_*`` function."""
+        pass
+
+    def _check_mergeable(self, other: "MetricAccumulator"):
+        if type(other) is not type(self):
+            raise TypeError(f"Can't merge {type(other).__name__} into {type(self).__name__}")
+
+
+def _accumulate_shard(factory: Callable[[], MetricAccumulator], predictions: list[str], targets: list,
+                      groups: Optional[list[str]] = None) -> MetricAccumulator:
+    accumulator = factory()
+    if groups is not None and accumulator.accepts_groups:
+        accumulator.update(predictions, targets, groups=groups)
+    else:
+        accumulator.update(predictions, targets)
+    return accumulator
+
+
+def submit_shards(executor: Executor, factory: Callable[[], MetricAccumulator], predictions: list[str],
+                  targets: list, num_shards: int, groups: Optional[list[str]] = None) -> list[Future]:
+    """Split the samples in ``num_shards`` contiguous shards and submit the accumulation of each one to ``executor``.
+    The futures give the accumulators of the shards, in order.
+    :param factory: a picklable callable that gives an empty accumulator, e.g. the accumulator class."""
+    shard_size = max(1, math.ceil(len(predictions) / num_shards))
+    return [executor.submit(_accumulate_shard, factory, predictions[start:start + shard_size],
+                            targets[start:start + shard_size],
+                            None if groups is None else groups[start:start + shard_size])
+            for start in range(0, len(predictions), shard_size)]
+
+
+def merge_accumulators(states: list[MetricAccumulator]) -> MetricAccumulator:
+    """Merge the accumulators of the shards into the first one."""
+    merged = states[0]
+    for state in states[1:]:
+        merged.merge(state)
+    return merged
+
+
+def accumulate_in_processes(factory: Callable[[], MetricAccumulator], predictions: list[str], targets: list,
+                            num_workers: int = 1) -> MetricAccumulator:
+    """Give an accumulator of ``factory`` updated with all samples. With ``num_workers > 1`` the samples are split in
+    shards, each shard is accumulated in a worker process and the partial states are merged, so the result is the
+    same as in one process.
+    :param factory: a picklable callable that gives an empty accumulator, e.g. the accumulator class."""
+    if num_workers <= 1 or len(predictions) < 2:
+        return _accumulate_shard(factory, predictions, targets)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = submit_shards(executor, factory, list(predictions), list(targets), num_workers)
+        return merge_accumulators([future.result() for future in futures])
+
+
+class F1ExactMatchAccumulator(MetricAccumulator):
+    """Accumulator of ``f1_score_exact_match``"""
+
+    def __init__(self, char_level: bool = False):
+        self.char_level = char_level
+        self.f1 = 0.0
+        self.exact_match = 0.0
+        self.total = 0
+
+    def update(self, predictions: list[str], targets: list[list[str]]):
+        if not self.char_level:
+            num_samples = min(len(predictions), len(targets))
+            f1, exact_match = _f1_exact_match_scores(list(predictions)[:num_samples], list(targets)[:num_samples])
+            self.f1 += float(f1.sum())
+            self.exact_match += float(exact_match.sum())
+            self.total += len(f1)
+            return
+        for ground_truths, prediction in zip(targets, predictions):
+            self.total += 1
+            self.exact_match += _metric_max_over_ground_truths(_exact_match_score, prediction, ground_truths)
+            self.f1 += _metric_max_over_ground_truths(_f1_score, prediction, ground_truths)
+
+    def merge(self, other: "F1ExactMatchAccumulator") -> "F1ExactMatchAccumulator":
+        self._check_mergeable(other)
+        if other.char_level != self.char_level:
+            raise ValueError("Can't merge character level and token level F1 states")
+        self.f1 += other.f1
+        self.exact_match += other.exact_match
+        self.total += other.total
+        return self
+
+    def finalize(self) -> dict:
+        return {"f1_score": 100.0 * self.f1 / self.total, "exact_match": 100.0 * self.exact_match / self.total}
+
+
+class AccuracyAccumulator(MetricAccumulator):
+    """Accumulator of ``calc_accuracy``"""
+
+    def __init__(self):
+        self.correct = 0
+        self.total = 0
+
+    def update(self, predictions: list[str], targets: list[list[str]]):
+        for ground_truth, prediction in zip(targets, predictions):
+            self.total += 1
+            pred_norm = str(prediction).strip().lower()
+            if pred_norm in [str(g).strip().lower() for g in ground_truth]:
+                self.correct += 1
+
+    def merge(self, other: "AccuracyAccumulator") -> "AccuracyAccumulator":
+        self._check_mergeable(other)
+        self.correct += other.correct
+        self.total += other.total
+        return self
+
+    def finalize(self) -> dict:
+        return {"accuracy": self.correct / self.total if self.total > 0 else 0.0}
+
+
+class MultipleChoiceAccumulator(MetricAccumulator):
+    """Accumulator of ``calc_mc_accuracy``. it keeps the number of correct and all answers, in total and per group."""
+
+    accepts_groups = True
+
+    def __init__(self):
+        self.correct = 0
+        self.total = 0
+        self.correct_per_group: dict[str, int] = {}
+        self.total_per_group: dict[str, int] = {}
+
+    def update(self, predictions: list[str], targets: list, groups: Optional[list[str]] = None):
+        is_correct = extract_choices(predictions) == _target_choice_ids(targets)
+        self.correct += int(is_correct.sum())
+        self.total += len(is_correct)
+        if groups is None:
+            return
+        names, inverse = np.unique(np.asarray(groups, dtype=str), return_inverse=True)
+        correct_counts = np.bincount(inverse, weights=is_correct, minlength=len(names))
+        total_counts = np.bincount(inverse, minlength=len(names))
+        for name, correct, total in zip(names.tolist(), correct_counts.tolist(), total_counts.tolist()):
+            self.correct_per_group[name] = self.correct_per_group.get(name, 0) + int(correct)
+            self.total_per_group[name] = self.total_per_group.get(name, 0) + int(total)
+
+    def merge(self, other: "MultipleChoiceAccumulator") -> "MultipleChoiceAccumulator":
+        self._check_mergeable(other)
+        self.correct += other.correct
+        self.total += other.total
+        for name, total in other.total_per_group.items():
+            self.correct_per_group[name] = self.correct_per_group.get(name, 0) + other.correct_per_group[name]
+            self.total_per_group[name] = self.total_per_group.get(name, 0) + total
+        return self
+
+    def finalize(self) -> dict:
+        result = {"accuracy": self.correct / self.total if self.total > 0 else 0.0}
+        if self.total_per_group:
+            result["accuracy_per_subject"] = {name: self.correct_per_group[name] / total
+                                              for name, total in sorted(self.total_per_group.items())}
+        return result
+
+
+# language-dependent part (assuming Western languages): symbols are padded with spaces. the space itself is left out of
+# the class of mteval, more spaces give the same tokens. splitting on the symbols and joining with spaces is the same as
+# ``sub(r" \1 ")``, only faster.
+_BLEU_13A_SYMBOLS = re.compile(r"([\{-\~\[-\`!-\&\(-\+\:-\@\/])")
+_BLEU_13A_RULES = [
+    # tokenize period and comma unless preceded by a digit
+    (re.compile(r"([^0-9])([\.,])"), r"\1 \2 "),
+    # tokenize period and comma unless followed by a digit
+    (re.compile(r"([\.,])([^0-9])"), r" \1 \2"),
+    # tokenize dash when preceded by a digit
+    (re.compile(r"([0-9])(-)"), r"\1 \2 "),
+]
+_BLEU_13A_RULE_CHARS = re.compile(r"[.,-]")
+
+
+@lru_cache(maxsize=2 ** 16)
+def _split_13a_word(word: str) -> tuple[str, ...]:
+    """Apply the period, comma and dash rules of 13a to one word. the rules only look at two neighbouring characters
+    and only add spaces, so applying them word by word gives the same tokens as applying them to the line."""
+    word = f" {word} "
+    for pattern, replacement in _BLEU_13A_RULES:
+        word = pattern.sub(replacement, word)
+    return tuple(word.split())
+
+
+@lru_cache(maxsize=2 ** 16)
+def _tokenize_13a(line: str) -> tuple[str, ...]:
+    """The ``13a`` tokenizer of sacrebleu/mteval that the ``bleu`` metric of ``evaluate`` uses."""
+    line = line.replace("<skipped>", "")
+    line = line.replace("-\n", "")
+    line = line.replace("\n", " ")
+    if "&" in line:
+        line = line.replace("&quot;", '"')
+        line = line.replace("&amp;", "&")
+        line = line.replace("&lt;", "<")
+        line = line.replace("&gt;", ">")
+    words = " ".join(_BLEU_13A_SYMBOLS.split(line)).split()
+    if not _BLEU_13A_RULE_CHARS.search(line):
+        return tuple(words)
+    tokens = []
+    for word in words:
+        if "." in word or "," in word or "-" in word:
+            tokens.extend(_split_13a_word(word))
+        else:
+            tokens.append(word)
+    return tuple(tokens)
+
+
+_MAX_NGRAM_KEY = 2 ** 62  # packed n-gram keys stay below this
+
+
+def _intern(tokens: Sequence[str], vocab: dict[str, int]) -> np.ndarray:
+    """Give the integer ids of ``tokens`` in ``vocab``, a new token gets the next id. a vocabulary is made for one
+    batch of samples, so it only holds the tokens of the batch and is freed with it."""
+    return np.fromiter((vocab.setdefault(token, len(vocab)) for token in tokens), dtype=np.int64, count=len(tokens))
+
+
+def _count_keys(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Sorted unique keys and their counts"""
+    if len(keys) == 0:
+        return keys, keys
+    keys = np.sort(keys)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.diff(np.append(starts, len(keys)))
+
+
+def _lookup(keys: np.ndarray, values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Values of ``queries`` in the sorted unique ``keys``, 0 for the missing ones."""
+    if len(keys) == 0:
+        return np.zeros(len(queries), dtype=values.dtype)
+    positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[positions] == queries, values[positions], 0)
+
+
+def _iter_ngram_windows(sequences: list[np.ndarray], max_order: int) -> Iterator[tuple[int, np.ndarray, np.ndarray,
+                                                                                       int]]:
+    """Yield ``(order, window_seq, window_codes, num_grams)`` of the n-grams of all ``sequences`` (arrays of token
+    ids) for each order up to ``max_order``. ``window_seq`` is the index of the sequence of each n-gram and
+    ``window_codes`` its code, codes are smaller than ``num_grams``, so ``window_seq * num_grams + window_codes`` is a
+    key of an n-gram in a sequence.
+
+    All sequences are laid in one id array. An n-gram is packed into one integer from the packed (n-1)-gram and the
+    next id, and the codes are renumbered densely when the next order could overflow, so codes never collide."""
+    seq_lengths = [len(token_ids) for token_ids in sequences]
+    if not sum(seq_lengths):
+        return
+    ids = np.concatenate(sequences)
+    seq = np.repeat(np.arange(len(seq_lengths)), seq_lengths)  # the sequence of each token
+    vocab_size = int(ids.max()) + 1
+    codes = ids  # the code of the n-gram that starts at each position
+    num_grams = vocab_size
+    for order in range(1, max_order + 1):
+        if order > 1:
+            if len(codes) < 2:
+                return
+            if num_grams * vocab_size * len(seq_lengths) >= _MAX_NGRAM_KEY:
+                # renumber densely, so the codes of the next order and the keys fit in int64
+                codes = np.unique(codes, return_inverse=True)[1]
+                num_grams = int(codes.max()) + 1
+            codes = codes[:-1] * vocab_size + ids[order - 1:]
+            num_grams *= vocab_size
+        window_seq = seq[:len(codes)]
+        valid = window_seq == seq[order - 1:]
+        yield order, window_seq[valid], codes[valid], num_grams
+
+
+def _bleu_statistics(predictions: list[str], targets: list, max_order: int) -> tuple[np.ndarray, np.ndarray, int, int]:
+    """Clipped n-gram matches and possible matches per order, translation and reference lengths of a corpus.
+
+    Tokens are interned to integer ids and n-grams to integer codes (``_iter_ngram_windows``). With the sample index
+    in the key, the n-grams of all samples are counted with one sort per order, and the counts of the references of a
+    sample are clipped by taking their maximum (``maximum.reduceat``) and matching the predictions against it with
+    ``searchsorted``."""
+    sequences, seq_samples = [], []
+    translation_length = reference_length = 0
+    vocab = {}
+    for prediction in predictions:
+        token_ids = _intern(_tokenize_13a(prediction), vocab)
+        sequences.append(token_ids)
+        translation_length += len(token_ids)
+    num_samples = len(sequences)
+    for sample_ix, references in enumerate(targets):
+        if isinstance(references, str):
+            references = [references]
+        reference_ids = [_intern(_tokenize_13a(reference), vocab) for reference in references]
+        sequences.extend(reference_ids)
+        seq_samples.extend([sample_ix] * len(reference_ids))
+        reference_length += min(len(token_ids) for token_ids in reference_ids)
+    matches = np.zeros(max_order, dtype=np.int64)
+    possible_matches = np.zeros(max_order, dtype=np.int64)
+    # sequences 0..num_samples-1 are the predictions, the next ones are the references
+    sample_of_seq = np.concatenate((np.arange(num_samples), np.asarray(seq_samples, dtype=np.int64)))
+    for order, window_seq, window_codes, num_grams in _iter_ngram_windows(sequences, max_order):
+        is_prediction = window_seq < num_samples
+        possible_matches[order - 1] = int(is_prediction.sum())
+
+        prediction_keys, prediction_counts = _count_keys(window_seq[is_prediction] * num_grams
+                                                         + window_codes[is_prediction])
+        reference_seq = window_seq[~is_prediction]
+        reference_keys, reference_counts = _count_keys(reference_seq * num_grams + window_codes[~is_prediction])
+        if len(prediction_keys) == 0 or len(reference_keys) == 0:
+            continue
+        # max count of each n-gram over the references of a sample
+        sample_keys = sample_of_seq[reference_keys // num_grams] * num_grams + reference_keys % num_grams
+        by_sample = np.argsort(sample_keys, kind="stable")
+        sample_keys = sample_keys[by_sample]
+        starts = np.flatnonzero(np.concatenate(([True], sample_keys[1:] != sample_keys[:-1])))
+        max_counts = np.maximum.reduceat(reference_counts[by_sample], starts)
+        # prediction keys are sample * num_grams + gram too, since a prediction's sequence is its sample
+        clipped = _lookup(sample_keys[starts], max_counts, prediction_keys)
+        matches[order - 1] = int(np.minimum(prediction_counts, clipped).sum())
+    return matches, possible_matches, translation_length, reference_length
+
+
+class BleuAccumulator(MetricAccumulator):
+    """Accumulator of corpus BLEU (``calc_bleu``). it keeps the clipped n-gram matches, the possible matches per
+    order and the lengths, so the merged result is exactly the corpus BLEU of all batches (not an average of the
+    BLEU of batches)."""
+
+    def __init__(self, max_order: int = 4, smooth: bool = False):
+        self.max_order = max_order
+        self.smooth = smooth
+        self.matches_by_order = [0] * max_order
+        self.possible_matches_by_order = [0] * max_order
+        self.translation_length = 0
+        self.reference_length = 0
+
+    def update(self, predictions: list[str], targets: list[list[str]]):
+        matches, possible_matches, translation_length, reference_length = _bleu_statistics(
+            list(predictions), list(targets), self.max_order)
+        self.matches_by_order = [a + int(b) for a, b in zip(self.matches_by_order, matches)]
+        self.possible_matches_by_order = [a + int(b) for a, b in zip(self.possible_matches_by_order,
+                                                                     possible_matches)]
+        self.translation_length += translation_length
+        self.reference_length += reference_length
+
+    def merge(self, other: "BleuAccumulator") -> "BleuAccumulator":
+        self._check_mergeable(other)
+        if other.max_order != self.max_order:
+            raise ValueError("Can't merge BLEU states with different max_order")
+        self.matches_by_order = [a + b for a, b in zip(self.matches_by_order, other.matches_by_order)]
+        self.possible_matches_by_order = [a + b for a, b in zip(self.possible_matches_by_order,
+                                                                other.possible_matches_by_order)]
+        self.translation_length += other.translation_length
+        self.reference_length += other.reference_length
+        return self
+
+    def finalize(self) -> dict:
+        precisions = [0.0] * self.max_order
+        for ix in range(self.max_order):
+            if self.smooth:
+                precisions[ix] = (self.matches_by_order[ix] + 1.0) / (self.possible_matches_by_order[ix] + 1.0)
+            elif self.possible_matches_by_order[ix] > 0:
+                precisions[ix] = float(self.matches_by_order[ix]) / self.possible_matches_by_order[ix]
+        if min(precisions) > 0:
+            geo_mean = math.exp(sum((1.0 / self.max_order) * math.log(p) for p in precisions))
+        else:
+            geo_mean = 0
+        ratio = float(self.translation_length) / self.reference_length
+        brevity_penalty = 1.0 if ratio > 1.0 else math.exp(1 - 1.0 / ratio)
+        return {
+            "bleu": geo_mean * brevity_penalty,
+            "precisions": precisions,
+            "brevity_penalty": brevity_penalty,
+            "length_ratio": ratio,
+            "translation_length": self.translation_length,
+            "reference_length": self.reference_length,
+        }
+
+
+_ROUGE_NON_ALPHANUM = re.compile(r"[^a-z0-9]+")
+_ROUGE_N_TYPE = re.compile(r"rouge([0-9])$")
+
+
+@lru_cache(maxsize=2 ** 16)
+def _rouge_tokens(text: str) -> tuple[str, ...]:
+    """Tokens of the default tokenizer of ``rouge_score`` (lowercase runs of ``[a-z0-9]``, no stemming). other
+    scripts have no tokens, like in ``rouge_score``."""
+    return tuple(_ROUGE_NON_ALPHANUM.sub(" ", text.lower()).split())
+
+
+def _rouge_sentences(text: str) -> list[tuple[str, ...]]:
+    """Tokens of the lines of ``text``, the sentences of ``rougeLsum``."""
+    return [_rouge_tokens(line) for line in text.split("\n") if line]
+
+
+def _fmeasure(hits: np.ndarray, prediction_lengths: np.ndarray, reference_lengths: np.ndarray) -> np.ndarray:
+    """F-measure of each pair, with the same floating point steps as ``rouge_score``."""
+    precision = hits / np.maximum(prediction_lengths, 1)
+    recall = hits / np.maximum(reference_lengths, 1)
+    total = precision + recall
+    return np.where(total > 0, 2 * precision * recall / np.where(total > 0, total, 1), 0.0)
+
+
+def _lcs_lengths(prediction: np.ndarray, references: list[np.ndarray]) -> list[int]:
+    """Length of the longest common subsequence of the prediction with each reference.
+
+    Bit-parallel LCS (Allison-Dix, Hyyro): a bit vector holds one DP row over the positions of a reference, and each
+    token of the prediction updates all of them with a few integer operations, in ``O(n * m / 64)`` instead of the
+    ``O(n * m)`` Python steps of a DP table. All references of the prediction share one vector, a zero guard bit after
+    each of them stops the carry of the addition, and ``V - U`` never borrows because ``U`` is a subset of ``V``."""
+    match_masks: dict[int, int] = {}
+    segments = []
+    offset = 0
+    for reference in references:
+        for position, token in enumerate(reference.tolist()):
+            match_masks[token] = match_masks.get(token, 0) | (1 << (offset + position))
+        segments.append((offset, len(reference)))
+        offset += len(reference) + 1
+    full = 0
+    for start, length in segments:
+        full |= ((1 << length) - 1) << start
+    vector = full
+    for token in prediction.tolist():
+        mask = match_masks.get(token)
+        if mask is None:
+            # a token that is in no reference leaves the row as it is
+            continue
+        matched = vector & mask
+        vector = ((vector + matched) | (vector - matched)) & full
+    return [length - bin((vector >> start) & ((1 << length) - 1)).count("1") for start, length in segments]
+
+
+def _lcs_indices(reference: Sequence[int], candidate: Sequence[int]) -> list[int]:
+    """Positions in ``reference`` of one LCS with ``candidate``, the same one that ``rouge_score`` reads out of its
+    DP table (the union LCS of ``rougeLsum`` depends on which one)."""
+    rows = [[0] * (len(candidate) + 1)]
+    for ref_token in reference:
+        previous = rows[-1]
+        row = [0]
+        for j, can_token in enumerate(candidate):
+            row.append(previous[j] + 1 if ref_token == can_token else max(previous[j + 1], row[j]))
+        rows.append(row)
+    i, j = len(reference), len(candidate)
+    indices = []
+    while i > 0 and j > 0:
+        if reference[i - 1] == candidate[j - 1]:
+            indices.append(i - 1)
+            i -= 1
+            j -= 1
+        elif rows[i][j - 1] > rows[i - 1][j]:
+            j -= 1
+        else:
+            i -= 1
+    return indices[::-1]
+
+
+def _summary_level_lcs(reference: str, prediction: str) -> float:
+    """``rougeLsum`` F-measure of a pair with more than one line (summary-level LCS, section 3.2 of the ROUGE
+    paper, with the double counting check of ROUGE 1.5.5 like ``rouge_score``)."""
+    ref_sents = _rouge_sentences(reference)
+    can_sents = _rouge_sentences(prediction)
+    m = sum(map(len, ref_sents))
+    n = sum(map(len, can_sents))
+    if not ref_sents or not can_sents or not n or not m:
+        return 0.0
+    ref_counts = Counter(token for sent in ref_sents for token in sent)
+    can_counts = Counter(token for sent in can_sents for token in sent)
+    hits = 0
+    for ref_sent in ref_sents:
+        union = sorted(set().union(*[_lcs_indices(ref_sent, can_sent) for can_sent in can_sents]))
+        for token in (ref_sent[ix] for ix in union):
+            if can_counts[token] > 0 and ref_counts[token] > 0:
+                hits += 1
+                can_counts[token] -= 1
+                ref_counts[token] -= 1
+    return float(_fmeasure(np.array([hits]), np.array([n]), np.array([m]))[0])
+
+
+def _ngram_hits(prediction_ids: list[np.ndarray], reference_ids: list[np.ndarray], ref_samples: np.ndarray,
+                orders: set[int]) -> dict[int, np.ndarray]:
+    """Number of the common n-grams (clipped counts) of each reference with the prediction of its sample, for each
+    order in ``orders``. All pairs are counted at once with the packed n-gram codes."""
+    num_samples = len(prediction_ids)
+    hits = {order: np.zeros(len(reference_ids)) for order in orders}
+    for order, window_seq, window_codes, num_grams in _iter_ngram_windows(prediction_ids + reference_ids,
+                                                                          max(orders)):
+        if order not in hits:
+            continue
+        is_prediction = window_seq < num_samples
+        prediction_keys, prediction_counts = _count_keys(window_seq[is_prediction] * num_grams
+                                                         + window_codes[is_prediction])
+        reference_keys, reference_counts = _count_keys(window_seq[~is_prediction] * num_grams
+                                                       + window_codes[~is_prediction])
+        reference_ix = reference_keys // num_grams - num_samples
+        sample_keys = ref_samples[reference_ix] * num_grams + reference_keys % num_grams
+        common = np.minimum(reference_counts, _lookup(prediction_keys, prediction_counts, sample_keys))
+        hits[order] = np.bincount(reference_ix, weights=common, minlength=len(reference_ids))
+    return hits
+
+
+def _rouge_scores(predictions: list[str], targets: list, rouge_types: tuple[str, ...]) -> dict[str, np.ndarray]:
+    """F-measure of each rouge type for each sample, the best reference of a sample is taken like ``score_multi`` of
+    ``rouge_score``.
+
+    ROUGE-N counts the n-grams of all pairs at once like the BLEU statistics. ROUGE-L uses the bit-parallel LCS, and
+    so does ROUGE-Lsum for pairs of single lines, where it's equal to ROUGE-L. Only the multi-line pairs of
+    ROUGE-Lsum need the DP table, its union LCS depends on the exact LCS."""
+    references_per_sample = [[references] if isinstance(references, str) else list(references)
+                             for references in targets]
+    vocab = {}
+    prediction_ids = [_intern(_rouge_tokens(prediction), vocab) for prediction in predictions]
+    reference_ids = [_intern(_rouge_tokens(reference), vocab) for references in references_per_sample
+                     for reference in references]
+    num_samples = len(prediction_ids)
+    ref_samples = np.repeat(np.arange(num_samples), [len(references) for references in references_per_sample])
+    ref_starts = np.cumsum([0] + [len(references) for references in references_per_sample[:-1]])
+    prediction_lengths = np.array([len(ids) for ids in prediction_ids], dtype=np.int64)
+    reference_lengths = np.array([len(ids) for ids in reference_ids], dtype=np.int64)
+
+    def best_of_references(pair_scores: np.ndarray) -> np.ndarray:
+        return np.maximum.reduceat(pair_scores, ref_starts) if num_samples else pair_scores
+
+    scores = {}
+    orders = {rouge_type: int(_ROUGE_N_TYPE.match(rouge_type).group(1)) for rouge_type in rouge_types
+              if _ROUGE_N_TYPE.match(rouge_type)}
+    for rouge_type, order in orders.items():
+        if order <= 0:
+            raise ValueError(f"rougen requires positive n: {rouge_type}")
+    if orders:
+        hits = _ngram_hits(prediction_ids, reference_ids, ref_samples, set(orders.values()))
+        for rouge_type, order in orders.items():
+            scores[rouge_type] = best_of_references(_fmeasure(hits[order],
+                                                              np.maximum(prediction_lengths[ref_samples] - order + 1, 0),
+                                                              np.maximum(reference_lengths - order + 1, 0)))
+
+    lcs_types = [rouge_type for rouge_type in rouge_types if rouge_type in ("rougeL", "rougeLsum")]
+    if lcs_types:
+        lcs = np.zeros(len(reference_ids), dtype=np.int64)
+        for sample_ix, token_ids in enumerate(prediction_ids):
+            start = ref_starts[sample_ix]
+            references = reference_ids[start:start + len(references_per_sample[sample_ix])]
+            lcs[start:start + len(references)] = _lcs_lengths(token_ids, references)
+        lcs_scores = _fmeasure(lcs, prediction_lengths[ref_samples], reference_lengths)
+        if "rougeL" in lcs_types:
+            scores["rougeL"] = best_of_references(lcs_scores)
+        if "rougeLsum" in lcs_types:
+            lsum_scores = lcs_scores.copy()
+            flat_references = [reference for references in references_per_sample for reference in references]
+            for pair_ix, reference in enumerate(flat_references):
+                prediction = predictions[ref_samples[pair_ix]]
+                if "\n" in prediction or "\n" in reference:
+                    lsum_scores[pair_ix] = _summary_level_lcs(reference, prediction)
+            scores["rougeLsum"] = best_of_references(lsum_scores)
+
+    for rouge_type in rouge_types:
+        if rouge_type not in scores:
+            raise ValueError(f"Invalid rouge type: {rouge_type}")
+    return scores
+
+
+class RougeAccumulator(MetricAccumulator):
+    """Accumulator of ROUGE (``calc_rouge``). it keeps the sum of the F-measure of each rouge type over the samples
+    (the best reference of each sample), and gives their mean. The scores are the same as ``rouge_score`` with its
+    default tokenizer and without stemming."""
+
+    ROUGE_TYPES = ("rouge1", "rouge2", "rougeL", "rougeLsum")
+
+    def __init__(self, rouge_types: tuple[str, ...] = ROUGE_TYPES):
+        self.rouge_types = tuple(rouge_types)
+        self.sums = {rouge_type: 0.0 for rouge_type in self.rouge_types}
+        self.total = 0
+
+    def update(self, predictions: list[str], targets: list[list[str]]):
+        predictions, targets = list(predictions), list(targets)
+        scores = _rouge_scores(predictions, targets[:len(predictions)], self.rouge_types)
+        for rouge_type in self.rouge_types:
+            self.sums[rouge_type] += float(scores[rouge_type].sum())
+        self.total += len(predictions)
+
+    def merge(self, other: "RougeAccumulator") -> "RougeAccumulator":
+        self._check_mergeable(other)
+        for rouge_type in self.rouge_types:
+            self.sums[rouge_type] += other.sums[rouge_type]
+        self.total += other.total
+        return self
+
+    def finalize(self) -> dict:
+        return {rouge_type: self.sums[rouge_type] / self.total for rouge_type in self.rouge_types}
+
+
+# Arabic forms of the letters that are written in Persian text, the Persian and Arabic digits, and the characters that
+# only change how a word is rendered.
+_PERSIAN_CHAR_MAP = str.maketrans({
+    "\u064a": "\u06cc", "\u0649": "\u06cc",  # Arabic yeh and alef maksura -> Persian yeh
+    "\u0643": "\u06a9",  # Arabic kaf -> Persian kaf
+    "\u0629": "\u0647", "\u06c0": "\u0647",  # teh marbuta and heh with yeh -> heh
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0671": "\u0627",  # alef with hamza and wasla -> alef
+    "\u200c": " ",  # zero-width non-joiner separates the parts of a word, like the old cleaner
+    "\u200d": None, "\u200e": None, "\u200f": None, "\u0640": None,  # joiner, direction marks and tatweel
+    **{chr(code): None for code in range(0x064b, 0x0660)}, "\u0670": None,  # diacritics (harakat)
+    **{persian: str(digit) for digit, persian in enumerate("۰۱۲۳۴۵۶۷۸۹")},
+    **{arabic: str(digit) for digit, arabic in enumerate("٠١٢٣٤٥٦٧٨٩")},
+})
+_ANSWER_PUNCTUATION = re.compile(r"[^\w\s]|_")
+
+
+@lru_cache(maxsize=2 ** 16)
+def _answer_tokens(text: str) -> tuple[str, ...]:
+    return tuple(_ANSWER_PUNCTUATION.sub("", text.lower().translate(_PERSIAN_CHAR_MAP)).split())
+
+
+def normalize_answer(text: str) -> str:
+    """Normalize an answer for F1 and exact match: lowercase, Arabic letters and all digits in their Persian/ASCII
+    forms, zero-width non-joiner as a space, no diacritics, no punctuation (Persian ones too) and single spaces.
+    >>> normalize_answer("كتاب‌هاي «علمي»، ۱۲")
+    'کتاب های علمی 12'"""
+    return " ".join(_answer_tokens(text))
+
+
+def _f1_exact_match_scores(predictions: list[str], targets: list) -> tuple[np.ndarray, np.ndarray]:
+    """Token level F1 and exact match of each sample with its best reference.
+
+    The common tokens of all prediction/reference pairs are counted at once (``_ngram_hits``), exact match compares
+    the normalized answers, and the best reference of each sample is taken with ``maximum.reduceat``."""
+    references_per_sample = [[references] if isinstance(references, str) else (list(references) or [""])
+                             for references in targets]
+    predictions = [_answer_tokens(prediction) for prediction in predictions]
+    references = [_answer_tokens(reference) for refs in references_per_sample for reference in refs]
+    ref_samples = np.repeat(np.arange(len(predictions)), [len(refs) for refs in references_per_sample])
+    ref_starts = np.cumsum([0] + [len(refs) for refs in references_per_sample[:-1]])
+    if not predictions:
+        return np.zeros(0), np.zeros(0)
+    vocab = {}
+    prediction_ids = [_intern(tokens, vocab) for tokens in predictions]
+    reference_ids = [_intern(tokens, vocab) for tokens in references]
+    prediction_lengths = np.array([len(ids) for ids in prediction_ids], dtype=np.int64)[ref_samples]
+    reference_lengths = np.array([len(ids) for ids in reference_ids], dtype=np.int64)
+
+    common = _ngram_hits(prediction_ids, reference_ids, ref_samples, {1})[1]
+    f1 = _fmeasure(common, prediction_lengths, reference_lengths)
+    # an empty answer only matches an empty answer
+    f1 = np.where((prediction_lengths == 0) | (reference_lengths == 0),
+                  (prediction_lengths == reference_lengths).astype(float), f1)
+    # tokens have no spaces, so the token tuples are equal exactly when the normalized answers are
+    exact_match = np.fromiter((predictions[sample_ix] == reference
+                               for sample_ix, reference in zip(ref_samples.tolist(), references)),
+                              dtype=float, count=len(references))
+    return np.maximum.reduceat(f1, ref_starts), np.maximum.reduceat(exact_match, ref_starts)
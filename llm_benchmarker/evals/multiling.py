@@ -1,7 +1,8 @@
 from typing import Tuple, Dict
 from loguru import logger
-from .base import BaseBench, BenchmarkResults
-from .metrics import f1_score_exact_match, calc_bleu, calc_rouge
+from .base import BaseBench, BenchmarkResults, MetricsBenchAccumulator
+from .metrics import F1ExactMatchAccumulator, BleuAccumulator, RougeAccumulator
+from .registry import get_metric
 
 from llm_benchmarker.config import BENCHMARK_NAME_PERSIAN_QA
 
@@ -9,6 +10,10 @@ from llm_benchmarker.config import BENCHMARK_NAME_PERSIAN_QA
 class FarsiBench(BaseBench):
     """This class used for implementing the measuing Persian Language Benchmark"""
 
+    metric_names = ("f1_exact_match", "bleu", "rouge")
+    interval_metrics = {"f1_score": 100.0, "exact_match": 100.0, "rouge1": 1.0, "rouge2": 1.0, "rougeL": 1.0,
+                        "rougeLsum": 1.0}
+
     def __init__(self):
         super().__init__()
         self.benchmark_name = FarsiBench.shared_key()
@@ -17,6 +22,13 @@ class FarsiBench(BaseBench):
     def shared_key(cls, ) -> str:
         return BENCHMARK_NAME_PERSIAN_QA
 
+    def accumulator(self) -> MetricsBenchAccumulator:
+        return MetricsBenchAccumulator(self.benchmark_name, [
+            ('f1', F1ExactMatchAccumulator),
+            ('bleu', BleuAccumulator),
+            ('rouge', RougeAccumulator)
+        ])
+
     def compute(self, predictions: list[str], targets: list[list[str]]) -> Dict:
 
         # validate the inputted data
@@ -35,9 +47,9 @@ class FarsiBench(BaseBench):
         result = BenchmarkResults(benchmark_name=self.benchmark_name,)
 
         metrics_to_calc = [
-            ('f1', f1_score_exact_match),
-            ('bleu', calc_bleu),
-            ('rouge', calc_rouge)
+            ('f1', get_metric("f1_exact_match")),
+            ('bleu', get_metric("bleu")),
+            ('rouge', get_metric("rouge"))
         ]
 
         for name, fn in metrics_to_calc:
@@ -0,0 +1,42 @@
+"""A registry of the metrics of the benchmarks by name. All registered metrics are bundled with the package, so scoring
+never downloads a metric script and works on machines without network access."""
+from typing import Callable, Iterable, Optional
+
+from llm_benchmarker.evals.metrics import f1_score_exact_match, calc_accuracy, calc_mc_accuracy, calc_bleu, \
+    calc_rouge
+
+
+_METRICS: dict[str, Callable] = {}
+
+
+def register_metric(name: str, metric: Callable):
+    """Register a metric.
+    :param name: name of the metric, e.g. ``"bleu"``.
+    :param metric: the metric function, it gets ``(predictions, targets)`` and returns a dictionary of values."""
+    _METRICS[name] = metric
+
+
+def get_metric(name: str) -> Callable:
+    """Give the metric function of ``name``.
+    >>> get_metric("bleu")(["the cat sat"], [["the cat sat"]])"""
+    if name not in _METRICS:
+        raise KeyError(f"Unknown metric {name}, registered metrics are {sorted(_METRICS)}")
+    return _METRICS[name]
+
+
+def warmup(names: Optional[Iterable[str]] = None) -> list[str]:
+    """Check that the metrics are registered before the benchmarks need them, an unknown name raises a ``KeyError``
+    before any generation.
+    :param names: names of the metrics, all registered metrics if it's ``None``.
+    :returns: names of the metrics"""
+    names = sorted(_METRICS) if names is None else list(dict.fromkeys(names))
+    for name in names:
+        get_metric(name)
+    return names
+
+
+register_metric("f1_exact_match", f1_score_exact_match)
+register_metric("accuracy", calc_accuracy)
+register_metric("mc_accuracy", calc_mc_accuracy)
+register_metric("bleu", calc_bleu)
+register_metric("rouge", calc_rouge)
@@ -0,0 +1,222 @@
+"""Serving performance of a model: time to first token, inter-token latency, end-to-end latency and output tokens per
+second on the prompts of a quality benchmark. The same prompt sets gate both the quality and the latency of a build."""
+import time
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple, Type, NamedTuple
+
+import numpy as np
+from loguru import logger
+
+from llm_benchmarker.utils import run_coroutine
+from .base import BaseBench, BenchmarkResults
+from .multiling import FarsiBench
+from .lang import MMLUBench
+
+
+class RequestStats(NamedTuple):
+    """Timings of one streamed request, in seconds from its (scheduled) start"""
+    first_token: Optional[float]
+    end: float
+    tokens: int
+    token_gaps: list  # seconds between the consecutive tokens
+    error: Optional[str] = None
+
+
+def _percentiles(values: list, scale: float = 1000.0) -> Optional[dict]:
+    if not values:
+        return None
+    p50, p90, p99 = (float(value) * scale for value in np.percentile(values, [50, 90, 99]))
+    return {"p50": p50, "p90": p90, "p99": p99, "max": float(max(values)) * scale}
+
+
+class ServingBench(BaseBench):
+    """Sends the prompts of ``dataset_bench`` to a streaming ``gen_func`` and measures the serving performance.
+
+    ``gen_func`` of this benchmark gets one formatted prompt and yields the output token by token (a generator or an
+    async generator, e.g. over the server-sent events of an inference server). Each level of ``concurrency_levels``
+    runs ``max_requests`` requests with that many requests in flight (a closed loop), each rate of ``request_rates``
+    starts the requests at that fixed rate whatever the latency is (an open loop, the latency includes the queueing).
+    The highest output tokens per second of the levels is the saturation throughput.
+
+    Configure it with a subclass or ``ServingBench.of``:
+
+    >>> PersianQAServing = ServingBench.of(FarsiBench, concurrency_levels=(1, 8, 32), max_requests=256)
+    >>> BenchManager({FarsiBench: quality_conf, PersianQAServing: {GENERATOR_FUNC_KEY: stream, ...}}).run()
+
+    Run it with ``max_workers=1`` (the default), so no other benchmark loads the model in the meantime."""
+
+    drives_generation = True
+    dataset_bench: Type[BaseBench] = None  # the benchmark that gives the dataset and the prompts
+    concurrency_levels: Tuple[int, ...] = (1, 4, 16)
+    request_rates: Tuple[float, ...] = ()  # requests per second
+    max_requests: Optional[int] = 256  # requests per level, the prompts are repeated if there are fewer
+    warmup_requests: int = 2  # requests before the levels that are not measured
+    max_in_flight: int = 256  # max requests in flight of the fixed rate levels
+
+    def __init__(self):
+        super().__init__()
+        if self.dataset_bench is None:
+            raise ValueError(f"{type(self).__name__} has no dataset_bench")
+        self.benchmark_name = f"{self.dataset_bench.shared_key()}-serving"
+
+    @classmethod
+    def shared_key(cls) -> str:
+        return cls.dataset_bench.shared_key()
+
+    @classmethod
+    def of(cls, dataset_bench: Type[BaseBench], **settings) -> Type["ServingBench"]:
+        """Make a serving benchmark on the dataset of ``dataset_bench``.
+        :param settings: class attributes, e.g. ``concurrency_levels``, ``request_rates`` or ``max_requests``."""
+        unknown = set(settings) - {"concurrency_levels", "request_rates", "max_requests", "warmup_requests",
+                                   "max_in_flight"}
+        if unknown:
+            raise ValueError(f"Unknown settings {sorted(unknown)}")
+        return type(f"{dataset_bench.__name__}Serving", (cls,), {"dataset_bench": dataset_bench, **settings})
+
+    def compute(self, predictions: list[str], targets: list[list[str]], groups: Optional[list[str]] = None):
+        """A serving benchmark has no quality metrics, ``BenchmarkPipeline`` runs ``run_generation`` instead and the
+        quality of the same prompts is the result of ``dataset_bench``."""
+        return BenchmarkResults(benchmark_name=self.benchmark_name).to_dict()
+
+    def count_tokens(self, chunk: Any) -> int:
+        """Number of tokens in a chunk that ``gen_func`` yielded, one by default. override it if the server sends
+        several tokens per chunk."""
+        return 1
+
+    def run_generation(self, model_pipeline, system_prompt: str, prompts: list[str]) -> dict:
+        """Run all levels.
+        :param model_pipeline: the ``ModelPipeline`` of the benchmark, its ``gen_func`` must stream.
+        :returns: ``levels`` (the stats of each level), ``saturation_throughput`` (output tokens per second) and
+            the level that reached it"""
+        if not prompts:
+            return BenchmarkResults(benchmark_name=self.benchmark_name,
+                                    errors={"validation": "The dataset has no prompts"}).to_dict()
+        formatted = list(model_pipeline.prompt_formatter(system_prompt, list(prompts)))
+        stream_fn = model_pipeline.gen_func
+        num_requests = self.max_requests or len(formatted)
+        requests = [formatted[ix % len(formatted)] for ix in range(num_requests)]
+        if self.warmup_requests:
+            self._run_level(stream_fn, formatted[:self.warmup_requests], concurrency=1)
+
+        levels = []
+        for concurrency in self.concurrency_levels:
+            logger.info(f"{self.benchmark_name}: {num_requests} requests with concurrency {concurrency}")
+            stats, duration = self._run_level(stream_fn, requests, concurrency=concurrency)
+            levels.append({"concurrency": concurrency, **self._level_report(stats, duration)})
+        for rate in self.request_rates:
+            logger.info(f"{self.benchmark_name}: {num_requests} requests at {rate} requests/s")
+            stats, duration = self._run_level(stream_fn, requests, concurrency=self.max_in_flight, rate=rate)
+            levels.append({"request_rate": rate, **self._level_report(stats, duration)})
+
+        result = BenchmarkResults(benchmark_name=self.benchmark_name)
+        result.metrics["levels"] = levels
+        if levels:
+            best = max(levels, key=lambda level: level["output_tokens_per_second"])
+            result.metrics["saturation_throughput"] = best["output_tokens_per_second"]
+            result.metrics["saturation_level"] = {key: best[key] for key in ("concurrency", "request_rate")
+                                                  if key in best}
+        return result.to_dict()
+
+    def _level_report(self, stats: list[RequestStats], duration: float) -> dict:
+        done = [s for s in stats if s.error is None]
+        errors = len(stats) - len(done)
+        if errors:
+            logger.warning(f"{self.benchmark_name}: {errors} of {len(stats)} requests failed, first error: "
+                           f"{next(s.error for s in stats if s.error is not None)}")
+        tokens = sum(s.tokens for s in done)
+        return {
+            "requests": len(stats),
+            "errors": errors,
+            "duration_s": duration,
+            "requests_per_second": len(done) / duration if duration > 0 else None,
+            "output_tokens_per_second": tokens / duration if duration > 0 else 0.0,
+            "tokens_per_request": tokens / len(done) if done else 0.0,
+            "ttft_ms": _percentiles([s.first_token for s in done if s.first_token is not None]),
+            "itl_ms": _percentiles([gap for s in done for gap in s.token_gaps]),
+            "e2e_ms": _percentiles([s.end for s in done]),
+        }
+
+    def _run_level(self, stream_fn: Callable, requests: list, concurrency: int,
+                   rate: Optional[float] = None) -> Tuple[list[RequestStats], float]:
+        """Send ``requests`` with at most ``concurrency`` in flight, started at ``rate`` per second if it's given.
+        :returns: the stats of the requests and the seconds from the first start to the last end"""
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, not {concurrency}")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"request rate must be positive, not {rate}")
+        started = time.perf_counter()
+        schedule = [started + ix / rate if rate is not None else None for ix in range(len(requests))]
+        if inspect.isasyncgenfunction(stream_fn) or inspect.isasyncgenfunction(getattr(stream_fn, "__call__", None)):
+            stats = run_coroutine(self._arun_level(stream_fn, requests, concurrency, schedule))
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(requests)) or 1,
+                                    thread_name_prefix="serving") as executor:
+                stats = list(executor.map(lambda args: self._request(stream_fn, *args), zip(requests, schedule)))
+        return stats, time.perf_counter() - started
+
+    def _request(self, stream_fn: Callable, prompt: Any, scheduled: Optional[float]) -> RequestStats:
+        if scheduled is not None:
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+        start = scheduled if scheduled is not None else time.perf_counter()
+        recorder = _Recorder(self, start)
+        try:
+            for chunk in stream_fn(prompt):
+                recorder.token(chunk)
+        except Exception as e:
+            return recorder.failed(e)
+        return recorder.finish()
+
+    async def _arun_level(self, stream_fn: Callable, requests: list, concurrency: int,
+                          schedule: list) -> list[RequestStats]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(prompt, scheduled):
+            if scheduled is not None:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            start = scheduled if scheduled is not None else None
+            async with semaphore:
+                recorder = _Recorder(self, start if start is not None else time.perf_counter())
+                try:
+                    async for chunk in stream_fn(prompt):
+                        recorder.token(chunk)
+                except Exception as e:
+                    return recorder.failed(e)
+                return recorder.finish()
+
+        return list(await asyncio.gather(*[request(prompt, scheduled)
+                                           for prompt, scheduled in zip(requests, schedule)]))
+
+
+class _Recorder:
+    """Collects the token times of one request"""
+    __slots__ = ("bench", "start", "first_token", "last_token", "tokens", "gaps")
+
+    def __init__(self, bench: ServingBench, start: float):
+        self.bench = bench
+        self.start = start
+        self.first_token = None
+        self.last_token = None
+        self.tokens = 0
+        self.gaps = []
+
+    def token(self, chunk: Any):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now - self.start
+        else:
+            self.gaps.append(now - self.last_token)
+        self.last_token = now
+        self.tokens += self.bench.count_tokens(chunk)
+
+    def finish(self) -> RequestStats:
+        return RequestStats(self.first_token, time.perf_counter() - self.start, self.tokens, self.gaps)
+
+    def failed(self, error: Exception) -> RequestStats:
+        return RequestStats(self.first_token, time.perf_counter() - self.start, self.tokens, self.gaps,
+                            f"{type(error).__name__}: {error}")
+
+
+FarsiServingBench = ServingBench.of(FarsiBench)
+MMLUServingBench = ServingBench.of(MMLUBench)
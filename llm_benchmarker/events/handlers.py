@@ -1,4 +1,5 @@
 import functools
+import threading
 
 from typing import Callable, Any, Tuple
 from loguru import logger
@@ -20,7 +21,10 @@ class EventHandler:
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            # the slot lists are replaced, never changed in place, so ``emit`` can iterate one while another thread
+            # subscribes or unsubscribes
             cls._instance._slots: dict[str, list] = {}
+            cls._instance._lock = threading.Lock()
         return cls._instance
 
     def __init__(self):
@@ -32,18 +36,39 @@ class EventHandler:
             self.subscribe(event_name, slot_fn)
 
     def subscribe(self, event_name: str, slot_fn: Callable[[Any], Any]):
-        if event_name not in self._slots.keys():
-            self._slots[event_name] = []
-        self._slots[event_name].append(slot_fn)
+        """Subscribe ``slot_fn`` to ``event_name``, a slot that is already subscribed is not added again. see
+        ``unsubscribe_module`` for a module that is executed again."""
+        with self._lock:
+            slots = self._slots.get(event_name, [])
+            if not any(subscribed is slot_fn for subscribed in slots):
+                self._slots[event_name] = slots + [slot_fn]
 
     def unsubscribe(self, event_name: str, slot_fn: Callable[[], Any]):
-        if event_name in self._slots.keys():
-            self._slots[event_name].remove(slot_fn)
+        with self._lock:
+            if event_name in self._slots.keys():
+                slots = list(self._slots[event_name])
+                slots.remove(slot_fn)
+                self._slots[event_name] = slots
+
+    def unsubscribe_module(self, module_name: str):
+        """Unsubscribe the slots that are defined in the module ``module_name``, e.g. before the module is executed
+        again, so its slots don't pile up in a long-running process."""
+        with self._lock:
+            for event_name, slots in self._slots.items():
+                self._slots[event_name] = [slot_fn for slot_fn in slots
+                                           if getattr(slot_fn, "__module__", None) != module_name]
+
+    def has_slots(self, event_name: str) -> bool:
+        """``True`` if a slot is subscribed to ``event_name``, cheap enough for the hot paths."""
+        return bool(self._slots.get(event_name))
+
+    def get_slots(self, event_name: str) -> list[Callable]:
+        """Give the slot functions that are subscribed to ``event_name``"""
+        return list(self._slots.get(event_name, []))
 
     def emit(self, event_name: str, *args, **kwargs) -> Any:
         results = {
         }
-        if event_name in self._slots:
-            for slot in self._slots[event_name]:
-                results[event_name] = slot(*args, **kwargs)
+        for slot in self._slots.get(event_name, ()):
+            results[event_name] = slot(*args, **kwargs)
         return results
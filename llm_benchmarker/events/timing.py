@@ -0,0 +1,259 @@
+"""Timing of the stages of a run (dataset loading, prompt formatting, each ``gen_func`` batch, scoring and each
+metric). Every finished stage is emitted as a ``TimingEvent`` on ``TIMING_EVENT`` of ``EventHandler``, exporters are
+plain slots of that event:
+
+    >>> with ChromeTraceExporter("run.trace.json"), TimingSummary() as summary:
+    >>>     BenchManager(conf).run()
+    >>> summary.report()
+
+Nothing is measured while no slot is subscribed to ``TIMING_EVENT``, ``span`` then gives a shared no-op object."""
+import os
+import json
+import time
+import pathlib
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Optional, NamedTuple, Union
+
+import numpy as np
+from loguru import logger
+
+from llm_benchmarker.events.handlers import EventHandler
+
+
+TIMING_EVENT = "llm_benchmarker.timing"
+
+# names of the spans
+SPAN_BENCHMARK = "benchmark"  # a whole benchmark pipeline
+SPAN_DATASET_LOAD = "dataset_load"  # the slot or the dataset cache
+SPAN_GENERATION = "generation"  # all the batches of one call of ``ModelPipeline``
+SPAN_FORMAT = "format"  # ``prompt_formatter_func`` of a batch
+SPAN_BATCH = "batch"  # ``gen_func`` of a batch
+SPAN_SCORING = "scoring"  # all metrics of a benchmark
+SPAN_METRIC = "metric"  # one metric, its name is the ``metric`` attribute
+
+# time.time() of time.perf_counter() == 0, the spans are measured with perf_counter and reported as unix times
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+class TimingEvent(NamedTuple):
+    """A finished stage of a run"""
+    name: str  # one of the ``SPAN_*`` names
+    benchmark: Optional[str]
+    start: float  # unix time in seconds
+    wall: float  # seconds
+    cpu: float  # cpu seconds of the thread of the stage
+    pid: int
+    thread_id: int
+    attrs: dict  # e.g. ``prompts`` and ``chars`` of a batch, ``metric``, ``error``
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+def is_enabled() -> bool:
+    """``True`` if a slot is subscribed to ``TIMING_EVENT``"""
+    return EventHandler().has_slots(TIMING_EVENT)
+
+
+class Span:
+    """Measures the wall and cpu time of a ``with`` block and emits it as a ``TimingEvent``. an exception of the block
+    is recorded in the ``error`` attribute and raised again. a failing exporter is logged, it never stops the run."""
+    __slots__ = ("name", "benchmark", "attrs", "_start", "_cpu_start")
+
+    def __init__(self, name: str, benchmark: Optional[str] = None, attrs: Optional[dict] = None):
+        self.name = name
+        self.benchmark = benchmark
+        self.attrs = attrs if attrs is not None else {}
+
+    def set(self, **attrs):
+        """Add attributes that are known inside the block, e.g. the number of generated characters."""
+        self.attrs.update(attrs)
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __enter__(self) -> "Span":
+        self._cpu_start = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._start
+        cpu = time.thread_time() - self._cpu_start
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        event = TimingEvent(self.name, self.benchmark, self._start + _EPOCH_OFFSET, wall, cpu, os.getpid(),
+                            threading.get_ident(), self.attrs)
+        for exporter in EventHandler().get_slots(TIMING_EVENT):
+            try:
+                exporter(event)
+            except Exception as e:
+                logger.error(f"Timing exporter {exporter!r} failed on the {self.name} span: {e}")
+        return False
+
+
+class _NullSpan:
+    """The span while timing is off, it's falsy so the callers can skip computing attributes."""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, benchmark: Optional[str] = None, **attrs) -> Union[Span, _NullSpan]:
+    """Time a stage.
+    >>> with span(SPAN_BATCH, "PersianQA", prompts=len(batch)) as s:
+    >>>     outputs = gen_func(batch)
+    >>>     if s:
+    >>>         s.set(chars=sum(map(len, batch)))"""
+    if not EventHandler().has_slots(TIMING_EVENT):
+        return _NULL_SPAN
+    return Span(name, benchmark, attrs)
+
+
+class _Subscriber(ABC):
+    """A slot of ``TIMING_EVENT`` that subscribes itself in ``with`` (or ``subscribe``/``close``)."""
+
+    @abstractmethod
+    def __call__(self, event: TimingEvent):
+        pass
+
+    def subscribe(self):
+        EventHandler().subscribe(TIMING_EVENT, self)
+        return self
+
+    def close(self):
+        if self in EventHandler().get_slots(TIMING_EVENT):
+            EventHandler().unsubscribe(TIMING_EVENT, self)
+
+    def __enter__(self):
+        return self.subscribe()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class TimingSummary(_Subscriber):
+    """Aggregates the events in memory: wall and cpu time per stage and benchmark, the latency percentiles of the
+    ``gen_func`` batches and the prompts and characters per second of the generation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: list[TimingEvent] = []
+
+    def __call__(self, event: TimingEvent):
+        with self._lock:
+            self._events.append(event)
+
+    @property
+    def events(self) -> list[TimingEvent]:
+        with self._lock:
+            return list(self._events)
+
+    def report(self) -> dict:
+        """
+        :returns: ``{benchmark: {"stages": {name: {"count", "wall", "cpu"}}, "metrics": {metric: {"wall", "cpu"}},
+            "batches": {"count", "latency_ms": {"p50", "p95", "p99", "max"}, "prompts_per_second",
+            "chars_per_second"}}}``, the benchmark of the events without one is ``None``"""
+        stages = defaultdict(lambda: defaultdict(lambda: {"count": 0, "wall": 0.0, "cpu": 0.0}))
+        metrics = defaultdict(lambda: defaultdict(lambda: {"wall": 0.0, "cpu": 0.0}))
+        batches = defaultdict(list)
+        for event in self.events:
+            stage = stages[event.benchmark][event.name]
+            stage["count"] += 1
+            stage["wall"] += event.wall
+            stage["cpu"] += event.cpu
+            if event.name == SPAN_METRIC:
+                metric = metrics[event.benchmark][event.attrs.get("metric")]
+                metric["wall"] += event.wall
+                metric["cpu"] += event.cpu
+            elif event.name == SPAN_BATCH:
+                batches[event.benchmark].append(event)
+
+        report = {}
+        for benchmark, benchmark_stages in stages.items():
+            report[benchmark] = {"stages": {name: dict(values) for name, values in benchmark_stages.items()},
+                                 "metrics": {name: dict(values) for name, values in metrics[benchmark].items()}}
+            if batches[benchmark]:
+                report[benchmark]["batches"] = _batch_stats(batches[benchmark])
+        return report
+
+
+def _batch_stats(events: list[TimingEvent]) -> dict:
+    """Latency percentiles and throughput of the ``gen_func`` batches. Concurrent (async) batches overlap, so the
+    throughput is over the time from the first start to the last end, not over the sum of the latencies."""
+    latencies = np.array([event.wall for event in events]) * 1000
+    p50, p95, p99 = (float(value) for value in np.percentile(latencies, [50, 95, 99]))
+    elapsed = max(event.start + event.wall for event in events) - min(event.start for event in events)
+    prompts = sum(event.attrs.get("prompts", 0) for event in events)
+    chars = sum(event.attrs.get("chars", 0) for event in events)
+    return {
+        "count": len(events),
+        "latency_ms": {"p50": p50, "p95": p95, "p99": p99, "max": float(latencies.max())},
+        "prompts_per_second": prompts / elapsed if elapsed > 0 else None,
+        "chars_per_second": chars / elapsed if elapsed > 0 else None,
+    }
+
+
+class JsonLinesExporter(_Subscriber):
+    """Writes every event as a json line as soon as it's emitted, so a running (or crashed) run can be inspected."""
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def __call__(self, event: TimingEvent):
+        line = json.dumps(event.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._file.close()
+
+
+class ChromeTraceExporter(_Subscriber):
+    """Collects the events and writes them on ``close`` in the Chrome trace event format, open the file in
+    ``chrome://tracing`` or https://ui.perfetto.dev. Every thread (e.g. a benchmark with ``max_workers``) is a row."""
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._trace_events: list[dict] = []
+
+    def __call__(self, event: TimingEvent):
+        args = {"benchmark": event.benchmark, "cpu_ms": event.cpu * 1000, **event.attrs}
+        name = event.attrs.get("metric", event.name) if event.name == SPAN_METRIC else event.name
+        trace_event = {"name": name, "cat": event.name, "ph": "X", "ts": event.start * 1e6, "dur": event.wall * 1e6,
+                       "pid": event.pid, "tid": event.thread_id, "args": args}
+        with self._lock:
+            self._trace_events.append(trace_event)
+
+    def trace(self) -> dict:
+        with self._lock:
+            return {"traceEvents": sorted(self._trace_events, key=lambda e: e["ts"]), "displayTimeUnit": "ms"}
+
+    def close(self):
+        super().close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.trace(), f, ensure_ascii=False, default=str)
@@ -1,19 +1,29 @@
 from loguru import logger
+import time
+import pickle
 import inspect
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from typing import Type, Callable
+from pathlib import Path
+from typing import Type, Callable, Union, Optional, TYPE_CHECKING
 
 
 from llm_benchmarker.evals import BaseBench
+from llm_benchmarker.evals import registry
 from llm_benchmarker.dataset import DatasetManager
 from llm_benchmarker.config import GENERATOR_FUNC_KEY, CHAT_TEMPLATE_FUNC, SLOT_DIR_PATH
 from llm_benchmarker.pipelines import ModelPipeline, BenchmarkPipeline
+from llm_benchmarker.sampling import SamplingConfig, EarlyStopping
 from llm_benchmarker.utils import load_slots
+from llm_benchmarker.workqueue import WorkQueue, Heartbeat, default_worker_id
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class BenchManager:
-    def __init__(self, benchmark_model_conf: dict[Type[BaseBench], dict[str, Callable]]):
+    def __init__(self, benchmark_model_conf: dict[Type[BaseBench], dict[str, Callable]],
+                 checkpoint_dir: Union[str, Path, None] = None, download_workers: Optional[int] = None):
         """Manage requested benchmarks
         :param benchmark_model_conf: a dictionary of benchmarks that keys are Benchmarks in the ``evals``
             and values are dictionary as well. the dictionary in the value must have two (key, value) pairs.
@@ -23,6 +33,10 @@ class BenchManager:
             ``system prompt`` as ``str`` and another one is a list of strings. this function gets a syste, prompt
             and a string list of prompts then formmated the prompts for your model and return the formatted as list
             of ``Any``.
+        :param checkpoint_dir: if set, predictions of each benchmark are written batch by batch into
+            ``<checkpoint_dir>/<benchmark name>.jsonl``, then ``run(resume=True)`` continues an interrupted run.
+        :param download_workers: number of datasets that are downloaded at the same time, one per benchmark (at most
+            8) by default. see ``DatasetManager``.
 
         >>> from benchmarker.evals import FarsiBench
         >>> import benchmarker.manager.BenchManager as BenchManager
@@ -51,36 +65,63 @@ class BenchManager:
         """
         self._btypes: list[Type[BaseBench]] = list(set(benchmark_model_conf.keys())) # btype stands for (B)enchmark (TYPE), is a list of requested benchmarks
         self._benchmark_model_conf = benchmark_model_conf # This is the inputted dictionary.
+        self._checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir is not None else None
         self._check_model_benchmark_conf()
         logger.debug("Check datasets per benchmark")
-        self.loader_manager = DatasetManager(self._btypes)
+        self.loader_manager = DatasetManager(self._btypes, max_workers=download_workers)
         logger.debug("Loading the benchmarks")
-        load_slots(SLOT_DIR_PATH)
+        load_slots(SLOT_DIR_PATH, [bt.shared_key() for bt in self._btypes])
+        # keyed by type, a serving benchmark shares the dataset (shared key) of a quality benchmark
         self.benchmarks = {
-           bt.shared_key(): bt() for bt in self._btypes
+           bt: bt() for bt in self._btypes
         }
 
-    def _pipe_creator(self, ) -> dict[Type[BaseBench], BenchmarkPipeline]:
+    def _pipe_creator(self, resume: bool = False, stream_chunk_size: Optional[int] = None,
+                      scoring_workers: int = 1,
+                      sampling: Optional[SamplingConfig] = None,
+                      early_stopping: Optional[EarlyStopping] = None) -> dict[Type[BaseBench], BenchmarkPipeline]:
         """Create Benchmark pipeline for all requested benchmarks.
+        :param resume: continue from the checkpoints of the benchmarks.
+        :param stream_chunk_size: run the benchmarks chunk by chunk with this size.
+        :param scoring_workers: number of processes that score each benchmark.
+        :param sampling: run the benchmarks on a stratified sample of their datasets.
+        :param early_stopping: stop each benchmark when its metric is settled.
         :returns: a dictionary, keys are Benchmark Type and
             values are benchmark pipelines"""
         logger.debug("Create pipelines based on Model info's er benchmarks.")
         results = {}
         for bench_type, fns in self._benchmark_model_conf.items():
-            results[bench_type] = BenchmarkPipeline(self.benchmarks[bench_type.shared_key()],
+            results[bench_type] = BenchmarkPipeline(self.benchmarks[bench_type],
                                                     ModelPipeline(**fns),
-                                                    self.loader_manager.get_loader_by_bench(bench_type))
+                                                    self.loader_manager.get_loader_by_bench(bench_type),
+                                                    checkpoint_path=self._checkpoint_path(bench_type),
+                                                    resume=resume,
+                                                    # a serving benchmark always sends its whole sample
+                                                    stream_chunk_size=None if bench_type.drives_generation
+                                                    else stream_chunk_size,
+                                                    scoring_workers=scoring_workers,
+                                                    sampling=sampling,
+                                                    early_stopping=None if bench_type.drives_generation
+                                                    else early_stopping)
         return results
 
+    def _checkpoint_path(self, benchmark: Type[BaseBench]) -> Optional[Path]:
+        """Path to the checkpoint file of a benchmark, ``None`` if checkpointing is off (or the benchmark has no
+        predictions to keep, see ``BaseBench.drives_generation``)."""
+        if self._checkpoint_dir is None or benchmark.drives_generation:
+            return None
+        return self._checkpoint_dir / f"{benchmark.shared_key()}.jsonl"
+
     def _pipe_per_bench(self, benchmark: Type[BaseBench]) -> BenchmarkPipeline:
         """Create a benchmark pipeline for requested benchmark
         :param benchmark:``Type[BaseBench]``: The type of the benchmark. like FarsiBench
         :returns:``BenchmarkPipeline``: A benchmark pipeline will be returned
         >>> from benchmarker.evals import FarsiBench
         >>> self._pipe_per_bench(FarsiBench)"""
-        return BenchmarkPipeline(self.benchmarks[benchmark.shared_key()],
+        return BenchmarkPipeline(self.benchmarks[benchmark],
                                  ModelPipeline(**self._benchmark_model_conf[benchmark]),
-                                 self.loader_manager.get_loader_by_bench(benchmark.shared_key()))
+                                 self.loader_manager.get_loader_by_bench(benchmark.shared_key()),
+                                 checkpoint_path=self._checkpoint_path(benchmark))
 
 
     def _check_model_benchmark_conf(self, ):
@@ -109,14 +150,16 @@ class BenchManager:
         :returns: the object(instance) of the requested benchmark.
         >>> from benchmarker.evals import FarsiBench
         >>> get_bench_obj_by_btype(FarsiBench)"""
-        return self.benchmarks.get(btype.shared_key())
+        return self.benchmarks.get(btype)
 
     def run_bench_by_dataset(self, __dataset__,):
         ...
 
-    def summary(self) -> pd.DataFrame:
+    def summary(self) -> "pd.DataFrame":
         """A dataframe of the requested benchmark with their names and they're local and remote path.
         :returns: a pandas.DataFrame from this information"""
+        import pandas as pd  # imported here, it's the only user of pandas
+
         return pd.DataFrame({
             "Benchmark Name": [bt.__name__ for bt in self._btypes],
             "Benchmark Dataset Name": [bt.shared_key() for bt in self._btypes],
@@ -130,14 +173,158 @@ class BenchManager:
                                   .get_local_path() for bt in self._btypes]
         })
 
-    def run(self):
+    def warmup(self) -> list[str]:
+        """Check the metrics of the requested benchmarks, so an unknown metric fails before the generation. ``run``
+        calls this too.
+        :returns: names of the metrics"""
+        names = [name for bt in self._btypes for name in bt.metric_names]
+        logger.debug(f"Warming up the metrics {names}")
+        return registry.warmup(names)
+
+    def run(self, max_workers: int = 1, resume: bool = False, stream_chunk_size: Optional[int] = None,
+            scoring_workers: int = 1, sampling: Union[SamplingConfig, float, None] = None,
+            early_stopping: Optional[EarlyStopping] = None):
         """Run all requested benchmarks on your model.
+        :param max_workers: number of benchmarks that run at the same time. with ``1`` (default) benchmarks run one
+            after another. a bigger number runs each benchmark pipeline in its own thread, this is useful when every
+            benchmark has its own ``gen_func`` (e.g. a different endpoint or model replica).
+        :param resume: continue each benchmark from the last completed batch in its checkpoint (needs
+            ``checkpoint_dir``). a checkpoint of another dataset or prompt format is ignored and the benchmark
+            starts over.
+        :param stream_chunk_size: if set, datasets are read, generated and scored in chunks of this size instead of
+            all at once, so big datasets fit in a small memory. it can't be used with ``checkpoint_dir``.
+        :param scoring_workers: with more than one, the predictions of each benchmark are split in shards and scored
+            by a pool of this many processes, all metrics at the same time. the results are the same as with one.
+        :param sampling: run each benchmark on a seeded sample of its dataset that is stratified by the group of the
+            samples (e.g. MMLU subject), a ``SamplingConfig`` or the fraction of the dataset (e.g. ``0.05``). the
+            sample size and the confidence intervals of the metrics (``<metric>_ci``) are added to the results. it
+            can't be used with ``stream_chunk_size``.
+        :param early_stopping: run each dataset in a random order chunk by chunk and stop when the metric is known
+            within a precision or is surely better/worse than a baseline (see ``EarlyStopping``). the number of used
+            samples (``sample_size``) and the interval are added to the results. it can't be used with
+            ``checkpoint_dir`` or ``stream_chunk_size``.
         :returns: a dictionary with keys as the benchmark name and values as dictionary too.
             in dictionary value keys are metrics and values are the value of that metric for that benchmarks"""
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, not {max_workers}")
+        if resume and self._checkpoint_dir is None:
+            raise ValueError("resume needs a checkpoint_dir")
+        results = {}
+        if stream_chunk_size is not None and self._checkpoint_dir is not None:
+            raise ValueError("stream_chunk_size can't be used with checkpoint_dir")
+        if isinstance(sampling, (int, float)):
+            sampling = SamplingConfig(fraction=sampling)
+        if sampling is not None and stream_chunk_size is not None:
+            raise ValueError("sampling can't be used with stream_chunk_size")
+        self.warmup()
+        pipes_dict = self._pipe_creator(resume=resume, stream_chunk_size=stream_chunk_size,
+                                        scoring_workers=scoring_workers, sampling=sampling,
+                                        early_stopping=early_stopping)
+        if max_workers == 1 or len(pipes_dict) < 2:
+            for btype, benchmark_pipe in pipes_dict.items():
+                bout = benchmark_pipe()
+                if bout is not None:
+                    results.update(bout)
+            return results
+
+        outputs = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pipes_dict)),
+                                thread_name_prefix="bench") as executor:
+            futures = {executor.submit(benchmark_pipe): btype for btype, benchmark_pipe in pipes_dict.items()}
+            for future in as_completed(futures):
+                btype = futures[future]
+                logger.debug(f"Benchmark {btype.shared_key()} is finished.")
+                outputs[btype] = future.result()
+        # results are merged in the caller thread and in the requested order, so the output is the same as a
+        # sequential run.
+        for btype in pipes_dict.keys():
+            if outputs[btype] is not None:
+                results.update(outputs[btype])
+        return results
+
+    def _sharded_pipes(self, sampling: Optional[SamplingConfig]) -> dict[str, BenchmarkPipeline]:
+        pipes = {}
+        for btype, pipe in self._pipe_creator(sampling=sampling).items():
+            if btype.drives_generation:
+                logger.warning(f"{btype.__name__} measures the generation itself, it's not run in shards")
+                continue
+            pipes[btype.shared_key()] = pipe
+        return pipes
+
+    def publish(self, queue: Union[str, Path, WorkQueue], shard_size: int = 500,
+                sampling: Optional[SamplingConfig] = None) -> dict[str, int]:
+        """Publish the datasets of the requested benchmarks as shards of ``shard_size`` samples into a work queue,
+        then workers (``work`` or ``python -m llm_benchmarker worker``) run them. publishing the same datasets again
+        keeps the completed shards.
+        :param queue: a ``WorkQueue`` or the path of its SQLite file, e.g. on a shared file system.
+        :param sampling: publish a sample of the datasets, the workers must use the same sampling.
+        :returns: number of shards per benchmark"""
+        queue = queue if isinstance(queue, WorkQueue) else WorkQueue(queue)
+        shards = {}
+        for shared_key, pipe in self._sharded_pipes(sampling).items():
+            shards[shared_key] = queue.publish(shared_key, len(pipe.load_samples()[1]), shard_size,
+                                               pipe.fingerprint())
+            logger.info(f"Published {shards[shared_key]} shards of {shared_key}")
+        return shards
+
+    def work(self, queue: Union[str, Path, WorkQueue], worker_id: Optional[str] = None, poll_interval: float = 5.0,
+             max_shards: Optional[int] = None, wait: bool = True, sampling: Optional[SamplingConfig] = None) -> int:
+        """Run the shards of the requested benchmarks from a work queue until all of them are done. the partial metric
+        states of each shard are written into the queue, ``collect`` merges them.
+        :param worker_id: identifier of the worker in the queue, host name and process id by default.
+        :param poll_interval: seconds between the checks of the queue when the other workers have the remaining
+            shards, a shard of a dead worker is taken over when it gets stale.
+        :param max_shards: stop after this many shards.
+        :param wait: keep polling until all shards are done, otherwise stop when there is no free shard.
+        :param sampling: the sampling of ``publish``.
+        :returns: number of the shards that this worker completed"""
+        queue = queue if isinstance(queue, WorkQueue) else WorkQueue(queue)
+        worker_id = worker_id or default_worker_id()
+        pipes = self._sharded_pipes(sampling)
+        verified = set()
+        completed = 0
+        while max_shards is None or completed < max_shards:
+            shard = queue.claim(worker_id, pipes.keys())
+            if shard is None:
+                if not wait or all(queue.fingerprint(key) is None or queue.is_done(key) for key in pipes):
+                    break
+                time.sleep(poll_interval)
+                continue
+            pipe = pipes[shard.benchmark]
+            try:
+                if shard.benchmark not in verified:
+                    if pipe.fingerprint() != queue.fingerprint(shard.benchmark):
+                        raise ValueError(f"The dataset of {shard.benchmark} on {worker_id} is not the published one")
+                    verified.add(shard.benchmark)
+                logger.info(f"{worker_id} runs shard {shard.shard_id} of {shard.benchmark} "
+                            f"(samples {shard.start}:{shard.stop})")
+                with Heartbeat(queue, shard, worker_id):
+                    accumulator = pipe.run_shard(shard.start, shard.stop)
+            except BaseException:
+                queue.release(shard, worker_id)
+                raise
+            if queue.complete(shard, worker_id, pickle.dumps(accumulator)):
+                completed += 1
+        return completed
+
+    def collect(self, queue: Union[str, Path, WorkQueue], wait: bool = True, poll_interval: float = 5.0,
+                timeout: Optional[float] = None, sampling: Optional[SamplingConfig] = None) -> dict:
+        """Merge the partial metric states of all shards of the requested benchmarks, the results are the same as
+        ``run``. the queue file must be trusted, the states are pickled.
+        :param wait: wait for the running shards, otherwise a benchmark with unfinished shards raises an error.
+        :param timeout: max seconds to wait.
+        :param sampling: the sampling of ``publish``.
+        :returns: the results like ``run``"""
+        queue = queue if isinstance(queue, WorkQueue) else WorkQueue(queue)
+        deadline = time.monotonic() + timeout if timeout is not None else None
         results = {}
-        pipes_dict = self._pipe_creator()
-        for btype, benchmark_pipe in pipes_dict.items():
-            bout = benchmark_pipe()
-            if bout is not None:
-                results.update(bout)
+        for shared_key, pipe in self._sharded_pipes(sampling).items():
+            while not queue.is_done(shared_key):
+                progress = queue.progress(shared_key)
+                if not wait or (deadline is not None and time.monotonic() > deadline):
+                    raise TimeoutError(f"Shards of {shared_key} are not done: {progress}")
+                if progress["stale"]:
+                    logger.warning(f"{progress['stale']} shards of {shared_key} are stale, they wait for a worker")
+                time.sleep(poll_interval)
+            results.update(pipe.merge_shards([pickle.loads(state) for state in queue.states(shared_key)]))
         return results
@@ -0,0 +1,294 @@
+"""Performance suite of the harness itself. Every stage (the slot readers, the dataset cache, ``ModelPipeline``, each
+metric and a whole ``BenchManager`` run) is run on generated fixture datasets with a zero-latency mock ``gen_func``, so
+the measured time is the overhead of the benchmarker only. A report is saved as json and a later report is compared
+with it to find the regressions.
+
+    python -m llm_benchmarker perf --output perf.json
+    python -m llm_benchmarker perf --baseline perf.json --threshold 0.2"""
+import gc
+import os
+import json
+import time
+import random
+import shutil
+import pathlib
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Optional, NamedTuple, Union
+
+import numpy as np
+from loguru import logger
+
+REPORT_VERSION = 1
+PERF_QA_KEY = "PerfPersianQA"
+PERF_MMLU_KEY = "PerfMMLU"
+STAGES = ("reader.persian_qa", "reader.mmlu", "dataset_cache.save", "dataset_cache.load", "model_pipeline",
+          "metric.f1_exact_match", "metric.bleu", "metric.rouge", "metric.accuracy", "metric.mc_accuracy",
+          "bench_manager")
+# changes of the peak memory below this are noise (e.g. an interned string more or less)
+MIN_MEMORY_CHANGE = 64 * 1024
+
+_WORDS = ["کتاب", "خانه", "شهر", "دانشگاه", "تاریخ", "ایران", "زبان", "فارسی", "سال", "مردم", "دریا", "کوه", "علم",
+          "the", "of", "river", "city", "science", "history", "language", "year", "people", "mountain", "school"]
+_SUBJECTS = ["anatomy", "astronomy", "college_physics", "econometrics", "philosophy", "virology", "world_religions",
+             "high_school_biology"]
+
+
+class Regression(NamedTuple):
+    """A measure of a stage that is worse than in the baseline"""
+    stage: str
+    measure: str  # "throughput" or "peak_memory_bytes"
+    baseline: float
+    current: float
+    change: float  # relative change, e.g. -0.3 is 30% less throughput
+
+
+def mock_generation(messages: list[str]) -> list[str]:
+    """A deterministic model without latency, it answers the last three words of each prompt."""
+    return [" ".join(message.split()[-3:]) for message in messages]
+
+
+def mock_formatter(system_prompt: str, prompts: list[str]) -> list[str]:
+    return prompts
+
+
+def _sentence(rnd: random.Random, num_words: int) -> str:
+    return " ".join(rnd.choice(_WORDS) for _ in range(num_words))
+
+
+def write_persian_qa_fixture(path: Union[str, pathlib.Path], samples: int, seed: int = 0) -> pathlib.Path:
+    """Write a SQuAD-like json file with ``samples`` questions, the format of the PersianQA dataset."""
+    rnd = random.Random(f"{seed}:persian_qa")
+    paragraphs = []
+    for ix in range(samples):
+        words = _sentence(rnd, rnd.randint(40, 120)).split()
+        start = rnd.randrange(len(words) - 4)
+        answer = " ".join(words[start:start + rnd.randint(1, 4)])
+        context = " ".join(words)
+        # every 10th question has no answer, like SQuAD 2.0
+        answers = [] if ix % 10 == 9 else [{"text": answer, "answer_start": context.find(answer)}]
+        paragraphs.append({"context": context,
+                           "qas": [{"id": str(ix), "question": _sentence(rnd, rnd.randint(4, 12)) + "؟",
+                                    "answers": answers}]})
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"data": [{"title": "perf", "paragraphs": paragraphs}]}, f, ensure_ascii=False)
+    return path
+
+
+def write_mmlu_fixture(path: Union[str, pathlib.Path], samples: int, seed: int = 0) -> pathlib.Path:
+    """Write an MMLU-like ``datasets`` dataset with a ``test`` split of ``samples`` questions."""
+    from datasets import Dataset, DatasetDict
+
+    rnd = random.Random(f"{seed}:mmlu")
+    rows = {"question": [], "subject": [], "choices": [], "answer": []}
+    for _ in range(samples):
+        rows["question"].append(_sentence(rnd, rnd.randint(8, 30)) + "?")
+        rows["subject"].append(rnd.choice(_SUBJECTS))
+        rows["choices"].append([_sentence(rnd, rnd.randint(1, 6)) for _ in range(4)])
+        rows["answer"].append(rnd.randrange(4))
+    DatasetDict({"test": Dataset.from_dict(rows)}).save_to_disk(str(path))
+    return pathlib.Path(path)
+
+
+def measure(fn: Callable[[], Any], items: int, repeats: int = 5, warmup: int = 1) -> dict:
+    """Run ``fn`` ``repeats`` times and give its throughput, the percentiles of its latency and its peak memory.
+    :param items: number of samples that one call of ``fn`` handles.
+    :param warmup: number of calls before the measured ones (metrics are built, files are in the page cache).
+    :returns: ``throughput`` (items per second of the median call), ``latency_ms`` (percentiles of the calls),
+        ``us_per_item`` and ``peak_memory_bytes`` (python allocations of one more call, from ``tracemalloc``; the
+        memory-mapped arrow buffers are not counted)"""
+    if repeats < 1:
+        raise ValueError(f"repeats must be at least 1, not {repeats}")
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    median = float(np.median(durations))
+    p50, p95, p99 = (float(value) * 1000 for value in np.percentile(durations, [50, 95, 99]))
+    return {
+        "items": items,
+        "repeats": repeats,
+        "throughput": items / median if median > 0 else float("inf"),
+        "us_per_item": median / max(items, 1) * 1e6,
+        "latency_ms": {"p50": p50, "p95": p95, "p99": p99, "max": max(durations) * 1000},
+        "peak_memory_bytes": max(0, peak),
+    }
+
+
+@contextlib.contextmanager
+def _perf_benchmarks(qa_path: pathlib.Path, mmlu_path: pathlib.Path):
+    """Register PersianQA and MMLU with the fixture datasets under their own keys, so the user's dataset cache files
+    are never replaced. Everything is undone at exit."""
+    from llm_benchmarker.config import DATASETS_PER_BENCH, BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, \
+        BENCH_CATEGORY_MULTILING, BENCH_CATEGORY_LANG, DATASET_CACHE_DIR_PATH
+    from llm_benchmarker.dataset import SlotOutputCache
+    from llm_benchmarker.data.readers._multiling import persian_qa_dataset_loader
+    from llm_benchmarker.data.readers._lang import MMLU_load_from_disk
+    from llm_benchmarker.evals import FarsiBench, MMLUBench
+    from llm_benchmarker.events.handlers import EventHandler
+
+    class PerfQABench(FarsiBench):
+        @classmethod
+        def shared_key(cls) -> str:
+            return PERF_QA_KEY
+
+    class PerfMMLUBench(MMLUBench):
+        @classmethod
+        def shared_key(cls) -> str:
+            return PERF_MMLU_KEY
+
+    entries = [(PERF_QA_KEY, BENCH_CATEGORY_MULTILING, qa_path, persian_qa_dataset_loader),
+               (PERF_MMLU_KEY, BENCH_CATEGORY_LANG, mmlu_path, MMLU_load_from_disk)]
+    for key, category, path, slot_fn in entries:
+        DATASETS_PER_BENCH[key] = {"backend": BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, "category": category, "path": key,
+                                   "local_dir": str(path), "download_kwargs": {}}
+        EventHandler().subscribe(key, slot_fn)
+    try:
+        yield PerfQABench, PerfMMLUBench
+    finally:
+        for key, _, _, slot_fn in entries:
+            DATASETS_PER_BENCH.pop(key, None)
+            EventHandler().unsubscribe(key, slot_fn)
+            for cache_file in SlotOutputCache(DATASET_CACHE_DIR_PATH).cache_files(key):
+                cache_file.unlink(missing_ok=True)
+
+
+def run_suite(samples: int = 2000, repeats: int = 5, stages: Optional[Iterable[str]] = None,
+              work_dir: Union[str, pathlib.Path, None] = None, seed: int = 0) -> dict:
+    """Run the stages of the suite and give the report.
+    :param samples: number of samples of each fixture dataset.
+    :param repeats: number of measured runs of each stage.
+    :param stages: names of the stages to run (see ``STAGES``), all of them if it's ``None``.
+    :param work_dir: directory of the fixture datasets, a temporary directory (removed at the end) if it's ``None``.
+    :param seed: seed of the fixture datasets, the same seed always gives the same datasets."""
+    from llm_benchmarker.dataset import SlotOutputCache, materialize_slot_output
+    from llm_benchmarker.data.readers._multiling import persian_qa_dataset_loader
+    from llm_benchmarker.data.readers._lang import MMLU_load_from_disk
+    from llm_benchmarker.evals import registry
+    from llm_benchmarker.manager import BenchManager
+    from llm_benchmarker.pipelines import ModelPipeline
+    from llm_benchmarker.config import GENERATOR_FUNC_KEY, CHAT_TEMPLATE_FUNC, BATCH_SIZE_KEY
+
+    stages = list(STAGES) if stages is None else list(dict.fromkeys(stages))
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}, the stages are {list(STAGES)}")
+    own_dir = work_dir is None
+    work_dir = pathlib.Path(tempfile.mkdtemp(prefix="llm_benchmarker_perf_") if own_dir else work_dir)
+    try:
+        qa_path = write_persian_qa_fixture(work_dir / "persian_qa" / "pqa_test.json", samples, seed)
+        mmlu_path = write_mmlu_fixture(work_dir / "mmlu", samples, seed)
+        qa = materialize_slot_output(persian_qa_dataset_loader(str(qa_path)))
+        mmlu = materialize_slot_output(MMLU_load_from_disk(str(mmlu_path)))
+        qa_predictions = mock_generation(qa.prompts)
+        mmlu_predictions = mock_generation(mmlu.prompts)
+        cache = SlotOutputCache(work_dir / "cache")
+        pipeline = ModelPipeline(gen_func=mock_generation, prompt_formatter_func=mock_formatter, batch_size=32)
+
+        def cache_load():
+            return list(cache.load(PERF_QA_KEY, "perf").prompts)
+
+        def bench_manager():
+            conf = {GENERATOR_FUNC_KEY: mock_generation, CHAT_TEMPLATE_FUNC: mock_formatter, BATCH_SIZE_KEY: 32}
+            return BenchManager({bench: conf for bench in perf_benches}).run()
+
+        stage_fns = {
+            "reader.persian_qa": (lambda: materialize_slot_output(persian_qa_dataset_loader(str(qa_path))),
+                                  len(qa.prompts)),
+            "reader.mmlu": (lambda: materialize_slot_output(MMLU_load_from_disk(str(mmlu_path))), len(mmlu.prompts)),
+            "dataset_cache.save": (lambda: cache.save(PERF_QA_KEY, "perf", qa), len(qa.prompts)),
+            "dataset_cache.load": (cache_load, len(qa.prompts)),
+            "model_pipeline": (lambda: pipeline(qa.system_prompt, qa.prompts), len(qa.prompts)),
+            "metric.f1_exact_match": (lambda: registry.get_metric("f1_exact_match")(qa_predictions, qa.targets),
+                                      len(qa.prompts)),
+            "metric.bleu": (lambda: registry.get_metric("bleu")(qa_predictions, qa.targets), len(qa.prompts)),
+            "metric.rouge": (lambda: registry.get_metric("rouge")(qa_predictions, qa.targets), len(qa.prompts)),
+            "metric.accuracy": (lambda: registry.get_metric("accuracy")(qa_predictions, qa.targets), len(qa.prompts)),
+            "metric.mc_accuracy": (lambda: registry.get_metric("mc_accuracy")(mmlu_predictions, mmlu.targets,
+                                                                              mmlu.groups), len(mmlu.prompts)),
+            "bench_manager": (bench_manager, len(qa.prompts) + len(mmlu.prompts)),
+        }
+        if "dataset_cache.load" in stages:
+            cache.save(PERF_QA_KEY, "perf", qa)
+
+        results = {}
+        with _perf_benchmarks(qa_path, mmlu_path) as perf_benches:
+            for stage in stages:
+                fn, items = stage_fns[stage]
+                logger.info(f"Measuring {stage} on {items} samples")
+                results[stage] = measure(fn, items, repeats)
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "version": REPORT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"samples": samples, "repeats": repeats, "seed": seed},
+        "stages": results,
+    }
+
+
+def save_report(report: dict, path: Union[str, pathlib.Path]):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_report(path: Union[str, pathlib.Path]) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.2) -> list[Regression]:
+    """Find the stages that are slower or need more memory than in the baseline.
+    :param threshold: the allowed relative change, e.g. ``0.2`` allows 20% less throughput and 20% more peak memory.
+    :returns: the regressions, an empty list if there is none"""
+    if threshold < 0:
+        raise ValueError(f"threshold must not be negative, not {threshold}")
+    if report.get("config") != baseline.get("config"):
+        logger.warning(f"The report ({report.get('config')}) and the baseline ({baseline.get('config')}) are run "
+                       f"with different settings, the comparison is not exact")
+    regressions = []
+    for stage, current in report.get("stages", {}).items():
+        old = baseline.get("stages", {}).get(stage)
+        if old is None:
+            logger.info(f"Stage {stage} is not in the baseline")
+            continue
+        if old["throughput"] > 0 and current["throughput"] < old["throughput"] * (1 - threshold):
+            regressions.append(Regression(stage, "throughput", old["throughput"], current["throughput"],
+                                          current["throughput"] / old["throughput"] - 1))
+        old_memory, memory = old["peak_memory_bytes"], current["peak_memory_bytes"]
+        if memory > old_memory * (1 + threshold) and memory - old_memory > MIN_MEMORY_CHANGE:
+            regressions.append(Regression(stage, "peak_memory_bytes", old_memory, memory,
+                                          memory / old_memory - 1 if old_memory else float("inf")))
+    return regressions
@@ -1,72 +1,483 @@
 """This Module provide us with some functionality for make benchmarks running easier with pipelines.
 """
 
+import time
+import asyncio
+import inspect
+import pathlib
+
+from loguru import logger
+
 from llm_benchmarker.evals import BaseBench
-from llm_benchmarker.dataset import BenchDatasetLoader
+from llm_benchmarker.evals.base import BenchAccumulator
+from llm_benchmarker.dataset import BenchDatasetLoader, iter_slot_samples, chunked
+from llm_benchmarker.events import timing
+from llm_benchmarker.batching import AdaptiveBatchSizer, is_oom_error
+from llm_benchmarker.cache import PredictionCache
+from llm_benchmarker.checkpoint import Checkpoint
+from llm_benchmarker.sampling import SamplingConfig, EarlyStopping, add_confidence_intervals
+from llm_benchmarker.berrors import LengthMisMatchError
+from llm_benchmarker.config import DEFAULT_BATCH_SIZE, BATCH_SIZE_STORE_PATH
+from llm_benchmarker.utils import run_coroutine
 
-from typing import Callable, Any
+from typing import Callable, Any, Iterator, Tuple, Optional, Union
 
 
 class ModelPipeline:
     """With this class a pipeline for the model will be created."""
     def __init__(self, gen_func: Callable[[Any], list[str]],
-                 prompt_formatter_func: Callable[[str, list[str]], Any]):
+                 prompt_formatter_func: Callable[[str, list[str]], Any],
+                 max_concurrency: int = 1,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 adaptive_batch_size: bool = False,
+                 batch_size_store: Union[str, pathlib.Path, None] = BATCH_SIZE_STORE_PATH,
+                 sort_by_length: bool = False,
+                 length_func: Optional[Callable[[str], int]] = None,
+                 max_batch_tokens: Optional[int] = None,
+                 prediction_cache: Optional[PredictionCache] = None):
         """A pipeline will be created base on inputted functions
-        :param gen_func: The generated function of the model
-        :param prompt_formatter_func: A function the formatted the input prompt"""
+        :param gen_func: The generated function of the model. It can be a coroutine function (``async def``), in
+            that case several batches are sent to it at the same time.
+        :param prompt_formatter_func: A function the formatted the input prompt
+        :param max_concurrency: Maximum number of batches that are in flight at once when ``gen_func`` is a
+            coroutine function. It is ignored for regular functions.
+        :param batch_size: Number of prompts per call of ``gen_func``. with ``adaptive_batch_size`` it's the
+            initial size.
+        :param adaptive_batch_size: If ``True`` the batch size grows while the latency per prompt improves and
+            the failing batch is bisected on OOM errors. See ``llm_benchmarker.batching.AdaptiveBatchSizer``.
+        :param batch_size_store: json file that the chosen batch size of each benchmark is saved in and loaded
+            from in the later runs. ``None`` disables it.
+        :param sort_by_length: If ``True`` prompts are sorted by their length (longest first) before batching, so
+            prompts with similar lengths share a batch and padding-based backends waste less compute. Outputs are
+            still returned in the order of the prompts.
+        :param length_func: A function that gives the length of a prompt, e.g. number of tokens with your tokenizer.
+            default is the number of characters.
+        :param max_batch_tokens: If set, a batch is closed before its padded size (length of its longest prompt
+            times number of prompts) goes above this budget. ``batch_size`` is still the max number of prompts.
+            Setting this turns ``sort_by_length`` on.
+        :param prediction_cache: An on-disk cache of the predictions (see ``llm_benchmarker.cache.PredictionCache``).
+            prompts that are found in it are not sent to ``gen_func`` and new predictions are written into it."""
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, not {max_concurrency}")
         self.gen_func: Callable[[Any], list[str]] = gen_func
         self.prompt_formatter: Callable[[str, list[str]], Any] = prompt_formatter_func
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.adaptive_batch_size = adaptive_batch_size
+        self.batch_size_store = batch_size_store
+        self.sort_by_length = sort_by_length or max_batch_tokens is not None
+        self.length_func: Callable[[str], int] = length_func if length_func is not None else len
+        self.max_batch_tokens = max_batch_tokens
+        self.prediction_cache = prediction_cache
+        if adaptive_batch_size and self.is_async:
+            logger.warning("adaptive_batch_size is not supported for async gen_func, batch_size is used as is.")
 
-    def __call__(self, sys_prompt: str, prompts: list[str], batch_size) -> list[str]:
+    @property
+    def is_async(self) -> bool:
+        """``True`` when ``gen_func`` is a coroutine function"""
+        return inspect.iscoroutinefunction(self.gen_func) or \
+            inspect.iscoroutinefunction(getattr(self.gen_func, "__call__", None))
+
+    def __call__(self, sys_prompt: str, prompts: list[str], batch_size: Optional[int] = None,
+                 key: Optional[str] = None,
+                 on_batch: Optional[Callable[[list[int], list[str]], None]] = None,
+                 known_predictions: Optional[dict[int, str]] = None) -> list[str]:
         """Runs prompt_formatter_func and gen_func in order to get output of the model with specified batch size.
         :param sys_prompt: This is a system prompt for the model.
         :param prompts: list pf prompts to be processed by the model.
-        :param batch_size: Batch size for put data in it.
+        :param batch_size: Batch size for put data in it. if ``None`` the ``batch_size`` of the pipeline is used.
+        :param key: name of the benchmark that prompts belong to. the adaptive batch size is saved under this key.
+        :param on_batch: a function that is called after each generated batch with the indices of the batch prompts
+            (in ``prompts``) and their outputs.
+        :param known_predictions: predictions that are already generated (e.g. loaded from a checkpoint) by their
+            index in ``prompts``. these prompts are not sent to the model.
         :returns: a list model output w.r.t input prompts"""
-        results = []
-        ix = 0
-        while True:
-            start_ix = batch_size * ix
-            end_ix = batch_size * (ix+1)
-            if end_ix > len(prompts) and start_ix > len(prompts):
-                break
-            if end_ix > len(prompts) > start_ix:
-                results += self._run(sys_prompt, prompts[start_ix:])
-            else:
-                results += self._run(sys_prompt, prompts[start_ix:end_ix])
-            ix += 1
+        batch_size = self.batch_size if batch_size is None else batch_size
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, not {batch_size}")
+        results: list[Optional[str]] = [None] * len(prompts)
+        order = list(range(len(prompts)))
+        if known_predictions:
+            for ix, prediction in known_predictions.items():
+                results[ix] = prediction
+            order = [ix for ix in order if ix not in known_predictions]
+
+        cache_keys = None
+        if self.prediction_cache is not None:
+            cache_keys = {ix: self.prediction_cache.key(self.prompt_formatter(sys_prompt, [prompts[ix]]))
+                          for ix in order}
+            hits = self.prediction_cache.get_many(list(cache_keys.values()))
+            for ix in order:
+                if cache_keys[ix] in hits:
+                    results[ix] = hits[cache_keys[ix]]
+            misses = [ix for ix in order if cache_keys[ix] not in hits]
+            logger.debug(f"Prediction cache: {len(order) - len(misses)} hits, {len(misses)} misses")
+            order = misses
+
+        lengths = None
+        if self.sort_by_length:
+            all_lengths = {ix: self.length_func(prompts[ix]) for ix in order}
+            order.sort(key=lambda ix: all_lengths[ix], reverse=True)
+            lengths = [all_lengths[ix] for ix in order]
+
+        def collect(batch_ix: list[int], outputs: list[str]):
+            # outputs are scattered back to the order of the prompts
+            for ix, output in zip(batch_ix, outputs):
+                results[ix] = output
+            if cache_keys is not None:
+                self.prediction_cache.put_many([(cache_keys[ix], output) for ix, output in zip(batch_ix, outputs)])
+            if on_batch is not None:
+                on_batch(batch_ix, outputs)
+
+        if order:
+            with timing.span(timing.SPAN_GENERATION, key, prompts=len(order)):
+                self._generate(sys_prompt, prompts, order, batch_size, key, collect, lengths)
         return results
 
-    def _run(self, sys_prompt: str, batch_prompt: list[str]) -> list[str]:
+    def _generate(self, sys_prompt: str, prompts: list[str], order: list[int], batch_size: int, key: Optional[str],
+                  on_batch: Callable[[list[int], list[str]], None], lengths: Optional[list[int]] = None):
+        """Send the prompts to the model batch by batch.
+        :param order: indices of the prompts that must be generated, in the order they are sent to the model.
+        :param on_batch: called with the indices and the outputs of each batch.
+        :param lengths: lengths of the prompts in ``order``, needed for ``max_batch_tokens``."""
+        if self.is_async:
+            batches = [order[start_ix:end_ix] for start_ix, end_ix in self._batches(len(order), batch_size, lengths)]
+            return self._run_async(sys_prompt, prompts, batches, on_batch, key)
+        if self.adaptive_batch_size:
+            return self._run_adaptive(sys_prompt, prompts, order, batch_size, key, on_batch, lengths)
+        for start_ix, end_ix in self._batches(len(order), batch_size, lengths):
+            batch_ix = order[start_ix:end_ix]
+            on_batch(batch_ix, self._run(sys_prompt, [prompts[ix] for ix in batch_ix], key))
+
+    def _batches(self, length: int, batch_size: int,
+                 lengths: Optional[list[int]] = None) -> Iterator[Tuple[int, int]]:
+        """Split ``range(length)`` into ``(start, end)`` ranges of at most ``batch_size`` items (and at most
+        ``max_batch_tokens`` padded tokens if ``lengths`` is given)."""
+        start_ix = 0
+        while start_ix < length:
+            end_ix = self._batch_end(start_ix, batch_size, length, lengths)
+            yield start_ix, end_ix
+            start_ix = end_ix
+
+    def _batch_end(self, start_ix: int, batch_size: int, length: int, lengths: Optional[list[int]] = None) -> int:
+        """Give the end index of the batch that starts at ``start_ix``. a batch has at least one item, even if
+        that item alone is longer than ``max_batch_tokens``."""
+        end_ix = min(start_ix + batch_size, length)
+        if self.max_batch_tokens is None or lengths is None:
+            return end_ix
+        longest = 0
+        for ix in range(start_ix, end_ix):
+            longest = max(longest, lengths[ix])
+            if ix > start_ix and longest * (ix - start_ix + 1) > self.max_batch_tokens:
+                return ix
+        return end_ix
+
+    def _run(self, sys_prompt: str, batch_prompt: list[str], key: Optional[str] = None) -> list[str]:
         """Run pipeline on a batch of prompts
         :param sys_prompt: This is a system prompt for the model.
         :param batch_prompt: list pf prompts to be processed by the model.
+        :param key: name of the benchmark, for the timing events.
         :returns: a list model output w.r.t input prompts"""
-        formatted_prompts = self.prompt_formatter(sys_prompt, batch_prompt)
-        return self.gen_func(formatted_prompts)
+        with timing.span(timing.SPAN_FORMAT, key, prompts=len(batch_prompt)):
+            formatted_prompts = self.prompt_formatter(sys_prompt, batch_prompt)
+        with timing.span(timing.SPAN_BATCH, key, prompts=len(batch_prompt)) as span:
+            outputs = self._check_outputs(batch_prompt, self.gen_func(formatted_prompts))
+            if span:
+                span.set(**self._batch_chars(batch_prompt, outputs))
+        return outputs
+
+    @staticmethod
+    def _batch_chars(batch_prompt: list[str], outputs: list[str]) -> dict:
+        """Characters of the prompts and of the outputs of a batch, for the throughput of the timing events."""
+        return {"chars": sum(len(prompt) for prompt in batch_prompt if isinstance(prompt, str)),
+                "output_chars": sum(len(output) for output in outputs if isinstance(output, str))}
+
+    @staticmethod
+    def _check_outputs(batch_prompt: list[str], outputs: list[str]) -> list[str]:
+        """Make sure that ``gen_func`` gave one output per prompt."""
+        outputs = list(outputs)
+        if len(outputs) != len(batch_prompt):
+            raise LengthMisMatchError(f"gen_func returned {len(outputs)} outputs for {len(batch_prompt)} prompts")
+        return outputs
+
+    def _run_adaptive(self, sys_prompt: str, prompts: list[str], order: list[int], batch_size: int,
+                      key: Optional[str], on_batch: Callable[[list[int], list[str]], None],
+                      lengths: Optional[list[int]] = None):
+        """Run all prompts with a batch size that is adapted after each batch."""
+        store_path = self.batch_size_store if key is not None else None
+        sizer = AdaptiveBatchSizer.load(key, store_path, initial=batch_size)
+        start_ix = 0
+        while start_ix < len(order):
+            batch_ix = order[start_ix:self._batch_end(start_ix, sizer.size, len(order), lengths)]
+            on_batch(batch_ix, self._run_bisect(sys_prompt, [prompts[ix] for ix in batch_ix], sizer, key))
+            start_ix += len(batch_ix)
+        sizer.save(key, store_path)
+
+    def _run_bisect(self, sys_prompt: str, batch_prompt: list[str], sizer: AdaptiveBatchSizer,
+                    key: Optional[str] = None) -> list[str]:
+        """Run a batch, if it fails with an OOM error, it is split into parts of the new size of ``sizer`` (at most
+        halves) that are run one after another."""
+        started = time.perf_counter()
+        try:
+            outputs = self._run(sys_prompt, batch_prompt, key)
+        except Exception as e:
+            if len(batch_prompt) < 2 or not is_oom_error(e):
+                raise
+            sizer.failed(len(batch_prompt))
+            outputs = []
+            while len(outputs) < len(batch_prompt):
+                # the size of each part is taken after the previous one, it may have failed too
+                step = max(1, min(sizer.size, len(batch_prompt) // 2))
+                outputs += self._run_bisect(sys_prompt, batch_prompt[len(outputs):len(outputs) + step], sizer, key)
+            return outputs
+        sizer.succeeded(len(batch_prompt), time.perf_counter() - started)
+        return outputs
+
+    async def _arun(self, sys_prompt: str, prompts: list[str], batch_ix: list[int], semaphore: asyncio.Semaphore,
+                    on_batch: Callable[[list[int], list[str]], None], key: Optional[str] = None):
+        """Async version of ``_run``, at most ``max_concurrency`` of these await ``gen_func`` at the same time."""
+        batch_prompt = [prompts[ix] for ix in batch_ix]
+        async with semaphore:
+            with timing.span(timing.SPAN_FORMAT, key, prompts=len(batch_prompt)):
+                formatted_prompts = self.prompt_formatter(sys_prompt, batch_prompt)
+            # the cpu time of the batch includes the other batches that run on the loop in the meantime
+            with timing.span(timing.SPAN_BATCH, key, prompts=len(batch_prompt)) as span:
+                outputs = self._check_outputs(batch_prompt, await self.gen_func(formatted_prompts))
+                if span:
+                    span.set(**self._batch_chars(batch_prompt, outputs))
+        on_batch(batch_ix, outputs)
+
+    async def _arun_batches(self, sys_prompt: str, prompts: list[str], batches: list[list[int]],
+                            on_batch: Callable[[list[int], list[str]], None], key: Optional[str] = None):
+        """Send all batches to ``gen_func`` with bounded concurrency."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.gather(*[self._arun(sys_prompt, prompts, batch_ix, semaphore, on_batch, key)
+                               for batch_ix in batches])
+
+    def _run_async(self, sys_prompt: str, prompts: list[str], batches: list[list[int]],
+                   on_batch: Callable[[list[int], list[str]], None], key: Optional[str] = None):
+        """Run the async batches to completion, in a helper thread if the caller is already inside an event loop
+        (see ``run_coroutine``)."""
+        return run_coroutine(self._arun_batches(sys_prompt, prompts, batches, on_batch, key))
 
 
 class BenchmarkPipeline:
     """With this class a pipeline for the Benchmark will be created."""
-    def __init__(self, bobj: BaseBench, model_pipeline: ModelPipeline, dataset_loader: BenchDatasetLoader):
+    def __init__(self, bobj: BaseBench, model_pipeline: ModelPipeline, dataset_loader: BenchDatasetLoader,
+                 checkpoint_path: Union[str, pathlib.Path, None] = None, resume: bool = False,
+                 stream_chunk_size: Optional[int] = None, scoring_workers: int = 1,
+                 sampling: Optional[SamplingConfig] = None, early_stopping: Optional[EarlyStopping] = None):
         """Create a pipeline for a benchmark base on benchmark object(not type),
          the pipeline of the model and dataset loader
         :param bobj: stands for (B)enchmark (OBJ)ect, an object of the requested benchmark.
         :param model_pipeline: a model pipeline that made from ``ModelPipeline``.
-        :param dataset_loader: an instance of dataset loader related to the benchmark type"""
+        :param dataset_loader: an instance of dataset loader related to the benchmark type
+        :param checkpoint_path: if set, predictions of each completed batch are written into this file.
+        :param resume: continue from the predictions in ``checkpoint_path`` if it belongs to the same dataset and
+            prompt format.
+        :param stream_chunk_size: if set, the dataset is read, generated and scored in chunks of this size, so the
+            memory doesn't grow with the size of the dataset. checkpoints are not supported in this mode.
+        :param scoring_workers: with more than one, the predictions are scored by a pool of this many processes
+            (see ``BaseBench.compute_parallel``).
+        :param sampling: run the benchmark on a stratified sample of the dataset, the sample size and the confidence
+            intervals are reported with the metrics. it's not supported with ``stream_chunk_size``.
+        :param early_stopping: run the dataset in a random order chunk by chunk and stop calling ``gen_func`` when the
+            metric is settled (see ``EarlyStopping``). it's not supported with checkpoints or ``stream_chunk_size``."""
+        if stream_chunk_size is not None and checkpoint_path is not None:
+            raise ValueError("Checkpoints are not supported with stream_chunk_size")
+        if stream_chunk_size is not None and sampling is not None:
+            raise ValueError("Sampling is not supported with stream_chunk_size")
+        if bobj.drives_generation and (stream_chunk_size is not None or early_stopping is not None):
+            raise ValueError(f"{bobj.benchmark_name} sends the prompts itself, it can't be streamed or stopped early")
+        if early_stopping is not None:
+            if stream_chunk_size is not None or checkpoint_path is not None:
+                raise ValueError("Early stopping is not supported with checkpoints or stream_chunk_size")
+            if early_stopping.metric not in bobj.interval_metrics:
+                raise ValueError(f"{bobj.shared_key()} has no confidence interval for {early_stopping.metric}, "
+                                 f"the metrics with an interval are {sorted(bobj.interval_metrics)}")
         self.bobj = bobj
         self._model_pipeline = model_pipeline
         self._dataset_loader = dataset_loader
+        self._checkpoint_path = checkpoint_path
+        self._resume = resume
+        self._stream_chunk_size = stream_chunk_size
+        self._scoring_workers = scoring_workers
+        self._sampling = sampling
+        self._early_stopping = early_stopping
+        self._samples: Optional[Tuple[str, list, list, Optional[list]]] = None
 
     def __call__(self, *args, **kwargs):
         """Runs the ```self._run``` and return its output."""
-        return self._run()
+        with timing.span(timing.SPAN_BENCHMARK, self.bobj.shared_key()):
+            return self._run()
+
+    def _load(self) -> Tuple[str, list, list, Optional[list]]:
+        """Load the whole dataset of the benchmark."""
+        with timing.span(timing.SPAN_DATASET_LOAD, self.bobj.shared_key()) as span:
+            system_prompt, prompts, targets, groups = self._dataset_loader.load_from_disk()[self.bobj.shared_key()]
+            if span:
+                span.set(prompts=len(prompts))
+        return system_prompt, prompts, targets, groups
+
+    def _update(self, accumulator: BenchAccumulator, predictions: list[str], targets: list,
+                groups: Optional[list] = None):
+        """Score a chunk of predictions into ``accumulator``."""
+        with timing.span(timing.SPAN_SCORING, self.bobj.shared_key(), prompts=len(predictions)):
+            accumulator.update(predictions, targets, groups)
 
     def _run(self):
         """this will run the benchmark pipeline with defined attribute. system prompt, prompts and targets loaded by
         dataset loader of the related benchmark then they passed into model pipeline and finally the results passed
         to the benchmark to compute the benchmarks
         :returns: a dictionary of the calculated metrics in benchmarks"""
-        system_prompt, prompts, targets = self._dataset_loader.load_from_disk()[self.bobj.shared_key()]
-        predictions = self._model_pipeline(system_prompt, prompts, 50)
-        return self.bobj.compute(predictions, targets)
+        if self._stream_chunk_size is not None:
+            return self._run_stream()
+        system_prompt, prompts, targets, groups = self._load()
+        population_size = len(prompts)
+        if self._sampling is not None:
+            prompts, targets, groups = self._sample(prompts, targets, groups)
+        if self.bobj.drives_generation:
+            return self.bobj.run_generation(self._model_pipeline, system_prompt, list(prompts))
+        if self._early_stopping is not None:
+            return self._run_early_stopping(system_prompt, prompts, targets, groups, population_size)
+        checkpoint = self._open_checkpoint(system_prompt, prompts, targets)
+        try:
+            predictions = self._model_pipeline(
+                system_prompt, prompts, key=self.bobj.shared_key(),
+                on_batch=checkpoint.write if checkpoint is not None else None,
+                known_predictions=checkpoint.known_predictions if checkpoint is not None else None
+            )
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        results = self._compute(predictions, targets, groups)
+        if self._sampling is not None:
+            # the interval is over the scored samples, the invalid predictions are not in the metric
+            num_scored = self.bobj.num_scored(predictions)
+            for metrics in results.values():
+                add_confidence_intervals(metrics, self.bobj.interval_metrics, num_scored, population_size,
+                                         self._sampling.confidence)
+        return results
+
+    def _run_early_stopping(self, system_prompt: str, prompts: list, targets: list, groups: Optional[list],
+                            population_size: int) -> dict:
+        """Generate and score the samples chunk by chunk in a random order until the metric is settled.
+        :param population_size: size of the dataset before ``sampling``, the stopping rule and the confidence interval
+            of the results are over it. the run stops early if it ends before all of ``prompts`` are generated."""
+        stopping = self._early_stopping
+        scale = self.bobj.interval_metrics[stopping.metric]
+        order = stopping.order(len(prompts))
+        accumulator = self.bobj.accumulator()
+        reason, num_samples = None, 0
+        # the stopping metric is a mean of per-sample scores: the mean of the chunk means weighted by their scored
+        # samples is the metric of all chunks, so finalizing the whole run (e.g. ``compute`` on all buffered
+        # predictions) after every chunk is not needed
+        score_sum, num_scored = 0.0, 0
+        for start_ix in range(0, len(order), stopping.chunk_size):
+            chunk = order[start_ix:start_ix + stopping.chunk_size]
+            predictions = self._model_pipeline(system_prompt, [prompts[ix] for ix in chunk],
+                                               key=self.bobj.shared_key())
+            chunk_accumulator = self.bobj.accumulator()
+            self._update(chunk_accumulator, predictions, [targets[ix] for ix in chunk],
+                         [groups[ix] for ix in chunk] if groups is not None else None)
+            num_samples += len(chunk)
+            chunk_value = next(iter(chunk_accumulator.finalize().values())).get(stopping.metric)
+            if isinstance(chunk_value, (int, float)):
+                score_sum += chunk_value * chunk_accumulator.num_scored
+                num_scored += chunk_accumulator.num_scored
+            accumulator.merge(chunk_accumulator)
+            if num_scored > 0 and num_samples < len(order):
+                value = score_sum / num_scored
+                reason = stopping.stop_reason(value, scale, num_scored, population_size)
+                if reason is not None:
+                    logger.info(f"{self.bobj.shared_key()} stopped after {num_samples} of {len(order)} samples, "
+                                f"{stopping.metric} is {value} ({reason})")
+                    break
+        results = accumulator.finalize()
+        # the intervals are over the scored samples, the invalid predictions are not in the metric
+        num_scored = accumulator.num_scored
+        for metrics in results.values():
+            add_confidence_intervals(metrics, self.bobj.interval_metrics, num_scored, population_size,
+                                     stopping.confidence)
+            stopping.report(metrics, scale, num_scored, population_size, reason)
+        return results
+
+    def load_samples(self) -> Tuple[str, list, list, Optional[list]]:
+        """The system prompt, prompts, targets and groups of the dataset (the sample of it with ``sampling``). it's
+        loaded once, a worker runs many shards of the same dataset."""
+        if self._samples is None:
+            system_prompt, prompts, targets, groups = self._load()
+            if self._sampling is not None:
+                prompts, targets, groups = self._sample(prompts, targets, groups)
+            self._samples = system_prompt, prompts, targets, groups
+        return self._samples
+
+    def fingerprint(self) -> str:
+        """Hash of the formatted prompts and the targets, the coordinator and the workers of a sharded run must have
+        the same dataset."""
+        system_prompt, prompts, targets, _ = self.load_samples()
+        formatted_prompts = self._model_pipeline.prompt_formatter(system_prompt, prompts)
+        return Checkpoint.make_fingerprint(system_prompt, formatted_prompts, targets)
+
+    def run_shard(self, start: int, stop: int,
+                  on_batch: Optional[Callable[[list[int], list[str]], None]] = None) -> BenchAccumulator:
+        """Generate the predictions of the samples ``start:stop`` of the dataset and score them.
+        :param on_batch: called after each completed batch of the shard, e.g. for a heartbeat.
+        :returns: the accumulator of the shard, its state is merged with the other shards by ``merge_shards``"""
+        system_prompt, prompts, targets, groups = self.load_samples()
+        predictions = self._model_pipeline(system_prompt, prompts[start:stop], key=self.bobj.shared_key(),
+                                           on_batch=on_batch)
+        accumulator = self.bobj.accumulator()
+        self._update(accumulator, predictions, list(targets[start:stop]),
+                     list(groups[start:stop]) if groups is not None else None)
+        return accumulator
+
+    def merge_shards(self, accumulators: list[BenchAccumulator]) -> dict:
+        """Merge the accumulators of all shards (in shard order) and give the results of the benchmark."""
+        merged = self.bobj.accumulator()
+        for accumulator in accumulators:
+            merged.merge(accumulator)
+        return merged.finalize()
+
+    def _sample(self, prompts: list, targets: list, groups: Optional[list]) -> Tuple[list, list, Optional[list]]:
+        """Keep the samples of the stratified sample (see ``SamplingConfig``)."""
+        indices = self._sampling.indices(len(prompts), groups)
+        logger.info(f"Running {self.bobj.shared_key()} on {len(indices)} of {len(prompts)} samples")
+        return ([prompts[ix] for ix in indices], [targets[ix] for ix in indices],
+                [groups[ix] for ix in indices] if groups is not None else None)
+
+    def _compute(self, predictions: list[str], targets: list, groups: Optional[list] = None):
+        """Run ``compute`` of the benchmark, ``groups`` is only passed if the slot gave it."""
+        with timing.span(timing.SPAN_SCORING, self.bobj.shared_key(), prompts=len(predictions)):
+            return self._compute_metrics(predictions, targets, groups)
+
+    def _compute_metrics(self, predictions: list[str], targets: list, groups: Optional[list] = None):
+        if self._scoring_workers > 1:
+            return self.bobj.compute_parallel(predictions, targets, num_workers=self._scoring_workers, groups=groups)
+        if groups is None:
+            return self.bobj.compute(predictions, targets)
+        return self.bobj.compute(predictions, targets, groups=groups)
+
+    def _run_stream(self):
+        """Run the benchmark chunk by chunk, only one chunk of prompts, targets and predictions is in memory."""
+        with timing.span(timing.SPAN_DATASET_LOAD, self.bobj.shared_key(), stream=True):
+            output = self._dataset_loader.load_from_disk(stream=True)[self.bobj.shared_key()]
+        system_prompt, samples = iter_slot_samples(output)
+        accumulator = self.bobj.accumulator()
+        for chunk in chunked(samples, self._stream_chunk_size):
+            prompts = [sample[0] for sample in chunk]
+            targets = [sample[1] for sample in chunk]
+            groups = [sample[2] for sample in chunk] if len(chunk[0]) > 2 else None
+            predictions = self._model_pipeline(system_prompt, prompts, key=self.bobj.shared_key())
+            self._update(accumulator, predictions, targets, groups)
+        return accumulator.finalize()
+
+    def _open_checkpoint(self, system_prompt: str, prompts: list[str], targets: list) -> Optional[Checkpoint]:
+        """Open the checkpoint of the run if it's requested."""
+        if self._checkpoint_path is None:
+            return None
+        formatted_prompts = self._model_pipeline.prompt_formatter(system_prompt, prompts)
+        checkpoint = Checkpoint(self._checkpoint_path,
+                                Checkpoint.make_fingerprint(system_prompt, formatted_prompts, targets))
+        checkpoint.open(resume=self._resume)
+        return checkpoint
@@ -0,0 +1,163 @@
+"""Stratified subsampling and early stopping of the benchmark runs, for quick (e.g. per-checkpoint) runs. Such a run
+reports its sample size and a confidence interval next to the metrics, so the error of the estimate is known."""
+import math
+import random
+import statistics
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence, Hashable
+
+
+@dataclass(frozen=True)
+class SamplingConfig:
+    """How a benchmark dataset is subsampled.
+
+    Samples are stratified by their group (the key that the slot gives per sample, e.g. the MMLU subject): every
+    group gets its share of the sample (at least ``min_per_group`` samples), so the small groups are not missed. The
+    sample only depends on ``seed``, the groups and the number of samples, so the same checkpoint is always evaluated
+    on the same questions."""
+    fraction: Optional[float] = None  # the part of the dataset to keep, e.g. 0.05
+    size: Optional[int] = None  # or the number of samples to keep
+    seed: int = 0
+    min_per_group: int = 1
+    confidence: float = 0.95  # level of the reported confidence intervals
+
+    def __post_init__(self):
+        if (self.fraction is None) == (self.size is None):
+            raise ValueError("Exactly one of fraction and size must be set")
+        if self.fraction is not None and not 0 < self.fraction <= 1:
+            raise ValueError(f"fraction must be in (0, 1], not {self.fraction}")
+        if self.size is not None and self.size < 1:
+            raise ValueError(f"size must be at least 1, not {self.size}")
+        if not 0 < self.confidence < 1:
+            raise ValueError(f"confidence must be in (0, 1), not {self.confidence}")
+
+    def indices(self, num_samples: int, groups: Optional[Sequence[Hashable]] = None) -> list[int]:
+        """Give the sorted indices of the sampled samples.
+        :param num_samples: size of the dataset.
+        :param groups: the group of each sample, all samples are in one group if it's ``None``."""
+        target = min(num_samples, self.size if self.size is not None else round(self.fraction * num_samples))
+        members = defaultdict(list)
+        for ix in range(num_samples):
+            members[groups[ix] if groups is not None else None].append(ix)
+        quotas = _allocate(target, {group: len(ixs) for group, ixs in members.items()}, self.min_per_group)
+        sampled = []
+        for group, ixs in members.items():
+            # a generator per group, so adding a group to the dataset doesn't change the samples of the other ones
+            rnd = random.Random(f"{self.seed}:{group}")
+            sampled.extend(rnd.sample(ixs, quotas[group]))
+        return sorted(sampled)
+
+
+def _allocate(target: int, group_sizes: dict[Any, int], min_per_group: int) -> dict[Any, int]:
+    """Split ``target`` between the groups proportionally to their sizes (largest remainder), then raise every group
+    to ``min_per_group`` (or its size)."""
+    total = sum(group_sizes.values())
+    if total == 0:
+        return {group: 0 for group in group_sizes}
+    exact = {group: target * size / total for group, size in group_sizes.items()}
+    quotas = {group: int(value) for group, value in exact.items()}
+    remainder = target - sum(quotas.values())
+    for group in sorted(exact, key=lambda g: quotas[g] - exact[g])[:remainder]:
+        quotas[group] += 1
+    return {group: min(group_sizes[group], max(quota, min_per_group)) for group, quota in quotas.items()}
+
+
+def wilson_interval(proportion: float, sample_size: int, confidence: float = 0.95,
+                    population_size: Optional[int] = None) -> tuple[float, float]:
+    """Wilson score interval of a proportion (or of the mean of scores in [0, 1], e.g. F1; the variance of such a
+    score is at most the variance of a 0/1 score with the same mean, so the interval is conservative).
+    :param population_size: size of the dataset that the sample is drawn from (without replacement). the interval
+        shrinks with the finite population correction and is a point when the whole dataset is in the sample."""
+    if sample_size <= 0:
+        return 0.0, 1.0
+    proportion = min(1.0, max(0.0, proportion))
+    n = float(sample_size)
+    if population_size is not None:
+        if sample_size >= population_size:
+            return proportion, proportion
+        n = sample_size * (population_size - 1) / (population_size - sample_size)
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    denominator = 1 + z * z / n
+    center = (proportion + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(proportion * (1 - proportion) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def add_confidence_intervals(metrics: dict, interval_metrics: dict[str, float], sample_size: int,
+                             population_size: int, confidence: float = 0.95) -> dict:
+    """Add ``sample_size``, ``population_size`` and ``<metric>_ci`` (``[low, high]``) to the metrics of a sampled run.
+    :param metrics: metrics of one benchmark, it's changed in place.
+    :param interval_metrics: the metrics that are means of per-sample scores and the max of their score (e.g.
+        ``{"accuracy": 1.0, "f1_score": 100.0}``), see ``BaseBench.interval_metrics``."""
+    metrics["sample_size"] = sample_size
+    metrics["population_size"] = population_size
+    for key, scale in interval_metrics.items():
+        value = metrics.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            low, high = wilson_interval(value / scale, sample_size, confidence, population_size)
+            metrics[f"{key}_ci"] = [low * scale, high * scale]
+    return metrics
+
+
+@dataclass(frozen=True)
+class EarlyStopping:
+    """Stop generating when a metric is known well enough.
+
+    The dataset is run in a seeded random order, ``chunk_size`` samples at a time. After every chunk the metric and
+    its confidence interval (``wilson_interval``) are updated, and the run stops when the interval is narrower than
+    ``precision`` or doesn't contain ``baseline`` anymore. The interval is checked after each chunk, so the real
+    confidence is a bit lower than ``confidence``; ``min_samples`` keeps the first noisy chunks from stopping it."""
+    metric: str  # a key of ``BaseBench.interval_metrics``, like ``"accuracy"``
+    precision: Optional[float] = None  # stop when the half width of the interval is at most this (in metric units)
+    baseline: Optional[float] = None  # stop when the metric is surely better or worse than this
+    confidence: float = 0.95
+    min_samples: int = 100
+    chunk_size: int = 100
+    seed: int = 0
+
+    def __post_init__(self):
+        if self.precision is None and self.baseline is None:
+            raise ValueError("At least one of precision and baseline must be set")
+        if self.chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, not {self.chunk_size}")
+        if not 0 < self.confidence < 1:
+            raise ValueError(f"confidence must be in (0, 1), not {self.confidence}")
+
+    def order(self, num_samples: int) -> list[int]:
+        """The order of the samples in the run."""
+        order = list(range(num_samples))
+        random.Random(f"{self.seed}:early-stopping").shuffle(order)
+        return order
+
+    def interval(self, value: float, scale: float, sample_size: int, population_size: int) -> tuple[float, float]:
+        low, high = wilson_interval(value / scale, sample_size, self.confidence, population_size)
+        return low * scale, high * scale
+
+    def stop_reason(self, value: float, scale: float, sample_size: int, population_size: int) -> Optional[str]:
+        """``"precision"`` or ``"baseline"`` if the run can stop with ``value`` of the metric after ``sample_size``
+        samples, otherwise ``None``."""
+        if sample_size < min(self.min_samples, population_size):
+            return None
+        low, high = self.interval(value, scale, sample_size, population_size)
+        if self.precision is not None and (high - low) / 2 <= self.precision:
+            return "precision"
+        if self.baseline is not None and (low > self.baseline or high < self.baseline):
+            return "baseline"
+        return None
+
+    def report(self, metrics: dict, scale: float, sample_size: int, population_size: int,
+               reason: Optional[str]) -> dict:
+        """Add ``stopped_early`` and ``stop_reason`` (and ``better_than_baseline``, ``None`` if it's not decided) to
+        the metrics of a run, it's changed in place. the run stopped early if it has a ``reason``, ``sample_size`` is
+        the number of scored samples of the interval."""
+        metrics["stopped_early"] = reason is not None
+        metrics["stop_reason"] = reason
+        if self.baseline is not None:
+            better = None
+            value = metrics.get(self.metric)
+            if isinstance(value, (int, float)):
+                low, high = self.interval(value, scale, sample_size, population_size)
+                better = True if low > self.baseline else False if high < self.baseline else None
+            metrics["better_than_baseline"] = better
+        return metrics
@@ -1,17 +1,61 @@
 import os.path
+import sys
+import ast
+import asyncio
+import shutil
 import pathlib
 import inspect
-import requests
+import hashlib
+import threading
+import importlib
 import importlib.util
 
-from typing import Union, Callable, Any, List
+from typing import Union, Callable, Any, List, NamedTuple, Optional, Iterable, Tuple, Coroutine
+from concurrent.futures import ThreadPoolExecutor
 
 from loguru import logger
 
-from datasets import load_dataset
+from llm_benchmarker.berrors import IncompleteDownloadError
 from llm_benchmarker.events.handlers import EventHandler
 
 RESPONSE_STATUS_CODE_SUCCEED = 200
+RESPONSE_STATUS_CODE_PARTIAL_CONTENT = 206
+RESPONSE_STATUS_CODE_RANGE_NOT_SATISFIABLE = 416
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+HTTP_POOL_SIZE = 16
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def run_coroutine(coroutine: Coroutine) -> Any:
+    """Run a coroutine to completion from synchronous code. If the caller is already inside an event loop (e.g. a
+    notebook), ``asyncio.run`` can't be used there, so the coroutine runs on a fresh loop in a helper thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def get_http_session():
+    """A ``requests.Session`` shared by all downloads of the process. its connections are pooled and kept alive, so
+    the concurrent downloads of ``DatasetManager`` (and the files from the same host) don't open a new TLS connection
+    each time."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _SESSION = session
+    return _SESSION
 
 
 def github_url_to_raw_github_url(github_url: Union[str, list]) -> list:
@@ -36,14 +80,86 @@ def github_url_to_raw_github_url(github_url: Union[str, list]) -> list:
     return outcomes
 
 
-def load_file_from_web(url: str, destination_path: str, **kwargs) -> bool:
-    response = requests.get(url)
-    if response.status_code == RESPONSE_STATUS_CODE_SUCCEED:
-        with open(destination_path, "wb") as file:
-            file.write(response.content)
-            return True
+def file_sha256(path: Union[str, pathlib.Path]) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _download_part(session, url: str, part_path: str, progress: Optional[Callable[[int, Optional[int]], None]],
+                   timeout: Tuple[float, float]) -> bool:
+    """Download ``url`` into ``part_path``, continue from the end of the part file with an HTTP Range request if it
+    already exists.
+    :returns: ``False`` if the server refused the file"""
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    # no compression: the Range offsets and Content-Length count the bytes of the file, not of a gzip stream
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as response:
+        if response.status_code == RESPONSE_STATUS_CODE_RANGE_NOT_SATISFIABLE and offset:
+            # the part file is not a prefix of the file anymore (e.g. the file changed on the server)
+            logger.debug(f"Can't resume {url} from byte {offset}, starting over")
+            os.remove(part_path)
+            return _download_part(session, url, part_path, progress, timeout)
+        if response.status_code == RESPONSE_STATUS_CODE_PARTIAL_CONTENT:
+            logger.debug(f"Resuming {url} from byte {offset}")
+            content_range = response.headers.get("Content-Range", "")
+            total = content_range.rsplit("/", 1)[-1]
+            total = int(total) if total.isdigit() else None
+        elif response.status_code == RESPONSE_STATUS_CODE_SUCCEED:
+            offset = 0  # the server sends the whole file
+            length = response.headers.get("Content-Length")
+            total = int(length) if length is not None and length.isdigit() else None
+        else:
+            logger.debug(f"Downloading {url} failed with HTTP status {response.status_code}")
+            return False
+        downloaded = offset
+        with open(part_path, "ab" if offset else "wb") as file:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                downloaded += len(chunk)
+                if progress is not None:
+                    progress(downloaded, total)
+    if total is not None and downloaded != total:
+        raise IncompleteDownloadError(f"Got {downloaded} bytes of {total} from {url}")
+    return True
+
+
+def load_file_from_web(url: str, destination_path: str, session=None,
+                       progress: Optional[Callable[[int, Optional[int]], None]] = None, sha256: Optional[str] = None,
+                       timeout: Tuple[float, float] = (10, 60), retries: int = 3, **kwargs) -> bool:
+    """Download a file with a constant memory. it's streamed into ``<destination_path>.part`` in chunks and renamed to
+    ``destination_path`` only when it's complete (and its checksum is right), so a broken download never looks like
+    a dataset. an interrupted download continues from where it stopped, in the next attempt or the next run.
+    :param session: the ``requests.Session`` of the download, the shared one (``get_http_session``) by default.
+    :param progress: called with the downloaded bytes and the total bytes (``None`` if unknown) after each chunk.
+    :param sha256: expected hex digest of the file, it's not checked if it's ``None``.
+    :param timeout: connect and read timeouts in seconds.
+    :param retries: number of retries after a connection error or an incomplete transfer."""
+    import requests  # imported here, only a download needs it
+
+    session = session or get_http_session()
+    part_path = f"{destination_path}.part"
+    for attempt in range(retries + 1):
+        try:
+            if not _download_part(session, url, part_path, progress, timeout):
+                return False
+            break
+        except (requests.RequestException, IncompleteDownloadError) as e:
+            logger.warning(f"Download of {url} was interrupted ({attempt + 1}/{retries + 1}): {e}")
     else:
         return False
+    if sha256 is not None:
+        digest = file_sha256(part_path)
+        if digest != sha256.lower():
+            logger.error(f"Checksum of {url} is {digest}, expected {sha256}. the file is removed.")
+            os.remove(part_path)
+            return False
+    os.replace(part_path, destination_path)
+    return True
 
 
 def load_from_no_where(url: str, destination_path: str, *args, **kwargs) -> bool:
@@ -56,13 +172,21 @@ def load_from_github(url: str, destination_path: str, **kwargs) -> bool:
     return load_file_from_web(url, destination_path, **kwargs)
 
 
-def load_from_hf(path: str, destination_path: str, **kwargs):
-    """download dataset from Huggingface"""
+def load_from_hf(path: str, destination_path: str, session=None, progress=None, sha256=None, **kwargs):
+    """download dataset from Huggingface, ``datasets`` has its own HTTP client, progress bars and checks, so
+    ``session``, ``progress`` and ``sha256`` are not used. the dataset is saved next to ``destination_path`` and
+    renamed when it's complete."""
+    from datasets import load_dataset  # imported here, importing ``datasets`` takes a few hundred milliseconds
+
+    part_path = f"{destination_path}.part"
     try:
-        load_dataset(path, **kwargs).save_to_disk(destination_path)
+        shutil.rmtree(part_path, ignore_errors=True)
+        load_dataset(path, **kwargs).save_to_disk(part_path)
+        os.replace(part_path, destination_path)
         return True
     except Exception as e:
         logger.debug(e)
+        shutil.rmtree(part_path, ignore_errors=True)
         return False
 
 
@@ -126,8 +250,127 @@ def list_slots_in_list_pathes(dir_pathes: Union[list[str], list[pathlib.Path]]):
             list_slots_in_module(file_name, file_path)]
 
 
-def load_slots(slot_pathes: Union[list[str], list[pathlib.Path]]):
-    handler = EventHandler()
+class SlotEntry(NamedTuple):
+    """A slot function found in a reader module without importing it"""
+    shared_key: Optional[str]  # ``None`` if the argument of ``@slot`` isn't a constant that can be resolved statically
+    file_path: str
+    function: str
+
+    def __str__(self):
+        return f"{_module_name(self.file_path)}:{self.function}"
+
+
+_PACKAGE_DIR = pathlib.Path(__file__).resolve().parent
+_SLOT_MANIFEST_CACHE: dict[str, Tuple[Tuple[int, int], list[SlotEntry]]] = {}
+_SLOT_MODULES: dict[str, Any] = {}
+
+
+def _module_name(file_path: Union[str, pathlib.Path]) -> str:
+    """Dotted name of a module of this package (so it's the same module as a normal import of it), a private name for
+    the other files."""
+    path = pathlib.Path(file_path).resolve()
+    if _PACKAGE_DIR in path.parents:
+        return ".".join((_PACKAGE_DIR.name,) + path.relative_to(_PACKAGE_DIR).with_suffix("").parts)
+    return f"_llm_benchmarker_slots.{path.stem}_{hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:8]}"
+
+
+def _resolve_shared_key(node: ast.expr, tree: ast.Module) -> Optional[str]:
+    """The value of the ``@slot`` argument if it's a string, a module level string or a name imported from another
+    module (like ``BENCHMARK_NAME_MMLU`` from ``llm_benchmarker.config``)."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if not isinstance(node, ast.Name):
+        return None
+    for statement in tree.body:
+        if isinstance(statement, ast.Assign) and isinstance(statement.value, ast.Constant) \
+                and any(isinstance(t, ast.Name) and t.id == node.id for t in statement.targets):
+            return statement.value.value if isinstance(statement.value.value, str) else None
+        if isinstance(statement, ast.ImportFrom) and statement.module and statement.level == 0:
+            for alias in statement.names:
+                if (alias.asname or alias.name) == node.id:
+                    try:
+                        value = getattr(importlib.import_module(statement.module), alias.name)
+                    except (ImportError, AttributeError):
+                        return None
+                    return value if isinstance(value, str) else None
+    return None
+
+
+def list_slots_in_file(file_path: Union[str, pathlib.Path]) -> list[SlotEntry]:
+    """Find the ``@slot`` functions of a module by parsing it, the module isn't executed. the result is cached until
+    the file changes."""
+    file_path = str(file_path)
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _SLOT_MANIFEST_CACHE.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(file_path, "rb") as f:
+        tree = ast.parse(f.read(), filename=file_path)
+    entries = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            if isinstance(decorator, ast.Call) and decorator.args and \
+                    getattr(decorator.func, "id", getattr(decorator.func, "attr", None)) == "slot":
+                entries.append(SlotEntry(_resolve_shared_key(decorator.args[0], tree), file_path, node.name))
+    _SLOT_MANIFEST_CACHE[file_path] = (signature, entries)
+    return entries
+
+
+def slot_manifest(slot_pathes: Union[list[str], list[pathlib.Path]]) -> dict[Optional[str], list[SlotEntry]]:
+    """Index the slot functions of the reader modules in ``slot_pathes`` by their shared key, without importing them.
+    >>> {key: [str(e) for e in entries] for key, entries in slot_manifest(SLOT_DIR_PATH).items()}
+    {'MMLU': ['llm_benchmarker.data.readers._lang:MMLU_load_from_disk'], ...}"""
+    manifest: dict[Optional[str], list[SlotEntry]] = {}
+    for file_path, _ in sorted(list_module_in_list_path(slot_pathes)):
+        for entry in list_slots_in_file(file_path):
+            manifest.setdefault(entry.shared_key, []).append(entry)
+    return manifest
+
+
+def _import_slot_module(file_path: str):
+    """Import a reader module once, its ``@slot`` decorators subscribe the slot functions."""
+    file_path = str(pathlib.Path(file_path).resolve())
+    if file_path in _SLOT_MODULES:
+        return _SLOT_MODULES[file_path]
+    module_name = _module_name(file_path)
+    if module_name not in sys.modules:
+        # the slots of an earlier execution of the module are replaced by the ones it subscribes now
+        EventHandler().unsubscribe_module(module_name)
+    if module_name.startswith(f"{_PACKAGE_DIR.name}."):
+        module = importlib.import_module(module_name)
+    else:
+        module = sys.modules.get(module_name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(module_name, file_path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[module_name]
+                raise
+    _SLOT_MODULES[file_path] = module
+    return module
+
+
+def load_slots(slot_pathes: Union[list[str], list[pathlib.Path]], shared_keys: Optional[Iterable[str]] = None):
+    """Subscribe the slot functions of the reader modules in ``slot_pathes``.
+    :param slot_pathes: directories of the reader modules.
+    :param shared_keys: only the modules with the slots of these benchmarks are imported, all of them if it's
+        ``None``. a module is imported once per process, so calling this again is cheap."""
     logger.debug("Finding slot functions...")
-    list_slots_in_list_pathes(slot_pathes)
+    manifest = slot_manifest(slot_pathes)
+    if shared_keys is None:
+        entries = [entry for key_entries in manifest.values() for entry in key_entries]
+    else:
+        shared_keys = list(shared_keys)
+        entries = [entry for key in shared_keys for entry in manifest.get(key, [])]
+        if any(key not in manifest for key in shared_keys):
+            # the slots of a missing key may be behind a dynamic ``@slot`` argument
+            entries += manifest.get(None, [])
+    for file_path in dict.fromkeys(entry.file_path for entry in entries):
+        _import_slot_module(file_path)
     logger.debug("Slot's were found successfully")
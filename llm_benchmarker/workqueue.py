@@ -0,0 +1,245 @@
+"""A work queue of dataset shards in a SQLite file. With it one benchmark runs on many model replicas and hosts: a
+coordinator publishes the index ranges of the dataset, independent workers (``python -m llm_benchmarker worker``) claim
+them, generate and write the partial metric states, and the coordinator merges the states exactly."""
+import os
+import time
+import socket
+import pathlib
+import sqlite3
+import threading
+
+from typing import Union, Optional, Iterable, NamedTuple
+from loguru import logger
+
+
+SHARD_PENDING = "pending"
+SHARD_RUNNING = "running"
+SHARD_DONE = "done"
+
+
+class Shard(NamedTuple):
+    """A range of samples of a benchmark dataset"""
+    benchmark: str
+    shard_id: int
+    start: int
+    stop: int
+    attempt: int  # number of times the shard was claimed, a stale claim can't complete the shard anymore
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """The shards of the published benchmarks, in a SQLite file that all workers can open (e.g. on a shared file
+    system).
+
+    A worker claims a pending shard, or a running shard whose worker hasn't sent a heartbeat for ``stale_after``
+    seconds (a dead node), ``Heartbeat`` keeps a claim alive while the worker runs it. Only the last claim of a shard can complete it, so a slow worker that comes back can't
+    overwrite the result of the worker that took its shard over. The rollback journal is used instead of WAL, since
+    WAL doesn't work on network file systems."""
+
+    def __init__(self, path: Union[str, pathlib.Path], stale_after: float = 600.0, timeout: float = 60.0):
+        """
+        :param path: path of the SQLite file.
+        :param stale_after: seconds without a heartbeat after that a running shard is given to another worker.
+        :param timeout: seconds to wait for the lock of the file."""
+        self.path = pathlib.Path(path)
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "benchmark TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, num_samples INTEGER NOT NULL, "
+                "num_shards INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shards ("
+                "benchmark TEXT NOT NULL, shard_id INTEGER NOT NULL, start INTEGER NOT NULL, stop INTEGER NOT NULL, "
+                "status TEXT NOT NULL, worker TEXT, heartbeat REAL, attempt INTEGER NOT NULL DEFAULT 0, state BLOB, "
+                "PRIMARY KEY (benchmark, shard_id))"
+            )
+
+    def _transaction(self):
+        """``BEGIN IMMEDIATE`` takes the write lock at the start, so two workers never claim the same shard."""
+        return _Transaction(self._conn, self._lock)
+
+    def publish(self, benchmark: str, num_samples: int, shard_size: int, fingerprint: str) -> int:
+        """Split a dataset into shards of ``shard_size`` samples. Publishing the same dataset (same ``fingerprint``)
+        again keeps the shards and their results, a changed dataset starts over.
+        :returns: number of shards of the benchmark"""
+        if shard_size < 1:
+            raise ValueError(f"shard_size must be at least 1, not {shard_size}")
+        with self._transaction() as conn:
+            row = conn.execute("SELECT fingerprint, num_samples, num_shards FROM runs WHERE benchmark = ?",
+                               (benchmark,)).fetchone()
+            if row is not None and row[0] == fingerprint and row[1] == num_samples:
+                return row[2]
+            if row is not None:
+                logger.warning(f"Dataset of {benchmark} changed since it was published, its shards start over")
+            ranges = [(start, min(start + shard_size, num_samples)) for start in range(0, num_samples, shard_size)]
+            conn.execute("DELETE FROM shards WHERE benchmark = ?", (benchmark,))
+            conn.execute("INSERT OR REPLACE INTO runs (benchmark, fingerprint, num_samples, num_shards, created) "
+                         "VALUES (?, ?, ?, ?, ?)", (benchmark, fingerprint, num_samples, len(ranges), time.time()))
+            conn.executemany("INSERT INTO shards (benchmark, shard_id, start, stop, status) VALUES (?, ?, ?, ?, ?)",
+                             [(benchmark, ix, start, stop, SHARD_PENDING) for ix, (start, stop) in enumerate(ranges)])
+            return len(ranges)
+
+    def fingerprint(self, benchmark: str) -> Optional[str]:
+        """The fingerprint of the published dataset of ``benchmark``, ``None`` if it isn't published."""
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM runs WHERE benchmark = ?", (benchmark,)).fetchone()
+        return row[0] if row is not None else None
+
+    def claim(self, worker: str, benchmarks: Optional[Iterable[str]] = None) -> Optional[Shard]:
+        """Take a pending or a stale shard.
+        :param worker: identifier of the worker, see ``default_worker_id``.
+        :param benchmarks: only the shards of these benchmarks, all of them if it's ``None``.
+        :returns: the shard, ``None`` if there is nothing to do now."""
+        now = time.time()
+        benchmarks = list(benchmarks) if benchmarks is not None else None
+        condition = "" if benchmarks is None else f" AND benchmark IN ({','.join('?' * len(benchmarks))})"
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT benchmark, shard_id, start, stop, attempt, status, worker FROM shards "
+                f"WHERE (status = ? OR (status = ? AND heartbeat < ?)){condition} "
+                "ORDER BY status = ? DESC, benchmark, shard_id LIMIT 1",
+                (SHARD_PENDING, SHARD_RUNNING, now - self.stale_after, *(benchmarks or []), SHARD_PENDING)
+            ).fetchone()
+            if row is None:
+                return None
+            benchmark, shard_id, start, stop, attempt, status, old_worker = row
+            if status == SHARD_RUNNING:
+                logger.warning(f"Shard {shard_id} of {benchmark} is stale (worker {old_worker}), {worker} takes it")
+            conn.execute("UPDATE shards SET status = ?, worker = ?, heartbeat = ?, attempt = ? "
+                         "WHERE benchmark = ? AND shard_id = ?",
+                         (SHARD_RUNNING, worker, now, attempt + 1, benchmark, shard_id))
+        return Shard(benchmark, shard_id, start, stop, attempt + 1)
+
+    def heartbeat(self, shard: Shard, worker: str) -> bool:
+        """Tell that the worker is still working on the shard.
+        :returns: ``False`` if the shard was given to another worker in the meantime."""
+        with self._transaction() as conn:
+            return conn.execute("UPDATE shards SET heartbeat = ? WHERE benchmark = ? AND shard_id = ? AND worker = ? "
+                                "AND attempt = ? AND status = ?",
+                                (time.time(), shard.benchmark, shard.shard_id, worker, shard.attempt,
+                                 SHARD_RUNNING)).rowcount == 1
+
+    def complete(self, shard: Shard, worker: str, state: bytes) -> bool:
+        """Save the partial result of a shard.
+        :param state: the serialized partial result (e.g. a pickled ``BenchAccumulator``).
+        :returns: ``False`` if the claim of the worker is not the last claim of the shard, the state is dropped."""
+        with self._transaction() as conn:
+            completed = conn.execute("UPDATE shards SET status = ?, state = ?, heartbeat = ? WHERE benchmark = ? "
+                                     "AND shard_id = ? AND worker = ? AND attempt = ? AND status = ?",
+                                     (SHARD_DONE, sqlite3.Binary(state), time.time(), shard.benchmark,
+                                      shard.shard_id, worker, shard.attempt, SHARD_RUNNING)).rowcount == 1
+        if not completed:
+            logger.warning(f"Shard {shard.shard_id} of {shard.benchmark} was taken over, the result of {worker} "
+                           f"is dropped")
+        return completed
+
+    def release(self, shard: Shard, worker: str):
+        """Give a claimed shard back (e.g. the generation failed), another worker can take it at once."""
+        with self._transaction() as conn:
+            conn.execute("UPDATE shards SET status = ?, worker = NULL, heartbeat = NULL WHERE benchmark = ? "
+                         "AND shard_id = ? AND worker = ? AND attempt = ? AND status = ?",
+                         (SHARD_PENDING, shard.benchmark, shard.shard_id, worker, shard.attempt, SHARD_RUNNING))
+
+    def progress(self, benchmark: str) -> dict[str, int]:
+        """Number of the shards of ``benchmark`` per status (and ``stale`` for the running ones without a recent
+        heartbeat)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM shards WHERE benchmark = ? GROUP BY status",
+                                      (benchmark,)).fetchall()
+            stale = self._conn.execute("SELECT COUNT(*) FROM shards WHERE benchmark = ? AND status = ? AND "
+                                       "heartbeat < ?",
+                                       (benchmark, SHARD_RUNNING, time.time() - self.stale_after)).fetchone()[0]
+        counts = {SHARD_PENDING: 0, SHARD_RUNNING: 0, SHARD_DONE: 0, **dict(rows)}
+        counts["stale"] = stale
+        return counts
+
+    def num_shards(self, benchmark: str) -> Optional[int]:
+        """The number of the published shards of ``benchmark``, ``None`` if it isn't published."""
+        with self._lock:
+            row = self._conn.execute("SELECT num_shards FROM runs WHERE benchmark = ?", (benchmark,)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_done(self, benchmark: str) -> bool:
+        """``benchmark`` is published and none of its shards is pending or running, a benchmark without samples has
+        no shards and is done at once."""
+        if self.num_shards(benchmark) is None:
+            return False
+        counts = self.progress(benchmark)
+        return counts[SHARD_PENDING] == counts[SHARD_RUNNING] == 0
+
+    def states(self, benchmark: str) -> list[bytes]:
+        """The partial results of the completed shards of ``benchmark`` in shard order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT state FROM shards WHERE benchmark = ? AND status = ? ORDER BY shard_id",
+                                      (benchmark, SHARD_DONE)).fetchall()
+        return [bytes(row[0]) for row in rows]
+
+    def close(self):
+        self._conn.close()
+
+
+class Heartbeat:
+    """Send the heartbeats of a claimed shard from a background thread while the worker runs it, so a batch that takes
+    longer than ``stale_after`` doesn't make the shard stale and run twice.
+
+    >>> with Heartbeat(queue, shard, worker):
+    ...     run(shard)"""
+
+    def __init__(self, queue: WorkQueue, shard: Shard, worker: str, interval: Optional[float] = None):
+        """
+        :param interval: seconds between the heartbeats, a quarter of ``stale_after`` of the queue by default."""
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.interval = interval if interval is not None else queue.stale_after / 4
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f"heartbeat-{shard.benchmark}-{shard.shard_id}",
+                                        daemon=True)
+
+    def _beat(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.shard, self.worker):
+                    logger.warning(f"Shard {self.shard.shard_id} of {self.shard.benchmark} was taken over from "
+                                   f"{self.worker}")
+                    return
+            except sqlite3.Error as e:
+                # a busy or unreachable file, the next heartbeat tries again
+                logger.warning(f"Heartbeat of shard {self.shard.shard_id} of {self.shard.benchmark} failed: {e}")
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stopped.set()
+        self._thread.join()
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._lock.acquire()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._lock.release()
+            raise
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._conn.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            self._lock.release()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker.cache import PredictionCache
+from llm_benchmarker.pipelines import ModelPipeline
+
+
+def formatter(system_prompt, usr_prompt):
+    return [{"role": "system", "content": system_prompt}, *[{"role": "user", "content": p} for p in usr_prompt]]
+
+
+class TestPredictionCache(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "predictions.sqlite")
+
+    def test_hits_skip_gen_func(self):
+        calls = []
+
+        def generation(messages):
+            calls.append(len(messages) - 1)
+            return [m["content"].upper() for m in messages[1:]]
+
+        prompts = [f"prompt {i}" for i in range(10)]
+        cache = PredictionCache("model-a", self.path, generation_settings={"temperature": 0})
+        pipe = ModelPipeline(generation, formatter, batch_size=4, prediction_cache=cache)
+        self.assertListEqual(pipe("sys", prompts), [p.upper() for p in prompts])
+        self.assertListEqual(calls, [4, 4, 2])
+
+        calls.clear()
+        more_prompts = prompts[:5] + ["new 1", "new 2"]
+        self.assertListEqual(pipe("sys", more_prompts), [p.upper() for p in more_prompts])
+        self.assertListEqual(calls, [2])
+
+        # another model, other settings or another system prompt never hit
+        calls.clear()
+        other = PredictionCache("model-a", self.path, generation_settings={"temperature": 1})
+        ModelPipeline(generation, formatter, prediction_cache=other)("sys", prompts)
+        ModelPipeline(generation, formatter, prediction_cache=cache)("other sys", prompts)
+        self.assertListEqual(calls, [10, 10])
+
+    def test_lru_eviction(self):
+        cache = PredictionCache("model-a", self.path, max_entries=3)
+        keys = [cache.key(f"p{i}") for i in range(3)]
+        cache.put_many([(k, "x") for k in keys])
+        cache.get_many([keys[0]])
+        cache.put_many([(cache.key("p3"), "y")])
+        self.assertEqual(len(cache), 3)
+        self.assertSetEqual(set(cache.get_many(keys)), {keys[0], keys[2]})
+
+    def test_max_bytes(self):
+        cache = PredictionCache("model-a", self.path, max_entries=None, max_bytes=10)
+        cache.put_many([(cache.key(f"p{i}"), "12345") for i in range(4)])
+        self.assertEqual(len(cache), 2)
@@ -0,0 +1,264 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker.dataset import BenchDatasetLoader, SlotOutputCache, ArrowColumnSequence, DatasetManager
+from llm_benchmarker.utils import load_file_from_web
+from llm_benchmarker.config import DATASETS_PER_BENCH, BACKEND_CUSTOM_DIRECT_DOWNLOAD_UNIFILE, BENCH_CATEGORY_LANG
+from llm_benchmarker.events.handlers import EventHandler
+
+SHARED_KEY = "TestCachedQA"
+slot_calls = []
+
+
+def cached_qa_slot(dataset_path):
+    slot_calls.append(dataset_path)
+    with open(dataset_path, encoding="utf-8") as f:
+        rows = json.load(f)
+    return "system", [row["q"] for row in rows], [row["a"] for row in rows]
+
+
+EventHandler().subscribe(SHARED_KEY, cached_qa_slot)
+
+
+class TestSlotOutputCache(TestCase):
+
+    def setUp(self):
+        self.dataset_path = os.path.join(tempfile.mkdtemp(), "qa.json")
+        self.write_dataset([{"q": f"سوال {i}", "a": {"text": [f"پاسخ {i}"], "answer_start": [i]}}
+                            for i in range(10)])
+        self.cache_dir = tempfile.mkdtemp()
+        slot_calls.clear()
+
+    def write_dataset(self, rows):
+        with open(self.dataset_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+
+    def loader(self):
+        return BenchDatasetLoader(SHARED_KEY, self.dataset_path, SHARED_KEY, None)
+
+    def test_warm_load_skips_slot(self):
+        cache = SlotOutputCache(self.cache_dir)
+        slot_fns = EventHandler().get_slots(SHARED_KEY)
+        fingerprint = cache.fingerprint(SHARED_KEY, self.dataset_path, slot_fns)
+        self.assertIsNone(cache.load(SHARED_KEY, fingerprint))
+
+        cold = cached_qa_slot(self.dataset_path)
+        cache.save(SHARED_KEY, fingerprint, cold)
+        system_prompt, prompts, targets, groups = cache.load(SHARED_KEY, fingerprint)
+        self.assertIsNone(groups)
+        self.assertEqual(system_prompt, "system")
+        self.assertIsInstance(prompts, ArrowColumnSequence)
+        self.assertListEqual(list(prompts), cold[1])
+        self.assertListEqual(list(targets), cold[2])
+        self.assertEqual(prompts[-1], cold[1][-1])
+        self.assertListEqual(prompts[2:5], cold[1][2:5])
+
+    def test_dataset_change_invalidates(self):
+        cache = SlotOutputCache(self.cache_dir)
+        slot_fns = EventHandler().get_slots(SHARED_KEY)
+        first = cache.fingerprint(SHARED_KEY, self.dataset_path, slot_fns)
+        self.write_dataset([{"q": "changed question", "a": {"text": ["x"], "answer_start": [0]}}])
+        os.utime(self.dataset_path, ns=(0, 0))
+        self.assertNotEqual(first, cache.fingerprint(SHARED_KEY, self.dataset_path, slot_fns))
+
+    def test_save_keeps_the_files_of_other_keys(self):
+        cache = SlotOutputCache(self.cache_dir)
+        output = cached_qa_slot(self.dataset_path)
+        for key in ("MMLU", "MMLU-Pro", "MMLU-Pro-v2"):
+            cache.save(key, "a" * 64, output)
+        # a new version of MMLU replaces only the old MMLU file
+        cache.save("MMLU", "b" * 64, output)
+        self.assertIsNone(cache.load("MMLU", "a" * 64))
+        self.assertIsNotNone(cache.load("MMLU", "b" * 64))
+        self.assertIsNotNone(cache.load("MMLU-Pro", "a" * 64))
+        self.assertIsNotNone(cache.load("MMLU-Pro-v2", "a" * 64))
+        self.assertListEqual([path.name for path in cache.cache_files("MMLU-Pro")], [f"MMLU-Pro-{'a' * 24}.arrow"])
+
+    def test_loader_uses_cache(self):
+        cold = self.loader().load_from_disk(cache_dir=self.cache_dir)[SHARED_KEY]
+        warm = self.loader().load_from_disk(cache_dir=self.cache_dir)[SHARED_KEY]
+        self.assertEqual(len(slot_calls), 1)
+        self.assertListEqual(list(warm[1]), cold[1])
+        self.assertListEqual(list(warm[2]), cold[2])
+
+
+class SlowFileHandler(BaseHTTPRequestHandler):
+    """Serves ``size`` bytes for ``/<size>`` after a delay, like a far away dataset host"""
+    protocol_version = "HTTP/1.1"  # keep-alive
+    delay = 0.4
+    connections = set()
+
+    def do_GET(self):
+        type(self).connections.add(self.client_address)
+        time.sleep(self.delay)
+        body = b"x" * int(self.path.strip("/"))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConcurrentPrefetch(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowFileHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def make_benches(self, sizes):
+        local_dir = tempfile.mkdtemp()
+        benches = []
+        for ix, size in enumerate(sizes):
+            name = f"Prefetch{ix}-{os.path.basename(local_dir)}"
+            DATASETS_PER_BENCH[name] = {
+                "backend": BACKEND_CUSTOM_DIRECT_DOWNLOAD_UNIFILE,
+                "category": BENCH_CATEGORY_LANG,
+                "path": f"http://127.0.0.1:{self.server.server_port}/{size}",
+                "local_dir": os.path.join(local_dir, f"{name}.json"),
+                "download_kwargs": {}
+            }
+            benches.append(type(name, (), {"shared_key": classmethod(lambda cls, name=name: name)}))
+        return benches
+
+    def test_downloads_run_concurrently(self):
+        sizes = [10, 3 << 20, 5, 1000]
+        benches = self.make_benches(sizes)
+        started = time.perf_counter()
+        manager = DatasetManager(benches)
+        elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, SlowFileHandler.delay * len(sizes) * 0.75)
+        for bench, size in zip(benches, sizes):
+            self.assertEqual(os.path.getsize(manager.get_loader_by_bench(bench).get_local_path()), size)
+            self.assertEqual(manager.download_stats[bench.shared_key()]["bytes"], size)
+            self.assertGreater(manager.download_stats[bench.shared_key()]["bytes_per_second"], 0)
+
+        # the datasets are on disk now, nothing is downloaded again
+        self.assertDictEqual(DatasetManager(benches).download_stats, {})
+
+    def test_connections_are_reused(self):
+        SlowFileHandler.connections.clear()
+        DatasetManager(self.make_benches([10, 20, 30]), max_workers=1)
+        self.assertEqual(len(SlowFileHandler.connections), 1)
+
+
+class RangeFileHandler(BaseHTTPRequestHandler):
+    """Serves ``CONTENT`` with HTTP Range support, the first ``drops`` responses are cut in the middle"""
+    protocol_version = "HTTP/1.1"
+    CONTENT = bytes(range(256)) * 4096 * 4  # a few download chunks
+    drops = 0
+    ranges = []
+    compress = False  # gzip the file if the client accepts it, like GitHub raw. ranges are of the gzipped bytes then
+
+    def do_GET(self):
+        start = 0
+        range_header = self.headers.get("Range")
+        type(self).ranges.append(range_header)
+        if range_header:
+            start = int(range_header.split("=")[1].split("-")[0])
+        compressed = self.compress and "gzip" in self.headers.get("Accept-Encoding", "")
+        content = gzip.compress(self.CONTENT, mtime=0) if compressed else self.CONTENT
+        body = content[start:]
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if type(self).drops > 0:
+            type(self).drops -= 1
+            self.wfile.write(body[:len(body) // 3])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResumableDownload(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeFileHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/data.bin"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.destination = os.path.join(tempfile.mkdtemp(), "data.bin")
+        RangeFileHandler.ranges = []
+        RangeFileHandler.drops = 0
+        RangeFileHandler.compress = False
+
+    def test_interrupted_transfer_resumes(self):
+        RangeFileHandler.drops = 2
+        sha256 = hashlib.sha256(RangeFileHandler.CONTENT).hexdigest()
+        self.assertTrue(load_file_from_web(self.url, self.destination, sha256=sha256))
+        with open(self.destination, "rb") as f:
+            self.assertEqual(f.read(), RangeFileHandler.CONTENT)
+        self.assertFalse(os.path.exists(f"{self.destination}.part"))
+        self.assertEqual(len(RangeFileHandler.ranges), 3)
+        self.assertIsNone(RangeFileHandler.ranges[0])
+        self.assertTrue(all(r.startswith("bytes=") for r in RangeFileHandler.ranges[1:]))
+
+    def test_failed_download_leaves_no_dataset(self):
+        RangeFileHandler.drops = 1
+        self.assertFalse(load_file_from_web(self.url, self.destination, retries=0))
+        self.assertFalse(os.path.exists(self.destination))
+        # the next run continues from the part file
+        self.assertTrue(load_file_from_web(self.url, self.destination))
+        resumed_from = int(RangeFileHandler.ranges[-1][len("bytes="):-1])
+        self.assertTrue(0 < resumed_from <= len(RangeFileHandler.CONTENT) // 3)
+        self.assertEqual(os.path.getsize(self.destination), len(RangeFileHandler.CONTENT))
+
+    def test_server_that_compresses(self):
+        RangeFileHandler.compress = True
+        RangeFileHandler.drops = 1
+        self.assertTrue(load_file_from_web(self.url, self.destination))
+        with open(self.destination, "rb") as f:
+            self.assertEqual(f.read(), RangeFileHandler.CONTENT)
+        self.assertTrue(RangeFileHandler.ranges[-1].startswith("bytes="))
+
+    def test_corrupt_dataset_on_disk_is_downloaded_again(self):
+        name = f"Checked-{os.path.basename(os.path.dirname(self.destination))}"
+        DATASETS_PER_BENCH[name] = {"backend": BACKEND_CUSTOM_DIRECT_DOWNLOAD_UNIFILE, "category": BENCH_CATEGORY_LANG,
+                                    "path": self.url, "local_dir": self.destination, "download_kwargs": {},
+                                    "sha256": hashlib.sha256(RangeFileHandler.CONTENT).hexdigest()}
+        with open(self.destination, "wb") as f:
+            f.write(b"broken")
+        BenchDatasetLoader.load(name)
+        with open(self.destination, "rb") as f:
+            self.assertEqual(f.read(), RangeFileHandler.CONTENT)
+        # a valid file is kept
+        RangeFileHandler.ranges = []
+        BenchDatasetLoader.load(name)
+        self.assertListEqual(RangeFileHandler.ranges, [])
+
+    def test_checksum_mismatch(self):
+        self.assertFalse(load_file_from_web(self.url, self.destination, sha256="0" * 64))
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertFalse(os.path.exists(f"{self.destination}.part"))
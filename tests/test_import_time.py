@@ -0,0 +1,52 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from unittest import TestCase
+
+sys.path.append("/benchmarker")
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = ("pandas", "datasets", "requests", "pyarrow", "evaluate", "nltk", "rouge_score")
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)\s*$")
+
+
+def import_time(module: str, runs: int = 3) -> tuple[float, set[str]]:
+    """Best cumulative import time of ``module`` in milliseconds (``-X importtime``) out of ``runs`` fresh
+    interpreters, and the top-level packages that were imported with it."""
+    code = (f"import sys; before = set(sys.modules); import {module}; "
+            f"print(' '.join(sorted({{m.split('.')[0] for m in set(sys.modules) - before}})))")
+    best, loaded = float("inf"), set()
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=PROJECT_DIR,
+                                 capture_output=True, text=True, env={**os.environ, "PYTHONPATH": str(PROJECT_DIR)},
+                                 check=True)
+        timings = {match.group(2): int(match.group(1)) / 1000 for match in map(_IMPORT_TIME_LINE.match,
+                                                                               process.stderr.splitlines()) if match}
+        best = min(best, timings[module])
+        loaded = set(process.stdout.split())
+    return best, loaded
+
+
+class TestImportTime(TestCase):
+    """Every worker process pays the import time, these budgets are a few times the time on a laptop, so only a
+    real regression (like a heavy dependency at the top of a module) fails them."""
+
+    def test_package_import_is_cheap(self):
+        elapsed, loaded = import_time("llm_benchmarker")
+        self.assertSetEqual(loaded, {"llm_benchmarker"})
+        self.assertLess(elapsed, 50)
+
+    def test_manager_import_budget(self):
+        elapsed, loaded = import_time("llm_benchmarker.manager")
+        self.assertSetEqual(loaded & set(HEAVY_MODULES), set())
+        self.assertLess(elapsed, 500)
+
+    def test_no_filesystem_side_effects(self):
+        code = ("import os\n"
+                "def fail(*args, **kwargs): raise AssertionError(f'directory created at import time: {args}')\n"
+                "os.mkdir = os.makedirs = fail\n"
+                "import llm_benchmarker.manager, llm_benchmarker.cache, llm_benchmarker.checkpoint")
+        subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, check=True,
+                       env={**os.environ, "PYTHONPATH": str(PROJECT_DIR)})
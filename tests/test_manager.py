@@ -0,0 +1,260 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker import BenchManager
+from llm_benchmarker.config import DATASETS_PER_BENCH, BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, \
+    BENCH_CATEGORY_LANG, GENERATOR_FUNC_KEY, CHAT_TEMPLATE_FUNC
+from llm_benchmarker.evals.base import BaseBench, BenchmarkResults
+from llm_benchmarker.evals.metrics import calc_accuracy
+from llm_benchmarker.events.handlers import EventHandler
+from llm_benchmarker.sampling import EarlyStopping, wilson_interval
+
+FIXTURE_DIR = tempfile.mkdtemp()
+
+
+def make_echo_bench(test: TestCase, name: str, size: int = 20, slot_fn=None):
+    """Create a benchmark, its dataset config and its slot for ``name``, they are removed at the cleanup of
+    ``test``"""
+    local_dir = os.path.join(FIXTURE_DIR, name)
+    DATASETS_PER_BENCH[name] = {
+        "backend": BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD,
+        "category": BENCH_CATEGORY_LANG,
+        "path": name,
+        "local_dir": local_dir,
+        "download_kwargs": {}
+    }
+
+    test.addCleanup(DATASETS_PER_BENCH.pop, name, None)
+
+    def echo_slot(dataset_path):
+        return "", [str(i) for i in range(size)], [[str(i)] for i in range(size)]
+
+    slot_fn = slot_fn or echo_slot
+    EventHandler().subscribe(name, slot_fn)
+    test.addCleanup(EventHandler().unsubscribe, name, slot_fn)
+
+    class EchoBench(BaseBench):
+        def __init__(self):
+            super().__init__()
+            self.benchmark_name = name
+
+        @classmethod
+        def shared_key(cls) -> str:
+            return name
+
+        def compute(self, predictions, targets):
+            result = BenchmarkResults(benchmark_name=self.benchmark_name)
+            result.metrics.update(calc_accuracy(predictions, targets))
+            return result.to_dict()
+
+    return EchoBench
+
+
+def formatter(system_prompt, usr_prompt):
+    return usr_prompt
+
+
+class TestBenchManager(TestCase):
+
+    def test_parallel_run_merges_results(self):
+        benches = [make_echo_bench(self, f"Echo{i}") for i in range(3)]
+        # each benchmark waits in its generation until all of them are generating, a sequential run breaks it
+        overlap = threading.Barrier(len(benches), timeout=10)
+
+        def generation(messages):
+            overlap.wait()
+            return list(messages)
+
+        manager = BenchManager({
+            b: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter} for b in benches
+        })
+        results = manager.run(max_workers=3)
+        self.assertDictEqual(results, {f"Echo{i}": {"accuracy": 1.0} for i in range(3)})
+        overlap = threading.Barrier(1)
+        self.assertDictEqual(manager.run(), results)
+
+    def test_resume_from_checkpoint(self):
+        bench = make_echo_bench(self, "EchoResume", size=120)
+        checkpoint_dir = tempfile.mkdtemp()
+        calls = []
+
+        def crashing_generation(messages):
+            if len(calls) == 2:
+                raise ConnectionError("network blip")
+            calls.append(list(messages))
+            return list(messages)
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: crashing_generation, CHAT_TEMPLATE_FUNC: formatter}},
+                               checkpoint_dir=checkpoint_dir)
+        with self.assertRaises(ConnectionError):
+            manager.run()
+
+        def generation(messages):
+            calls.append(list(messages))
+            return list(messages)
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter}},
+                               checkpoint_dir=checkpoint_dir)
+        self.assertDictEqual(manager.run(resume=True), {"EchoResume": {"accuracy": 1.0}})
+        self.assertListEqual([len(c) for c in calls], [50, 50, 20])
+
+        # a half written line at the end of the checkpoint is dropped
+        with open(os.path.join(checkpoint_dir, "EchoResume.jsonl"), "a") as f:
+            f.write('{"ix": [0, 1], "out": ["wro')
+        calls.clear()
+        self.assertDictEqual(manager.run(resume=True), {"EchoResume": {"accuracy": 1.0}})
+        self.assertListEqual(calls, [])
+
+        # without resume everything is generated again
+        self.assertDictEqual(manager.run(), {"EchoResume": {"accuracy": 1.0}})
+        self.assertListEqual([len(c) for c in calls], [50, 50, 20])
+
+    def test_sampled_run(self):
+        bench = make_echo_bench(self, "EchoSampled", size=200)
+        bench.interval_metrics = {"accuracy": 1.0}
+        calls = []
+
+        def generation(messages):
+            calls.append(list(messages))
+            return list(messages)
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter}})
+        results = manager.run(sampling=0.1)["EchoSampled"]
+        self.assertEqual(sum(len(c) for c in calls), 20)
+        self.assertEqual(results["accuracy"], 1.0)
+        self.assertEqual(results["sample_size"], 20)
+        self.assertEqual(results["population_size"], 200)
+        self.assertLess(results["accuracy_ci"][0], 1.0)
+        self.assertEqual(results["accuracy_ci"][1], 1.0)
+
+        sampled = sorted(p for c in calls for p in c)
+        calls.clear()
+        manager.run(sampling=0.1)
+        self.assertListEqual(sorted(p for c in calls for p in c), sampled)
+
+    def test_early_stopping_run(self):
+        bench = make_echo_bench(self, "EchoEarlyStop", size=5000)
+        bench.interval_metrics = {"accuracy": 1.0}
+        calls = []
+
+        def generation(messages):
+            calls.append(len(messages))
+            # right on 70% of the samples
+            return [m if int(m) % 10 < 7 else "wrong" for m in messages]
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter}})
+        results = manager.run(early_stopping=EarlyStopping("accuracy", baseline=0.5))["EchoEarlyStop"]
+        self.assertTrue(results["stopped_early"])
+        self.assertEqual(results["stop_reason"], "baseline")
+        self.assertTrue(results["better_than_baseline"])
+        self.assertEqual(results["sample_size"], sum(calls))
+        self.assertLess(sum(calls), 1000)
+
+        calls.clear()
+        results = manager.run(early_stopping=EarlyStopping("accuracy", precision=0.02, chunk_size=250))["EchoEarlyStop"]
+        self.assertEqual(results["stop_reason"], "precision")
+        self.assertLess(sum(calls), 5000)
+        self.assertAlmostEqual(results["accuracy"], 0.7, delta=0.04)
+        self.assertLessEqual(results["accuracy_ci"][1] - results["accuracy_ci"][0], 0.04)
+
+        with self.assertRaises(ValueError):
+            manager.run(early_stopping=EarlyStopping("bleu", precision=0.02))
+
+    def test_sampled_early_stopping_run(self):
+        bench = make_echo_bench(self, "EchoSampledEarlyStop", size=2000)
+        bench.interval_metrics = {"accuracy": 1.0}
+        computed = []
+        compute = bench.compute
+
+        def counting_compute(self, predictions, targets):
+            computed.append(len(predictions))
+            return compute(self, predictions, targets)
+
+        bench.compute = counting_compute
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: lambda messages: list(messages),
+                                        CHAT_TEMPLATE_FUNC: formatter}})
+        results = manager.run(sampling=0.1, early_stopping=EarlyStopping("accuracy", precision=1e-6,
+                                                                          chunk_size=60))["EchoSampledEarlyStop"]
+        # every sampled prompt is generated, so the run didn't stop early, the interval is over the whole dataset
+        self.assertFalse(results["stopped_early"])
+        self.assertIsNone(results["stop_reason"])
+        self.assertEqual(results["sample_size"], 200)
+        self.assertEqual(results["population_size"], 2000)
+        self.assertLess(results["accuracy_ci"][0], 1.0)
+        # each chunk is computed once for the stopping metric, and all of them once at the end
+        self.assertListEqual(computed, [60, 60, 60, 20, 200])
+
+    def test_sampled_early_stopping_interval_meets_the_precision(self):
+        bench = make_echo_bench(self, "EchoSampledPrecision", size=2000)
+        bench.interval_metrics = {"accuracy": 1.0}
+
+        def generation(messages):
+            # right on 70% of the samples
+            return [m if int(m) % 10 < 7 else "wrong" for m in messages]
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter}})
+        results = manager.run(sampling=0.5, early_stopping=EarlyStopping("accuracy", precision=0.025,
+                                                                          chunk_size=50))["EchoSampledPrecision"]
+        self.assertEqual(results["stop_reason"], "precision")
+        self.assertEqual(results["population_size"], 2000)
+        # the stopping rule and the reported interval are over the same population
+        low, high = results["accuracy_ci"]
+        self.assertLessEqual((high - low) / 2, 0.025)
+
+    def test_intervals_are_over_the_scored_samples(self):
+        bench = make_echo_bench(self, "EchoSampledInvalid", size=400)
+        bench.interval_metrics = {"accuracy": 1.0}
+
+        def compute(self, predictions, targets):
+            predictions, targets = self._validate_inputs(predictions, targets)
+            return {self.benchmark_name: calc_accuracy(list(predictions), list(targets))}
+
+        bench.compute = compute
+        answered = []
+
+        def generation(messages):
+            # the model gives no answer to the even prompts
+            answered.extend(m for m in messages if int(m) % 2)
+            return [m if int(m) % 2 else "" for m in messages]
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter}})
+        for options in ({"sampling": 0.25},
+                        {"early_stopping": EarlyStopping("accuracy", precision=1e-6, chunk_size=50)}):
+            answered.clear()
+            results = manager.run(**options)["EchoSampledInvalid"]
+            self.assertEqual(results["accuracy"], 1.0)
+            self.assertLess(len(answered), 400 if "early_stopping" in options else 100)
+            self.assertEqual(results["sample_size"], len(answered))
+            self.assertListEqual(list(results["accuracy_ci"]),
+                                 list(wilson_interval(1.0, len(answered), 0.95, population_size=400)))
+
+    def test_streaming_run(self):
+        name = "EchoStream"
+        produced = []
+
+        def stream_slot(dataset_path):
+            def samples():
+                for i in range(250):
+                    produced.append(i)
+                    yield str(i), [str(i)]
+            return "", samples()
+
+        bench = make_echo_bench(self, name, slot_fn=stream_slot)
+        seen = []
+
+        def generation(messages):
+            seen.append(len(produced))
+            return list(messages)
+
+        manager = BenchManager({bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter}})
+        self.assertDictEqual(manager.run(stream_chunk_size=100), {name: {"accuracy": 1.0}})
+        # the dataset is read chunk by chunk, not ahead of the generation
+        self.assertListEqual(seen, [100, 100, 200, 200, 250])
+        # a streaming slot works in the normal mode too
+        self.assertDictEqual(manager.run(), {name: {"accuracy": 1.0}})
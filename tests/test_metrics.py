@@ -0,0 +1,335 @@
+import os
+import json
+import pickle
+import random
+from collections import Counter
+from unittest import TestCase, mock
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker.evals.metrics import f1_score_exact_match, calc_accuracy, \
+    F1ExactMatchAccumulator, AccuracyAccumulator, BleuAccumulator, RougeAccumulator, _tokenize_13a, \
+    extract_choices, calc_mc_accuracy, MultipleChoiceAccumulator, calc_bleu, calc_rouge, normalize_answer, \
+    _f1_score, _exact_match_score, _metric_max_over_ground_truths
+from llm_benchmarker.evals import registry
+from llm_benchmarker.evals.multiling import FarsiBench
+from llm_benchmarker.evals.lang import MMLUBench
+
+BLEU_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bleu_baseline.json")
+
+WORDS = ["the", "cat", "sat", "on", "a", "mat", "dog", "ran", "away", "fast", ".", ",", "کتاب", "خانه", "در"]
+
+
+def random_corpus(size, seed=0):
+    rnd = random.Random(seed)
+    sentence = lambda: " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 15)))
+    targets = [[sentence() for _ in range(rnd.randint(1, 3))] for _ in range(size)]
+    predictions = [rnd.choice([t[0], sentence()]) for t in targets]
+    return predictions, targets
+
+
+def accumulate(factory, predictions, targets, shards=1):
+    states = []
+    step = max(1, len(predictions) // shards)
+    for start in range(0, len(predictions), step):
+        state = factory()
+        state.update(predictions[start:start + step], targets[start:start + step])
+        states.append(pickle.loads(pickle.dumps(state)))
+    merged = states[0]
+    for state in states[1:]:
+        merged.merge(state)
+    return merged.finalize()
+
+
+class TestMetricAccumulators(TestCase):
+
+    def setUp(self):
+        self.predictions, self.targets = random_corpus(200)
+
+    def test_merged_shards_equal_whole(self):
+        for factory in [F1ExactMatchAccumulator, AccuracyAccumulator, BleuAccumulator, RougeAccumulator]:
+            whole = accumulate(factory, self.predictions, self.targets)
+            sharded = accumulate(factory, self.predictions, self.targets, shards=7)
+            for key, value in whole.items():
+                if isinstance(value, list):
+                    for a, b in zip(value, sharded[key]):
+                        self.assertAlmostEqual(a, b)
+                else:
+                    self.assertAlmostEqual(value, sharded[key], msg=f"{factory.__name__}.{key}")
+
+    def test_same_as_calc_functions(self):
+        self.assertDictEqual(accumulate(F1ExactMatchAccumulator, self.predictions, self.targets),
+                             f1_score_exact_match(self.predictions, self.targets))
+        self.assertDictEqual(accumulate(AccuracyAccumulator, self.predictions, self.targets),
+                             calc_accuracy(self.predictions, self.targets))
+
+    def test_bleu_matches_nltk(self):
+        from nltk.translate.bleu_score import corpus_bleu
+        # nltk takes the closest reference length and evaluate the shortest one, with one reference they're equal.
+        # nltk also counts at least one possible n-gram for the too short predictions, so they are skipped
+        pairs = [(p, [t[0]]) for p, t in zip(self.predictions, self.targets) if len(_tokenize_13a(p)) >= 4]
+        predictions = [p for p, _ in pairs]
+        targets = [t for _, t in pairs]
+        expected = corpus_bleu([[_tokenize_13a(t[0])] for t in targets], [_tokenize_13a(p) for p in predictions])
+        self.assertAlmostEqual(accumulate(BleuAccumulator, predictions, targets)["bleu"], expected)
+
+    def test_bench_accumulator_filters_invalid(self):
+        bench = FarsiBench()
+        accumulator = bench.accumulator()
+        accumulator.update(["", None], [["x"], ["y"]])
+        self.assertIn("error_validation", accumulator.finalize()["PersianQA"])
+        accumulator.update(self.predictions[:10], self.targets[:10])
+        results = accumulator.finalize()["PersianQA"]
+        self.assertIn("bleu", results)
+        self.assertIn("rougeLsum", results)
+        self.assertAlmostEqual(results["f1_score"], f1_score_exact_match(self.predictions[:10],
+                                                                         self.targets[:10])["f1_score"])
+        mmlu = MMLUBench().accumulator()
+        mmlu.update(["1", "2"], [[0], [3]])
+        self.assertDictEqual(mmlu.finalize(), {"MMLU": {"accuracy": 0.5}})
+
+
+def reference_bleu_statistics(predictions, targets, max_order=4):
+    """The n-gram counting of ``evaluate``'s BLEU with ``Counter``s of token tuples"""
+    def ngrams(tokens):
+        return Counter(tokens[ix:ix + order] for order in range(1, max_order + 1)
+                       for ix in range(len(tokens) - order + 1))
+
+    matches, possible, translation_length, reference_length = [0] * max_order, [0] * max_order, 0, 0
+    for references, prediction in zip(targets, predictions):
+        reference_tokens = [_tokenize_13a(reference) for reference in references]
+        translation = _tokenize_13a(prediction)
+        reference_length += min(len(r) for r in reference_tokens)
+        translation_length += len(translation)
+        merged = Counter()
+        for reference in reference_tokens:
+            merged |= ngrams(reference)
+        for ngram, count in (ngrams(translation) & merged).items():
+            matches[len(ngram) - 1] += count
+        for order in range(1, max_order + 1):
+            possible[order - 1] += max(0, len(translation) - order + 1)
+    return matches, possible, translation_length, reference_length
+
+
+class TestFastBleu(TestCase):
+
+    def assert_parity(self, predictions, targets):
+        accumulator = BleuAccumulator()
+        accumulator.update(predictions, targets)
+        self.assertEqual((accumulator.matches_by_order, accumulator.possible_matches_by_order,
+                          accumulator.translation_length, accumulator.reference_length),
+                         reference_bleu_statistics(predictions, targets))
+
+    def test_parity_with_reference_counting(self):
+        for seed in range(20):
+            predictions, targets = random_corpus(50, seed=seed)
+            self.assert_parity(predictions, targets)
+        self.assert_parity(["", "the cat", "۱۲-۳ 12-3, 1.5 a.b"], [["", "x"], ["the cat the cat"], ["12 - 3 , 1.5"]])
+
+    def test_parity_when_codes_are_renumbered(self):
+        predictions, targets = random_corpus(50, seed=3)
+        with mock.patch("llm_benchmarker.evals.metrics._MAX_NGRAM_KEY", 16):
+            self.assert_parity(predictions, targets)
+
+    def test_golden_values_of_evaluate(self):
+        # the output of the ``bleu`` metric of ``evaluate`` that ``calc_bleu`` used before, with and without smoothing
+        with open(BLEU_BASELINE_PATH, encoding="utf-8") as f:
+            cases = json.load(f)
+        for case in cases:
+            for key, smooth in (("bleu", False), ("bleu_smooth", True)):
+                accumulator = BleuAccumulator(smooth=smooth)
+                accumulator.update(case["predictions"], case["targets"])
+                result, expected = accumulator.finalize(), case[key]
+                with self.subTest(case=case["name"], smooth=smooth):
+                    self.assertListEqual(sorted(result), sorted(expected))
+                    self.assertEqual(result["translation_length"], expected["translation_length"])
+                    self.assertEqual(result["reference_length"], expected["reference_length"])
+                    for name in ("bleu", "brevity_penalty", "length_ratio"):
+                        self.assertAlmostEqual(result[name], expected[name], places=12)
+                    self.assertEqual(len(result["precisions"]), len(expected["precisions"]))
+                    for precision, expected_precision in zip(result["precisions"], expected["precisions"]):
+                        self.assertAlmostEqual(precision, expected_precision, places=12)
+        self.assertAlmostEqual(calc_bleu(cases[0]["predictions"], cases[0]["targets"])["bleu"],
+                               cases[0]["bleu"]["bleu"], places=12)
+
+    def test_same_fields_as_evaluate(self):
+        predictions, targets = random_corpus(50)
+        self.assertListEqual(sorted(calc_bleu(predictions, targets)),
+                             ["bleu", "brevity_penalty", "length_ratio", "precisions", "reference_length",
+                              "translation_length"])
+
+    def test_tokenizer_matches_sacrebleu(self):
+        try:
+            from sacrebleu.tokenizers.tokenizer_13a import Tokenizer13a
+        except ImportError:
+            self.skipTest("sacrebleu is not installed")
+        tokenizer = Tokenizer13a()
+        rnd = random.Random(0)
+        chars = list("ab 1.2,-\n{}|~[]^_`!\"#$%&()*+:;<=>?@/'کتاب۱۲") + ["&quot;", "&amp;", "<skipped>", "-\n"]
+        for _ in range(2000):
+            line = "".join(rnd.choice(chars) for _ in range(rnd.randint(0, 30)))
+            self.assertListEqual(list(_tokenize_13a(line)), tokenizer(line).split(), repr(line))
+
+
+class TestFastRouge(TestCase):
+
+    def test_parity_with_rouge_score(self):
+        try:
+            from rouge_score import rouge_scorer
+        except ImportError:
+            self.skipTest("rouge_score is not installed")
+        scorer = rouge_scorer.RougeScorer(list(RougeAccumulator.ROUGE_TYPES))
+        rnd = random.Random(0)
+        words = WORDS + ["\n", "The", "CAT!", "mat."]
+        for _ in range(50):
+            sentence = lambda: " ".join(rnd.choice(words) for _ in range(rnd.randint(0, 25)))
+            targets = [[sentence() for _ in range(rnd.randint(1, 3))] for _ in range(10)]
+            predictions = [rnd.choice([t[0], sentence()]) for t in targets]
+            expected = {rouge_type: sum(scorer.score_multi(t, p)[rouge_type].fmeasure
+                                        for p, t in zip(predictions, targets)) / len(predictions)
+                        for rouge_type in RougeAccumulator.ROUGE_TYPES}
+            results = calc_rouge(predictions, targets)
+            for rouge_type, value in expected.items():
+                self.assertAlmostEqual(results[rouge_type], value, places=12, msg=rouge_type)
+
+    def test_lcs_of_long_predictions(self):
+        # the LCS of "a b" with a long prediction that has them in reverse order is 1
+        prediction = " ".join(["b"] * 500 + ["a"] * 500)
+        results = calc_rouge([prediction], [["a b", "b"]])
+        self.assertAlmostEqual(results["rougeL"], max(2 * (1 / 1000) * (1 / 2) / (1 / 1000 + 1 / 2),
+                                                      2 * (1 / 1000) * 1 / (1 / 1000 + 1)))
+
+    def test_processes_give_the_same_scores(self):
+        predictions, targets = random_corpus(40)
+        sharded = calc_rouge(predictions, targets, num_workers=2)
+        for rouge_type, value in calc_rouge(predictions, targets).items():
+            self.assertAlmostEqual(sharded[rouge_type], value)
+
+
+class TestTokenF1ExactMatch(TestCase):
+
+    def test_normalize_answer(self):
+        self.assertEqual(normalize_answer("كتاب‌هاي «علمي»، ۱۲ و ٣"), "کتاب های علمی 12 و 3")
+        self.assertEqual(normalize_answer("  The   Cat's mat!  "), "the cats mat")
+        self.assertEqual(normalize_answer("خانهٔ مُدرّسة"), "خانه مدرسه")
+        self.assertEqual(normalize_answer("؟!..."), "")
+
+    def test_same_as_squad_loop(self):
+        def squad_f1(prediction, reference):
+            prediction, reference = normalize_answer(prediction).split(), normalize_answer(reference).split()
+            if not prediction or not reference:
+                return float(prediction == reference)
+            common = sum((Counter(prediction) & Counter(reference)).values())
+            if common == 0:
+                return 0.0
+            precision, recall = common / len(prediction), common / len(reference)
+            return 2 * precision * recall / (precision + recall)
+
+        predictions, targets = random_corpus(300, seed=3)
+        predictions[:3] = ["", "؟", "كتاب"]
+        targets[:3] = [[""], ["x", ""], ["کتاب."]]
+        f1 = sum(max(squad_f1(p, r) for r in refs) for p, refs in zip(predictions, targets))
+        em = sum(max(float(normalize_answer(p) == normalize_answer(r)) for r in refs)
+                 for p, refs in zip(predictions, targets))
+        results = f1_score_exact_match(predictions, targets)
+        self.assertAlmostEqual(results["f1_score"], 100 * f1 / len(predictions))
+        self.assertAlmostEqual(results["exact_match"], 100 * em / len(predictions))
+
+    def test_best_reference_counts(self):
+        results = f1_score_exact_match(["تهران", "the cat sat"], [["شهر تهران", "تهران."], ["a cat", "cat sat on"]])
+        self.assertAlmostEqual(results["exact_match"], 50.0)
+        self.assertAlmostEqual(results["f1_score"], 100 * (1 + 2 / 3) / 2)
+
+    def test_char_level_flag(self):
+        predictions, targets = random_corpus(50, seed=4)
+        total = len(predictions)
+        f1 = sum(_metric_max_over_ground_truths(_f1_score, p, t) for p, t in zip(predictions, targets))
+        em = sum(_metric_max_over_ground_truths(_exact_match_score, p, t) for p, t in zip(predictions, targets))
+        self.assertDictEqual(f1_score_exact_match(predictions, targets, char_level=True),
+                             {"f1_score": 100.0 * f1 / total, "exact_match": 100.0 * em / total})
+        with self.assertRaises(ValueError):
+            F1ExactMatchAccumulator().merge(F1ExactMatchAccumulator(char_level=True))
+
+
+class TestMultipleChoice(TestCase):
+
+    def test_extract_choices(self):
+        predictions = ["3", "Answer: 3", "(3)", "(C)", "3. Paris", "10", "2.5", "A good guess is 4", "", None, "D"]
+        self.assertListEqual(extract_choices(predictions).tolist(), [2, 2, 2, 2, 2, -1, -1, 3, -1, -1, 3])
+
+    def test_accuracy_per_subject(self):
+        predictions = ["Answer: 1", "(B)", "4", "nothing", "3"]
+        targets = [[0], [1], [2], [0], ["C"]]
+        subjects = ["math", "math", "law", "law", "law"]
+        results = calc_mc_accuracy(predictions, targets, subjects)
+        self.assertAlmostEqual(results["accuracy"], 0.6)
+        self.assertDictEqual(results["accuracy_per_subject"], {"law": 1 / 3, "math": 1.0})
+        self.assertNotIn("accuracy_per_subject", calc_mc_accuracy(predictions, targets))
+
+        sharded = MultipleChoiceAccumulator()
+        sharded.update(predictions[:2], targets[:2], groups=subjects[:2])
+        rest = MultipleChoiceAccumulator()
+        rest.update(predictions[2:], targets[2:], groups=subjects[2:])
+        self.assertDictEqual(sharded.merge(pickle.loads(pickle.dumps(rest))).finalize(), results)
+
+    def test_mmlu_bench_keeps_subjects_aligned(self):
+        results = MMLUBench().compute(["", "1", "2"], [[0], [0], [3]], groups=["a", "b", "c"])["MMLU"]
+        self.assertEqual(results["accuracy"], 0.5)
+        self.assertDictEqual(results["accuracy_per_subject"], {"b": 1.0, "c": 0.0})
+
+
+class TestMetricRegistry(TestCase):
+
+    def test_metrics_by_name(self):
+        self.assertIn("rouge", registry.warmup())
+        self.assertIs(registry.get_metric("rouge"), calc_rouge)
+        with self.assertRaises(KeyError):
+            registry.get_metric("unknown")
+        with self.assertRaises(KeyError):
+            registry.warmup(["bleu", "unknown"])
+
+    def test_offline_scoring(self):
+        predictions, targets = random_corpus(20)
+        # scoring must not import ``evaluate`` (it loads the metric scripts from the hub)
+        with mock.patch.dict(sys.modules, {"evaluate": None}):
+            results = FarsiBench().compute(predictions, targets)["PersianQA"]
+        self.assertFalse([key for key in results if key.startswith("error")])
+        self.assertAlmostEqual(results["bleu"], accumulate(BleuAccumulator, predictions, targets)["bleu"])
+        self.assertAlmostEqual(results["rougeL"], accumulate(RougeAccumulator, predictions, targets)["rougeL"])
+
+
+class TestParallelScoring(TestCase):
+
+    def assert_results_equal(self, results, expected):
+        self.assertSetEqual(set(results), set(expected))
+        for key, value in expected.items():
+            if isinstance(value, list):
+                for a, b in zip(value, results[key]):
+                    self.assertAlmostEqual(a, b)
+            elif isinstance(value, dict):
+                self.assertDictEqual(results[key], value)
+            else:
+                self.assertAlmostEqual(results[key], value, msg=key)
+
+    def test_same_as_compute(self):
+        predictions, targets = random_corpus(120)
+        predictions[5] = ""
+        bench = FarsiBench()
+        self.assert_results_equal(bench.compute_parallel(predictions, targets, num_workers=3)["PersianQA"],
+                                  bench.compute(predictions, targets)["PersianQA"])
+
+        mmlu = MMLUBench()
+        subjects = [random.Random(ix).choice(["law", "math"]) for ix in range(40)]
+        answers = [str(ix % 4 + 1) for ix in range(40)]
+        choices = [[ix % 3] for ix in range(40)]
+        self.assert_results_equal(mmlu.compute_parallel(answers, choices, num_workers=2, groups=subjects)["MMLU"],
+                                  mmlu.compute(answers, choices, groups=subjects)["MMLU"])
+
+    def test_validation_errors(self):
+        bench = FarsiBench()
+        self.assertIn("error_validation", bench.compute_parallel([], [], num_workers=2)["PersianQA"])
+        self.assertIn("error_validation", bench.compute_parallel(["a"], [], num_workers=2)["PersianQA"])
+        self.assertIn("error_validation", bench.compute_parallel(["", None], [["a"], ["b"]],
+                                                                 num_workers=2)["PersianQA"])
@@ -34,4 +34,26 @@ class TestPersianQA(TestCase):
                 'rouge2': np.float64(0.0),
                 'rougeL': np.float64(0.004608294930875576),
                 'rougeLsum': np.float64(0.004608294930875576)}}
-        self.assertDictEqual(true_evals, result)
\ No newline at end of file
+        self.assertDictEqual(true_evals, result)
+
+class TestPersianQASlot(TestCase):
+    def test_targets_are_answer_texts(self):
+        import json
+        import tempfile
+        from llm_benchmarker.data.readers._multiling import persian_qa_dataset_loader
+
+        squad = {"data": [{"title": "t", "paragraphs": [{"context": "تهران پایتخت ایران است.", "qas": [
+            {"id": "1", "question": "پایتخت ایران کجاست؟",
+             "answers": [{"answer_start": 0, "text": "تهران"}, {"answer_start": 0, "text": "تهران "}]},
+            {"id": "2", "question": "جمعیت آن چقدر است؟", "answers": []},
+        ]}]}]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = f"{tmp_dir}/pqa.json"
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(squad, f, ensure_ascii=False)
+            _, prompts, targets = persian_qa_dataset_loader(path)
+            self.assertEqual(len(prompts), 1)
+            self.assertListEqual(targets, [["تهران", "تهران"]])
+            _, prompts, targets = persian_qa_dataset_loader(path, include_unanswerable=True)
+        self.assertEqual(len(prompts), 2)
+        self.assertListEqual(targets, [["تهران", "تهران"], [""]])
@@ -0,0 +1,79 @@
+import os
+import json
+import tempfile
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker import perf
+from llm_benchmarker.__main__ import main
+from llm_benchmarker.config import DATASETS_PER_BENCH, DATASET_CACHE_DIR_PATH
+from llm_benchmarker.data.readers._multiling import persian_qa_dataset_loader
+from llm_benchmarker.events.handlers import EventHandler
+
+
+class TestPerfSuite(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.report = perf.run_suite(samples=60, repeats=2)
+
+    def test_every_stage_is_measured(self):
+        self.assertListEqual(list(self.report["stages"]), list(perf.STAGES))
+        for stage, result in self.report["stages"].items():
+            self.assertGreater(result["throughput"], 0, stage)
+            self.assertGreaterEqual(result["peak_memory_bytes"], 0, stage)
+            latency = result["latency_ms"]
+            self.assertLessEqual(latency["p50"], latency["p95"])
+            self.assertLessEqual(latency["p95"], latency["max"])
+        # both fixture datasets run end to end, without the 6 unanswerable questions
+        self.assertEqual(self.report["stages"]["bench_manager"]["items"], 114)
+
+    def test_nothing_is_left_registered(self):
+        self.assertNotIn(perf.PERF_QA_KEY, DATASETS_PER_BENCH)
+        self.assertListEqual(EventHandler().get_slots(perf.PERF_MMLU_KEY), [])
+        self.assertListEqual(list(DATASET_CACHE_DIR_PATH.glob(f"{perf.PERF_QA_KEY}-*")), [])
+
+    def test_fixtures_are_deterministic(self):
+        tmp_dir = tempfile.mkdtemp()
+        first = perf.write_persian_qa_fixture(os.path.join(tmp_dir, "a.json"), 30, seed=3)
+        second = perf.write_persian_qa_fixture(os.path.join(tmp_dir, "b.json"), 30, seed=3)
+        self.assertEqual(first.read_text(encoding="utf-8"), second.read_text(encoding="utf-8"))
+        _, prompts, targets = persian_qa_dataset_loader(str(first))
+        self.assertEqual(len(prompts), 27)
+        _, prompts, targets = persian_qa_dataset_loader(str(first), include_unanswerable=True)
+        self.assertEqual(len(prompts), 30)
+        self.assertListEqual(targets[9], [""])
+
+    def test_compare(self):
+        self.assertListEqual(perf.compare(self.report, self.report), [])
+        slower = json.loads(json.dumps(self.report))
+        slower["stages"]["model_pipeline"]["throughput"] /= 2
+        slower["stages"]["metric.bleu"]["peak_memory_bytes"] += 10 * perf.MIN_MEMORY_CHANGE
+        regressions = perf.compare(slower, self.report, threshold=0.2)
+        self.assertListEqual([(r.stage, r.measure) for r in regressions],
+                             [("model_pipeline", "throughput"), ("metric.bleu", "peak_memory_bytes")])
+        self.assertAlmostEqual(regressions[0].change, -0.5)
+        # a looser threshold allows it
+        self.assertListEqual(perf.compare(slower, self.report, threshold=100), [])
+
+
+class TestPerfCommand(TestCase):
+
+    def test_baseline_round_trip(self):
+        baseline = os.path.join(tempfile.mkdtemp(), "perf.json")
+        args = ["perf", "--samples", "40", "--repeats", "1", "--stage", "model_pipeline", "--stage", "metric.bleu"]
+        self.assertEqual(main([*args, "--output", baseline]), 0)
+        self.assertSetEqual(set(perf.load_report(baseline)["stages"]), {"model_pipeline", "metric.bleu"})
+        self.assertEqual(main([*args, "--baseline", baseline, "--threshold", "1000"]), 0)
+
+        report = perf.load_report(baseline)
+        report["stages"]["model_pipeline"]["throughput"] *= 1000
+        perf.save_report(report, baseline)
+        self.assertEqual(main([*args, "--baseline", baseline]), 1)
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            perf.run_suite(samples=10, repeats=1, stages=["model"])
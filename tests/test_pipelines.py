@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import time
+import asyncio
+import tempfile
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker.pipelines import ModelPipeline
+from llm_benchmarker.batching import AdaptiveBatchSizer
+
+
+def formatter(system_prompt, usr_prompt):
+    return usr_prompt
+
+
+class TestModelPipeline(TestCase):
+
+    def test_sync_batches_keep_order(self):
+        calls = []
+
+        def generation(messages):
+            calls.append(len(messages))
+            return [m.upper() for m in messages]
+
+        prompts = [f"p{i}" for i in range(100)]
+        outputs = ModelPipeline(generation, formatter)("", prompts, 50)
+        self.assertListEqual(outputs, [p.upper() for p in prompts])
+        self.assertListEqual(calls, [50, 50])
+
+    def test_async_batches_keep_order_and_limit_concurrency(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def generation(messages):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            # later batches finish first, the pipeline must still return them in prompt order
+            await asyncio.sleep(0.01 / (1 + int(messages[0][1:])))
+            in_flight -= 1
+            return [m.upper() for m in messages]
+
+        prompts = [f"p{i}" for i in range(95)]
+        pipe = ModelPipeline(generation, formatter, max_concurrency=3)
+        outputs = pipe("", prompts, 10)
+        self.assertListEqual(outputs, [p.upper() for p in prompts])
+        self.assertEqual(max_in_flight, 3)
+
+    def test_async_inside_running_loop(self):
+        async def generation(messages):
+            return messages
+
+        async def main():
+            return ModelPipeline(generation, formatter, max_concurrency=2)("", ["a", "b", "c"], 2)
+
+        self.assertListEqual(asyncio.run(main()), ["a", "b", "c"])
+
+
+class TestAdaptiveBatchSize(TestCase):
+
+    def setUp(self):
+        self.store = os.path.join(tempfile.mkdtemp(), "batch_sizes.json")
+
+    def test_oom_bisects_and_remembers_size(self):
+        calls = []
+
+        def generation(messages):
+            calls.append(len(messages))
+            if len(messages) > 16:
+                raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+            return list(messages)
+
+        prompts = [str(i) for i in range(200)]
+        pipe = ModelPipeline(generation, formatter, batch_size=50, adaptive_batch_size=True,
+                             batch_size_store=self.store)
+        self.assertListEqual(pipe("", prompts, key="bench"), prompts)
+        with open(self.store) as f:
+            saved = json.load(f)["bench"]
+        self.assertLessEqual(saved, 16)
+        self.assertTrue(all(size <= 50 for size in calls))
+
+        calls.clear()
+        self.assertListEqual(pipe("", prompts, key="bench"), prompts)
+        self.assertLessEqual(calls[0], 16)
+
+    def test_grows_while_latency_per_item_improves(self):
+        calls = []
+
+        def generation(messages):
+            calls.append(len(messages))
+            # a fixed cost per call, so bigger batches are faster per item until 64
+            time.sleep(0.002 + 0.0001 * max(0, len(messages) - 64))
+            return list(messages)
+
+        prompts = [str(i) for i in range(1000)]
+        pipe = ModelPipeline(generation, formatter, batch_size=4, adaptive_batch_size=True,
+                             batch_size_store=self.store)
+        self.assertListEqual(pipe("", prompts, key="bench"), prompts)
+        self.assertEqual(calls[:3], [4, 8, 16])
+        self.assertGreaterEqual(max(calls), 64)
+
+    def test_number_of_ooms_is_bounded(self):
+        for limit, initial in [(60, 50), (60, 4), (1000, 50), (17, 1), (3, 50)]:
+            sizer = AdaptiveBatchSizer(initial=initial)
+            ooms, sizes = 0, []
+
+            def run(size):
+                # like ModelPipeline._run_bisect on a device that fits ``limit`` prompts, the latency is linear
+                nonlocal ooms
+                if size > limit:
+                    ooms += 1
+                    sizer.failed(size)
+                    done = 0
+                    while done < size:
+                        step = min(max(1, min(sizer.size, size // 2)), size - done)
+                        run(step)
+                        done += step
+                else:
+                    sizer.succeeded(size, 0.01 * size)
+
+            for _ in range(40):
+                sizes.append(sizer.size)
+                run(sizer.size)
+            with self.subTest(limit=limit, initial=initial):
+                # the range between the largest success and the smallest failure is bisected
+                self.assertLessEqual(ooms, math.ceil(math.log2(max(limit, initial))) + 2)
+                self.assertEqual(sizes[-1], limit)
+                self.assertTrue(sizer._settled)
+                if initial <= limit:
+                    self.assertGreaterEqual(min(sizes), initial)
+
+    def test_other_errors_are_raised(self):
+        def generation(messages):
+            raise ValueError("bad request")
+
+        pipe = ModelPipeline(generation, formatter, adaptive_batch_size=True, batch_size_store=None)
+        with self.assertRaises(ValueError):
+            pipe("", ["a", "b"])
+
+
+class TestLengthScheduling(TestCase):
+
+    def test_sorted_batches_are_scattered_back(self):
+        batches = []
+
+        def generation(messages):
+            batches.append(list(messages))
+            return [m[::-1] for m in messages]
+
+        prompts = ["x" * n for n in [3, 40, 1, 25, 7, 40, 2]]
+        pipe = ModelPipeline(generation, formatter, batch_size=3, sort_by_length=True)
+        self.assertListEqual(pipe("", prompts), [p[::-1] for p in prompts])
+        self.assertListEqual([len(m) for m in batches[0]], [40, 40, 25])
+
+    def test_token_budget(self):
+        batches = []
+
+        def generation(messages):
+            batches.append([len(m.split()) for m in messages])
+            return list(messages)
+
+        prompts = [" ".join(["w"] * n) for n in [10, 90, 20, 30, 10, 200, 10]]
+        pipe = ModelPipeline(generation, formatter, batch_size=100, max_batch_tokens=100,
+                             length_func=lambda p: len(p.split()))
+        self.assertListEqual(pipe("", prompts), prompts)
+        self.assertListEqual(batches, [[200], [90], [30, 20, 10], [10, 10]])
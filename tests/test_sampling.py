@@ -0,0 +1,85 @@
+from collections import Counter
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker.sampling import SamplingConfig, EarlyStopping, wilson_interval, add_confidence_intervals
+
+
+class TestStratifiedSampling(TestCase):
+
+    def setUp(self):
+        self.groups = ["math"] * 1000 + ["law"] * 100 + ["virology"] * 3
+
+    def test_every_group_is_represented(self):
+        indices = SamplingConfig(fraction=0.05).indices(len(self.groups), self.groups)
+        self.assertListEqual(indices, sorted(set(indices)))
+        self.assertDictEqual(Counter(self.groups[ix] for ix in indices), {"math": 50, "law": 5, "virology": 1})
+
+    def test_deterministic_and_seeded(self):
+        config = SamplingConfig(size=40, seed=7)
+        self.assertListEqual(config.indices(len(self.groups), self.groups),
+                             SamplingConfig(size=40, seed=7).indices(len(self.groups), self.groups))
+        self.assertNotEqual(config.indices(len(self.groups), self.groups),
+                            SamplingConfig(size=40, seed=8).indices(len(self.groups), self.groups))
+        self.assertEqual(len(config.indices(len(self.groups))), 40)
+
+    def test_bounds(self):
+        self.assertEqual(len(SamplingConfig(size=5000).indices(10)), 10)
+        with self.assertRaises(ValueError):
+            SamplingConfig()
+        with self.assertRaises(ValueError):
+            SamplingConfig(fraction=0.1, size=10)
+        with self.assertRaises(ValueError):
+            SamplingConfig(fraction=1.5)
+
+
+class TestConfidenceIntervals(TestCase):
+
+    def test_wilson_interval(self):
+        low, high = wilson_interval(0.5, 100)
+        self.assertAlmostEqual(low, 0.4038, places=4)
+        self.assertAlmostEqual(high, 0.5962, places=4)
+        low, high = wilson_interval(1.0, 20)
+        self.assertLess(low, 1.0)
+        self.assertEqual(high, 1.0)
+        # a sample that covers most of the dataset is more certain, the whole dataset is exact
+        self.assertLess(low, wilson_interval(1.0, 20, population_size=25)[0])
+        self.assertGreater(wilson_interval(0.5, 100, population_size=120)[0], 0.4038)
+        self.assertEqual(wilson_interval(0.3, 50, population_size=50), (0.3, 0.3))
+
+    def test_add_confidence_intervals(self):
+        metrics = add_confidence_intervals({"f1_score": 50.0, "bleu": 0.3, "accuracy_per_subject": {"a": 1.0}},
+                                           {"f1_score": 100.0, "accuracy": 1.0}, 100, 10_000)
+        self.assertEqual(metrics["sample_size"], 100)
+        self.assertEqual(metrics["population_size"], 10_000)
+        self.assertAlmostEqual(metrics["f1_score_ci"][0], 40.4, places=0)
+        self.assertNotIn("bleu_ci", metrics)
+        self.assertNotIn("accuracy_ci", metrics)
+
+
+class TestEarlyStopping(TestCase):
+
+    def test_stop_reason(self):
+        stopping = EarlyStopping("accuracy", precision=0.05, min_samples=50)
+        self.assertIsNone(stopping.stop_reason(0.5, 1.0, 40, 10_000))
+        self.assertIsNone(stopping.stop_reason(0.5, 1.0, 200, 10_000))
+        self.assertEqual(stopping.stop_reason(0.5, 1.0, 400, 10_000), "precision")
+        # percent metrics are compared in their own unit
+        self.assertEqual(EarlyStopping("f1_score", precision=5).stop_reason(50, 100.0, 400, 10_000), "precision")
+
+        stopping = EarlyStopping("accuracy", baseline=0.6, min_samples=50)
+        self.assertEqual(stopping.stop_reason(0.8, 1.0, 100, 10_000), "baseline")
+        self.assertIsNone(stopping.stop_reason(0.65, 1.0, 100, 10_000))
+        report = stopping.report({"accuracy": 0.4}, 1.0, 100, 10_000, "baseline")
+        self.assertDictEqual(report, {"accuracy": 0.4, "stopped_early": True, "stop_reason": "baseline",
+                                      "better_than_baseline": False})
+
+    def test_order_is_seeded(self):
+        self.assertListEqual(EarlyStopping("accuracy", precision=0.1).order(100),
+                             EarlyStopping("accuracy", precision=0.1).order(100))
+        self.assertNotEqual(EarlyStopping("accuracy", precision=0.1).order(100), list(range(100)))
+        with self.assertRaises(ValueError):
+            EarlyStopping("accuracy")
@@ -0,0 +1,180 @@
+import os
+import time
+import asyncio
+import tempfile
+import threading
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker import BenchManager
+from llm_benchmarker.config import DATASETS_PER_BENCH, BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, BENCH_CATEGORY_LANG, \
+    GENERATOR_FUNC_KEY, CHAT_TEMPLATE_FUNC
+from llm_benchmarker.evals import ServingBench
+from llm_benchmarker.evals.base import BaseBench, BenchmarkResults
+from llm_benchmarker.evals.metrics import calc_accuracy
+from llm_benchmarker.events.handlers import EventHandler
+from llm_benchmarker.pipelines import ModelPipeline
+
+FIXTURE_DIR = tempfile.mkdtemp()
+
+
+class StreamingHandler(BaseHTTPRequestHandler):
+    """A mock inference server, it streams the first ``tokens`` words of the prompt as chunks after ``ttft`` seconds,
+    one every ``itl`` seconds"""
+    protocol_version = "HTTP/1.1"
+    ttft = 0.03
+    itl = 0.01
+    tokens = 5
+
+    def do_POST(self):
+        words = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8").split()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.ttft)
+        for ix in range(self.tokens):
+            if ix:
+                time.sleep(self.itl)
+            data = (words[ix % len(words)] + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class ServingQA(BaseBench):
+    def __init__(self):
+        super().__init__()
+        self.benchmark_name = "ServingQA"
+
+    @classmethod
+    def shared_key(cls):
+        return "ServingQA"
+
+    def compute(self, predictions, targets):
+        result = BenchmarkResults(benchmark_name=self.benchmark_name)
+        result.metrics.update(calc_accuracy(predictions, targets))
+        return result.to_dict()
+
+
+def serving_qa_slot(dataset_path):
+    return "", [f"answer {i} now please" for i in range(6)], [[f"answer {i} now please"] for i in range(6)]
+
+
+DATASETS_PER_BENCH["ServingQA"] = {"backend": BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, "category": BENCH_CATEGORY_LANG,
+                                   "path": "ServingQA", "local_dir": os.path.join(FIXTURE_DIR, "ServingQA"),
+                                   "download_kwargs": {}}
+EventHandler().subscribe("ServingQA", serving_qa_slot)
+
+
+def formatter(system_prompt, prompts):
+    return prompts
+
+
+class TestServingBench(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StreamingHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def stream(self, prompt):
+        conn = http.client.HTTPConnection("127.0.0.1", self.server.server_port, timeout=10)
+        try:
+            conn.request("POST", "/generate", body=prompt.encode("utf-8"))
+            for line in conn.getresponse():
+                yield line.decode("utf-8").strip()
+        finally:
+            conn.close()
+
+    def run_levels(self, bench_type, stream_fn, prompts=("a b c",)):
+        return bench_type().run_generation(ModelPipeline(stream_fn, formatter), "", list(prompts))
+
+    def test_latencies_and_saturation(self):
+        bench = ServingBench.of(ServingQA, concurrency_levels=(1, 4), max_requests=8, warmup_requests=1)
+        metrics = self.run_levels(bench, self.stream)["ServingQA-serving"]
+        single, parallel = metrics["levels"]
+        for level in (single, parallel):
+            self.assertEqual(level["errors"], 0)
+            self.assertEqual(level["tokens_per_request"], 5)
+            self.assertGreaterEqual(level["ttft_ms"]["p50"], 30)
+            self.assertGreaterEqual(level["itl_ms"]["p50"], 10)
+            self.assertGreaterEqual(level["e2e_ms"]["p50"], 70)
+            self.assertLessEqual(level["e2e_ms"]["p50"], level["e2e_ms"]["p99"])
+        self.assertGreater(parallel["output_tokens_per_second"], 2 * single["output_tokens_per_second"])
+        self.assertDictEqual(metrics["saturation_level"], {"concurrency": 4})
+        self.assertEqual(metrics["saturation_throughput"], parallel["output_tokens_per_second"])
+
+    def test_fixed_request_rate(self):
+        bench = ServingBench.of(ServingQA, concurrency_levels=(), request_rates=(40.0,), max_requests=8,
+                                warmup_requests=0)
+        level = self.run_levels(bench, self.stream)["ServingQA-serving"]["levels"][0]
+        self.assertEqual(level["request_rate"], 40.0)
+        self.assertEqual(level["requests"], 8)
+        # the last request starts at 7 / 40 seconds whatever the latency is
+        self.assertGreaterEqual(level["duration_s"], 7 / 40 + 0.07)
+        self.assertLess(level["duration_s"], 8 * 0.07)
+
+    def test_async_stream_and_errors(self):
+        async def stream(prompt):
+            if prompt == "fail":
+                raise ConnectionError("server is gone")
+            await asyncio.sleep(0.01)
+            for token in prompt.split():
+                yield token
+                await asyncio.sleep(0.002)
+
+        bench = ServingBench.of(ServingQA, concurrency_levels=(2,), max_requests=6, warmup_requests=0)
+        level = self.run_levels(bench, stream, ["one two", "fail", "one two three"])["ServingQA-serving"]["levels"][0]
+        self.assertEqual(level["errors"], 2)
+        self.assertEqual(level["tokens_per_request"], 2.5)
+        self.assertGreaterEqual(level["ttft_ms"]["p50"], 10)
+
+    def test_async_stream_inside_a_running_loop(self):
+        async def stream(prompt):
+            for token in prompt.split():
+                yield token
+
+        async def notebook_cell():
+            return self.run_levels(bench, stream, ["one two three"])
+
+        bench = ServingBench.of(ServingQA, concurrency_levels=(2,), max_requests=4, warmup_requests=0)
+        level = asyncio.run(notebook_cell())["ServingQA-serving"]["levels"][0]
+        self.assertEqual(level["errors"], 0)
+        self.assertEqual(level["tokens_per_request"], 3)
+
+    def test_compute_has_no_quality_metrics(self):
+        bench = ServingBench.of(ServingQA)()
+        self.assertDictEqual(bench.compute(["a"], [["a"]])["ServingQA-serving"], {})
+
+    def test_with_bench_manager(self):
+        serving = ServingBench.of(ServingQA, concurrency_levels=(2,), max_requests=4, warmup_requests=0)
+        manager = BenchManager({
+            ServingQA: {GENERATOR_FUNC_KEY: lambda messages: list(messages), CHAT_TEMPLATE_FUNC: formatter},
+            serving: {GENERATOR_FUNC_KEY: self.stream, CHAT_TEMPLATE_FUNC: formatter},
+        })
+        self.assertIsInstance(manager.get_bench_obj_by_btype(serving), serving)
+        results = manager.run(stream_chunk_size=3)
+        self.assertEqual(results["ServingQA"]["accuracy"], 1.0)
+        level = results["ServingQA-serving"]["levels"][0]
+        self.assertEqual(level["requests"], 4)
+        self.assertEqual(level["errors"], 0)
+
+    def test_needs_a_dataset(self):
+        with self.assertRaises(ValueError):
+            ServingBench()
+        with self.assertRaises(ValueError):
+            ServingBench.of(ServingQA, concurrency=4)
@@ -0,0 +1,131 @@
+import os
+import json
+import asyncio
+import tempfile
+import timeit
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker import BenchManager
+from llm_benchmarker.config import DATASETS_PER_BENCH, BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, BENCH_CATEGORY_LANG, \
+    GENERATOR_FUNC_KEY, CHAT_TEMPLATE_FUNC, BATCH_SIZE_KEY
+from llm_benchmarker.evals.multiling import FarsiBench
+from llm_benchmarker.events import timing
+from llm_benchmarker.events.handlers import EventHandler
+from llm_benchmarker.pipelines import ModelPipeline
+
+FIXTURE_DIR = tempfile.mkdtemp()
+
+
+class TimedQA(FarsiBench):
+    def __init__(self):
+        super().__init__()
+        self.benchmark_name = "TimedQA"
+
+    @classmethod
+    def shared_key(cls):
+        return "TimedQA"
+
+
+def timed_qa_slot(dataset_path):
+    prompts = [f"question {i} about the cat" for i in range(45)]
+    return "", prompts, [[f"the cat {i}"] for i in range(45)]
+
+
+DATASETS_PER_BENCH["TimedQA"] = {"backend": BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, "category": BENCH_CATEGORY_LANG,
+                                 "path": "TimedQA", "local_dir": os.path.join(FIXTURE_DIR, "TimedQA"),
+                                 "download_kwargs": {}}
+EventHandler().subscribe("TimedQA", timed_qa_slot)
+
+
+def formatter(system_prompt, prompts):
+    return prompts
+
+
+def echo(messages):
+    return list(messages)
+
+
+class TestTimingEvents(TestCase):
+
+    def run_bench(self):
+        conf = {TimedQA: {GENERATOR_FUNC_KEY: echo, CHAT_TEMPLATE_FUNC: formatter, BATCH_SIZE_KEY: 10}}
+        return BenchManager(conf).run()
+
+    def test_off_without_subscribers(self):
+        self.assertFalse(timing.is_enabled())
+        with timing.span(timing.SPAN_BATCH, "x", prompts=3) as span:
+            self.assertFalse(span)
+        per_call = timeit.timeit(lambda: timing.span(timing.SPAN_BATCH, "x", prompts=3), number=10000) / 10000
+        self.assertLess(per_call, 20e-6)
+
+    def test_summary_of_a_run(self):
+        with timing.TimingSummary() as summary:
+            self.run_bench()
+        self.assertFalse(timing.is_enabled())
+        report = summary.report()["TimedQA"]
+        self.assertTrue({timing.SPAN_BENCHMARK, timing.SPAN_DATASET_LOAD, timing.SPAN_GENERATION, timing.SPAN_FORMAT,
+                         timing.SPAN_BATCH, timing.SPAN_SCORING}.issubset(report["stages"]))
+        self.assertEqual(report["stages"][timing.SPAN_BATCH]["count"], 5)
+        self.assertSetEqual(set(report["metrics"]), {"f1", "bleu", "rouge"})
+        batches = report["batches"]
+        self.assertEqual(batches["count"], 5)
+        self.assertLessEqual(batches["latency_ms"]["p50"], batches["latency_ms"]["p99"])
+        self.assertGreater(batches["prompts_per_second"], 0)
+        self.assertGreater(batches["chars_per_second"], batches["prompts_per_second"])
+        # a stage contains its sub stages
+        self.assertGreaterEqual(report["stages"][timing.SPAN_BENCHMARK]["wall"],
+                                report["stages"][timing.SPAN_GENERATION]["wall"])
+
+    def test_exporters(self):
+        tmp_dir = tempfile.mkdtemp()
+        jsonl_path, trace_path = os.path.join(tmp_dir, "events.jsonl"), os.path.join(tmp_dir, "run.trace.json")
+        with timing.JsonLinesExporter(jsonl_path), timing.ChromeTraceExporter(trace_path):
+            self.run_bench()
+        self.assertListEqual(EventHandler().get_slots(timing.TIMING_EVENT), [])
+        with open(jsonl_path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f]
+        batches = [event for event in events if event["name"] == timing.SPAN_BATCH]
+        self.assertListEqual([event["attrs"]["prompts"] for event in batches], [10, 10, 10, 10, 5])
+        with open(trace_path, encoding="utf-8") as f:
+            trace = json.load(f)["traceEvents"]
+        self.assertEqual(len(trace), len(events))
+        self.assertTrue(all(event["ph"] == "X" and event["dur"] >= 0 for event in trace))
+        self.assertTrue({"f1", "bleu", "rouge"}.issubset({event["name"] for event in trace}))
+
+    def test_failed_and_async_batches(self):
+        def failing(messages):
+            raise RuntimeError("model is down")
+
+        async def async_echo(messages):
+            await asyncio.sleep(0)
+            return list(messages)
+
+        with timing.TimingSummary() as summary:
+            with self.assertRaises(RuntimeError):
+                ModelPipeline(failing, formatter)("", ["a", "b"], key="failing")
+            ModelPipeline(async_echo, formatter, max_concurrency=2, batch_size=2)("", list("abcde"), key="async")
+        errors = [event.attrs.get("error") for event in summary.events if event.name == timing.SPAN_BATCH]
+        self.assertListEqual(errors, ["RuntimeError", None, None, None])
+        self.assertEqual(summary.report()["async"]["batches"]["count"], 3)
+
+    def test_failing_exporter_doesnt_stop_the_run(self):
+        def failing_exporter(event):
+            raise OSError("No space left on device")
+
+        EventHandler().subscribe(timing.TIMING_EVENT, failing_exporter)
+        try:
+            with timing.TimingSummary() as summary:
+                self.assertIn("TimedQA", self.run_bench())
+                # the exception of the block is raised, not the one of the exporter
+                with self.assertRaises(KeyError):
+                    with timing.span(timing.SPAN_BATCH, "failing"):
+                        raise KeyError("from the block")
+        finally:
+            EventHandler().unsubscribe(timing.TIMING_EVENT, failing_exporter)
+        # the exporters after the failing one get every event
+        self.assertEqual(summary.report()["TimedQA"]["batches"]["count"], 5)
+        self.assertEqual(summary.report()["failing"]["batches"]["count"], 1)
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 import unittest
 
 from pathlib import Path
@@ -7,7 +8,9 @@ from pathlib import Path
 sys.path.append("/benchmarker")
 
 from llm_benchmarker.utils import load_from_github, \
-    github_url_to_raw_github_url, load_from_hf
+    github_url_to_raw_github_url, load_from_hf, slot_manifest, load_slots, _module_name, \
+    _SLOT_MODULES
+from llm_benchmarker.events.handlers import EventHandler
 
 
 class TestDownloadFromUrl(unittest.TestCase):
@@ -53,3 +56,83 @@ class TestDownloadFromUrl(unittest.TestCase):
         destination = os.path.join(base_path, Path("mmlu"))
         self.assertTrue(load_from_hf("cais/mmlu", destination, name='all'))
         self.assertTrue(os.path.isdir(destination))
+
+
+class TestSlotRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.write("readers_a.py", """
+from llm_benchmarker.events.decorators import slot
+from llm_benchmarker.config import BENCHMARK_NAME_MMLU as MMLU_KEY
+
+IMPORTS = globals().get("IMPORTS", 0) + 1
+KEY = "SlotRegistryA"
+
+@slot(KEY)
+def load_a(dataset_path):
+    return "", ["a"], [["a"]]
+
+@slot(MMLU_KEY)
+def load_mmlu_like(dataset_path):
+    return "", ["m"], [["m"]]
+""")
+        self.write("readers_b.py", """
+from llm_benchmarker.events.decorators import slot
+
+@slot("SlotRegistryB")
+def load_b(dataset_path):
+    return "", ["b"], [["b"]]
+""")
+        self.write("helpers.py", "raise RuntimeError('modules without slots are never imported')\n")
+        for name in ("readers_a.py", "readers_b.py"):
+            self.addCleanup(EventHandler().unsubscribe_module, _module_name(os.path.join(self.tmp_dir.name, name)))
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp_dir.name, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def test_manifest_without_import(self):
+        manifest = slot_manifest([self.tmp_dir.name])
+        self.assertSetEqual(set(manifest), {"SlotRegistryA", "MMLU", "SlotRegistryB"})
+        self.assertListEqual([e.function for e in manifest["SlotRegistryA"]], ["load_a"])
+        self.assertNotIn(_module_name(os.path.join(self.tmp_dir.name, "readers_a.py")), sys.modules)
+
+    def test_only_requested_readers_are_imported_once(self):
+        for _ in range(3):
+            load_slots([self.tmp_dir.name], ["SlotRegistryB"])
+        handler = EventHandler()
+        self.assertEqual(len(handler.get_slots("SlotRegistryB")), 1)
+        self.assertListEqual(handler.get_slots("SlotRegistryA"), [])
+        self.assertDictEqual(handler.emit("SlotRegistryB", "path"), {"SlotRegistryB": ("", ["b"], [["b"]])})
+
+        load_slots([self.tmp_dir.name], ["SlotRegistryA"])
+        load_slots([self.tmp_dir.name])
+        module = sys.modules[_module_name(os.path.join(self.tmp_dir.name, "readers_a.py"))]
+        self.assertEqual(module.IMPORTS, 1)
+        self.assertEqual(len(handler.get_slots("SlotRegistryA")), 1)
+
+    def test_distinct_slots_coexist(self):
+        handler = EventHandler()
+
+        def make_slot(value):
+            def slot_fn(dataset_path):
+                return value
+            return slot_fn
+
+        slots = [make_slot(value) for value in range(3)]
+        for slot_fn in slots + slots:
+            handler.subscribe("SlotRegistryClosures", slot_fn)
+        self.assertListEqual(handler.get_slots("SlotRegistryClosures"), slots)
+
+    def test_executed_again_replaces_its_slots(self):
+        load_slots([self.tmp_dir.name], ["SlotRegistryB"])
+        file_path = str(Path(self.tmp_dir.name, "readers_b.py").resolve())
+        # e.g. a reader module that is reloaded in a long-running process
+        del sys.modules[_module_name(file_path)]
+        del _SLOT_MODULES[file_path]
+        load_slots([self.tmp_dir.name], ["SlotRegistryB"])
+        slots = EventHandler().get_slots("SlotRegistryB")
+        self.assertEqual(len(slots), 1)
+        self.assertIs(slots[0].__globals__, vars(sys.modules[_module_name(file_path)]))
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import textwrap
+import subprocess
+from pathlib import Path
+from unittest import TestCase
+
+import sys
+
+sys.path.append("/benchmarker")
+
+from llm_benchmarker.workqueue import WorkQueue, Heartbeat, SHARD_DONE
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+
+# a model configuration that the workers import, two benchmarks: one with metric accumulators and one that keeps
+# the predictions (BufferedBenchAccumulator)
+CONF_MODULE = textwrap.dedent('''
+    import os
+    import time
+
+    from llm_benchmarker.config import DATASETS_PER_BENCH, BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, BENCH_CATEGORY_LANG, \\
+        GENERATOR_FUNC_KEY, CHAT_TEMPLATE_FUNC, BATCH_SIZE_KEY
+    from llm_benchmarker.evals.base import BaseBench, BenchmarkResults
+    from llm_benchmarker.evals.multiling import FarsiBench
+    from llm_benchmarker.evals.metrics import calc_accuracy
+    from llm_benchmarker.events.handlers import EventHandler
+
+    WORDS = ["کتاب", "خانه", "در", "the", "cat", "sat", "on", "mat"]
+
+
+    def register(name):
+        DATASETS_PER_BENCH[name] = {"backend": BACKEND_CUSTOM_NO_DIRECT_DOWNLOAD, "category": BENCH_CATEGORY_LANG,
+                                    "path": name, "local_dir": os.path.join(os.path.dirname(__file__), name),
+                                    "download_kwargs": {}}
+
+
+    def qa_slot(dataset_path):
+        prompts = [" ".join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(1 + i % 6)) for i in range(180)]
+        targets = [[p if i % 3 else p.split()[0]] for i, p in enumerate(prompts)]
+        return "", prompts, targets
+
+
+    def echo_slot(dataset_path):
+        return "", [str(i) for i in range(130)], [[str(i)] for i in range(130)]
+
+
+    class ShardQA(FarsiBench):
+        @classmethod
+        def shared_key(cls):
+            return "ShardQA"
+
+
+    class ShardEcho(BaseBench):
+        def __init__(self):
+            super().__init__()
+            self.benchmark_name = "ShardEcho"
+
+        @classmethod
+        def shared_key(cls):
+            return "ShardEcho"
+
+        def compute(self, predictions, targets):
+            result = BenchmarkResults(benchmark_name=self.benchmark_name)
+            result.metrics.update(calc_accuracy(predictions, targets))
+            return result.to_dict()
+
+
+    register("ShardQA")
+    register("ShardEcho")
+    EventHandler().subscribe("ShardQA", qa_slot)
+    EventHandler().subscribe("ShardEcho", echo_slot)
+
+
+    def generation(messages):
+        time.sleep(0.05)
+        return [m if int(m) % 4 else "wrong" for m in messages] if messages and messages[0].isdigit() else messages
+
+
+    def formatter(system_prompt, prompts):
+        return prompts
+
+
+    conf = {bench: {GENERATOR_FUNC_KEY: generation, CHAT_TEMPLATE_FUNC: formatter, BATCH_SIZE_KEY: 10}
+            for bench in (ShardQA, ShardEcho)}
+''')
+
+
+class TestWorkQueue(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "queue.sqlite")
+        self.queue = WorkQueue(self.path)
+        self.addCleanup(self.queue.close)
+
+    def test_claim_complete(self):
+        self.assertEqual(self.queue.publish("bench", 25, 10, "fp"), 3)
+        claimed = [self.queue.claim("w1") for _ in range(3)]
+        self.assertListEqual([(s.start, s.stop) for s in claimed], [(0, 10), (10, 20), (20, 25)])
+        self.assertIsNone(self.queue.claim("w2"))
+        for shard in claimed:
+            self.assertTrue(self.queue.complete(shard, "w1", f"{shard.shard_id}".encode()))
+        self.assertTrue(self.queue.is_done("bench"))
+        self.assertListEqual(self.queue.states("bench"), [b"0", b"1", b"2"])
+
+        # the same dataset keeps the results, a changed one starts over
+        self.assertEqual(self.queue.publish("bench", 25, 10, "fp"), 3)
+        self.assertTrue(self.queue.is_done("bench"))
+        self.queue.publish("bench", 25, 10, "changed")
+        self.assertEqual(self.queue.progress("bench")["pending"], 3)
+
+    def test_stale_shard_is_taken_over(self):
+        queue = WorkQueue(self.path, stale_after=0.2)
+        self.addCleanup(queue.close)
+        queue.publish("bench", 10, 10, "fp")
+        dead = queue.claim("dead")
+        self.assertIsNone(queue.claim("alive"))
+        time.sleep(0.3)
+        self.assertEqual(queue.progress("bench")["stale"], 1)
+        alive = queue.claim("alive")
+        self.assertEqual(alive.shard_id, dead.shard_id)
+        self.assertFalse(queue.heartbeat(dead, "dead"))
+        # the late result of the dead worker is dropped
+        self.assertFalse(queue.complete(dead, "dead", b"late"))
+        self.assertTrue(queue.complete(alive, "alive", b"fresh"))
+        self.assertListEqual(queue.states("bench"), [b"fresh"])
+
+    def test_empty_benchmark_is_done(self):
+        self.assertFalse(self.queue.is_done("bench"))
+        self.assertEqual(self.queue.publish("bench", 0, 10, "fp"), 0)
+        self.assertEqual(self.queue.num_shards("bench"), 0)
+        self.assertTrue(self.queue.is_done("bench"))
+        self.assertListEqual(self.queue.states("bench"), [])
+
+    def test_heartbeat_thread_keeps_a_long_shard(self):
+        queue = WorkQueue(self.path, stale_after=0.2)
+        self.addCleanup(queue.close)
+        queue.publish("bench", 10, 10, "fp")
+        shard = queue.claim("w1")
+        with Heartbeat(queue, shard, "w1", interval=0.05):
+            # one batch that takes longer than stale_after
+            time.sleep(0.5)
+            self.assertIsNone(queue.claim("w2"))
+        self.assertTrue(queue.complete(shard, "w1", b"state"))
+        self.assertTrue(queue.is_done("bench"))
+
+    def test_release(self):
+        self.queue.publish("bench", 10, 5, "fp")
+        shard = self.queue.claim("w1")
+        self.queue.release(shard, "w1")
+        self.assertEqual(self.queue.claim("w2").shard_id, shard.shard_id)
+
+
+class TestShardedRun(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_dir, "shard_conf.py"), "w", encoding="utf-8") as f:
+            f.write(CONF_MODULE)
+        self.env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(PROJECT_DIR), self.tmp_dir])}
+        self.queue_path = os.path.join(self.tmp_dir, "queue.sqlite")
+
+    def cli(self, *args):
+        return [sys.executable, "-m", "llm_benchmarker", *args, "--queue", self.queue_path, "--conf", "shard_conf:conf"]
+
+    def test_workers_in_processes_match_a_single_run(self):
+        published = json.loads(subprocess.run(self.cli("publish", "--shard-size", "20"), env=self.env, check=True,
+                                              capture_output=True, text=True, cwd=self.tmp_dir).stdout)
+        self.assertDictEqual(published, {"ShardQA": 9, "ShardEcho": 7})
+        workers = [subprocess.Popen(self.cli("worker", "--worker-id", f"node-{ix}", "--poll-interval", "0.1"),
+                                    env=self.env, cwd=self.tmp_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    text=True) for ix in range(3)]
+        completed = [json.loads(worker.communicate(timeout=120)[0])["completed_shards"] for worker in workers]
+        self.assertEqual(sum(completed), 16)
+        with sqlite3.connect(self.queue_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM shards WHERE status = ?", (SHARD_DONE,)).fetchone()[0],
+                             16)
+
+        collected = subprocess.run(self.cli("collect", "--timeout", "10"), env=self.env, check=True,
+                                   capture_output=True, text=True, cwd=self.tmp_dir).stdout
+        single_run = subprocess.run([sys.executable, "-c", "import json, shard_conf; "
+                                     "from llm_benchmarker import BenchManager; "
+                                     "print(json.dumps(BenchManager(shard_conf.conf).run(), default=float))"],
+                                    env=self.env, check=True, capture_output=True, text=True, cwd=self.tmp_dir).stdout
+        collected, single_run = json.loads(collected), json.loads(single_run)
+        self.assertSetEqual(set(collected), {"PersianQA", "ShardEcho"})
+        self.assertAlmostEqual(collected["ShardEcho"]["accuracy"], 0.75, delta=0.01)
+        for name, metrics in single_run.items():
+            for key, value in metrics.items():
+                if isinstance(value, list):
+                    for a, b in zip(value, collected[name][key]):
+                        self.assertAlmostEqual(a, b)
+                else:
+                    self.assertAlmostEqual(value, collected[name][key], msg=f"{name}.{key}")